@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+# This Red Panda Lineage benchmark tool times the slow stages of building and
+# managing the dataset, so we can tell whether a change made them faster.
+
+import argparse
+import build
+import compact
+import configparser
+import contextlib
+import datetime
+import gzip
+import io
+import json
+import manage
+import os
+import platform
+import shutil
+import synthetic
+import tempfile
+import time
+
+from build import RedPandaGraph, list_tree
+from datafile import parse_fields
+from shared import *
+
+SECTIONS = [
+    (MEDIA_PATH, "media"),
+    (PANDA_PATH, "panda"),
+    (WILD_PATH, "wild"),
+    (ZOO_PATH, "zoo")
+]
+
+def best_time(method, rounds):
+    """Run a method several times, and return the fastest time in seconds."""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        method()
+        elapsed = time.perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best
+
+def bench_compact(rounds):
+    """Compare the size and load time of the v1 and v2 export formats."""
+    graph = RedPandaGraph()
+    graph.build_graph()
+    export = graph.export_document()
+    v1 = json.dumps(export, ensure_ascii=False, indent=4, sort_keys=True).encode('utf8')
+    v2 = json.dumps(compact.encode(export), ensure_ascii=False,
+                    separators=(',', ':'), sort_keys=True).encode('utf8')
+    if compact.decode(json.loads(v2.decode('utf8'))) != json.loads(v1.decode('utf8')):
+        raise ValueError("v2 export doesn't decode to the v1 export")
+    v1_load = best_time(lambda: json.loads(v1.decode('utf8')), rounds)
+    v2_load = best_time(lambda: compact.decode(json.loads(v2.decode('utf8'))), rounds)
+    print("Export formats, best of %d rounds:" % rounds)
+    print("  v1: %9d bytes, %8d gzipped, loads in %7.2f ms"
+          % (len(v1), len(gzip.compress(v1)), v1_load * 1000))
+    print("  v2: %9d bytes, %8d gzipped, loads and decodes in %7.2f ms"
+          % (len(v2), len(gzip.compress(v2)), v2_load * 1000))
+
+def load_data_files():
+    """Read every data file into memory, so that disk reads aren't timed."""
+    contents = []
+    for path, section in SECTIONS:
+        for datapath in list_tree(path):
+            with open(datapath, 'r', encoding='utf-8') as rfh:
+                contents.append((datapath, section, rfh.read()))
+    return contents
+
+def bench_parser(rounds):
+    """Compare the datafile parser against configparser on every data file."""
+    contents = load_data_files()
+    def with_configparser():
+        for datapath, section, text in contents:
+            infile = configparser.ConfigParser()
+            infile.read_string(text, source=datapath)
+            infile.items(section)
+    def with_datafile():
+        for datapath, section, text in contents:
+            parse_fields(io.StringIO(text), datapath, section).items()
+    # Both parsers must agree before their speed is worth comparing
+    for datapath, section, text in contents:
+        infile = configparser.ConfigParser()
+        infile.read_string(text, source=datapath)
+        if dict(infile.items(section)) != dict(parse_fields(io.StringIO(text), datapath, section)):
+            raise ValueError("Parsers disagree on %s" % datapath)
+    old = best_time(with_configparser, rounds)
+    new = best_time(with_datafile, rounds)
+    print("Parsed %d files, best of %d rounds:" % (len(contents), rounds))
+    print("  configparser: %8.2f ms (%6.1f us/file)" % (old * 1000, old * 1e6 / len(contents)))
+    print("  datafile:     %8.2f ms (%6.1f us/file)" % (new * 1000, new * 1e6 / len(contents)))
+    print("  speedup:      %8.2fx" % (old / new))
+
+def bench_scale(rounds, sizes, results_path=None):
+    """Time each stage of building and managing synthetic datasets.
+
+    For each size, a synthetic dataset is generated in a temporary folder
+    (see synthetic.py), and each stage is timed on its own: importing each
+    kind of file, each verify_* method, the JSON export, and vitamin(). The
+    build stages are repeated and the best time kept. Then manage.py's
+    author index, author removal, and photo removal with renumbering are
+    timed once each, since they change the files.
+
+    Results can also be written as JSON, to compare against later runs.
+    """
+    results = {}
+    results['date'] = datetime.datetime.now().isoformat()
+    results['python'] = platform.python_version()
+    results['rounds'] = rounds
+    results['sizes'] = []
+    source = os.getcwd()
+    for animals in sizes:
+        root = tempfile.mkdtemp(prefix="redpanda-bench-")
+        try:
+            start = time.perf_counter()
+            synthetic.generate_dataset(root, animals)
+            generated = time.perf_counter() - start
+            # Site files that vitamin() reads
+            for filename in build.VITAMIN_SOURCES:
+                destpath = os.path.join(root, filename)
+                if not os.path.isdir(os.path.dirname(destpath)):
+                    os.makedirs(os.path.dirname(destpath))
+                shutil.copyfile(os.path.join(source, filename), destpath)
+            os.makedirs(os.path.join(root, "export"))
+            os.chdir(root)
+            # Stage output, like export totals, isn't part of the results
+            with contextlib.redirect_stdout(io.StringIO()):
+                timings = time_build_stages(rounds)
+                timings.update(time_manage_stages())
+        finally:
+            os.chdir(source)
+            shutil.rmtree(root)
+        timings['generate'] = generated
+        size = {}
+        size['animals'] = animals
+        size['files'] = timings.pop('files')
+        size['seconds'] = timings
+        results['sizes'].append(size)
+        print("Synthetic dataset of %d pandas (%s files):"
+              % (animals, ", ".join("%d %s" % (size['files'][k], k)
+                                    for k in sorted(size['files']))))
+        for stage in sorted(timings):
+            print("  %-22s %10.2f ms" % (stage, timings[stage] * 1000))
+    if results_path != None:
+        with open(results_path, 'w', encoding='utf-8') as wfh:
+            json.dump(results, wfh, indent=4, sort_keys=True)
+        print("Results written to %s" % results_path)
+    return results
+
+def time_build_stages(rounds):
+    """Best time for each stage of a build in the current folder."""
+    timings = {}
+    def timed(stage, method):
+        start = time.perf_counter()
+        method()
+        elapsed = time.perf_counter() - start
+        if stage not in timings or elapsed < timings[stage]:
+            timings[stage] = elapsed
+    for _ in range(rounds):
+        graph = RedPandaGraph()
+        # Checks are left out of the imports, and timed separately below
+        skip = lambda: None
+        timed("import.zoo", lambda: graph.import_tree(ZOO_PATH, graph.parse_zoo, skip))
+        timed("import.wild", lambda: graph.import_tree(WILD_PATH, graph.parse_wild, skip))
+        timed("import.panda", lambda: graph.import_tree(PANDA_PATH, graph.parse_redpanda, skip))
+        timed("import.media", lambda: graph.import_tree(MEDIA_PATH, graph.parse_media, skip))
+        timed("verify_zoos", graph.verify_zoos)
+        timed("verify_wilds", graph.verify_wilds)
+        timed("verify_pandas", graph.verify_pandas)
+        timed("verify_media", graph.verify_media)
+        timed("export_json_graph", lambda: graph.export_json_graph(OUTPUT_PATH))
+        # vitamin() fills in index.html, so each round needs a fresh copy
+        with open("index.html", 'r', encoding='utf-8') as rfh:
+            page = rfh.read()
+        if os.path.isfile(VITAMIN_CACHE_PATH):
+            os.remove(VITAMIN_CACHE_PATH)
+        timed("vitamin", build.vitamin)
+        with open("index.html", 'w', encoding='utf-8') as wfh:
+            wfh.write(page)
+        # Again, with every file's character set already cached
+        timed("vitamin.cached", build.vitamin)
+        with open("index.html", 'w', encoding='utf-8') as wfh:
+            wfh.write(page)
+    timings['files'] = {}
+    timings['files']['media'] = len(graph.media_files)
+    timings['files']['panda'] = len(graph.panda_files)
+    timings['files']['wild'] = len(graph.wild_files)
+    timings['files']['zoo'] = len(graph.zoo_files)
+    return timings
+
+def time_manage_stages():
+    """Time manage.py's bulk photo edits once, in the current folder."""
+    timings = {}
+    data_paths = [PANDA_PATH, ZOO_PATH, MEDIA_PATH]
+    start = time.perf_counter()
+    index = manage.AuthorIndex(AUTHOR_INDEX_PATH, data_paths)
+    index.refresh()
+    index.save()
+    timings['manage.index_authors'] = time.perf_counter() - start
+    # The generator favors low-numbered authors, so this one has the most photos
+    start = time.perf_counter()
+    manage.remove_author_from_lineage("author_0")
+    timings['manage.remove_author'] = time.perf_counter() - start
+    start = time.perf_counter()
+    for path in list_tree(PANDA_PATH):
+        manage.remove_photo_from_file(path, "1")
+    timings['manage.remove_photo'] = time.perf_counter() - start
+    return timings
+
+if __name__ == '__main__':
+    """Choose a benchmark to run."""
+    parser = argparse.ArgumentParser(description="Benchmark the Red Panda Lineage scripts.")
+    parser.add_argument("--rounds", type=int, default=5,
+                        help="times to repeat each benchmark, keeping the best")
+    parser.add_argument("--animals", type=int, nargs="+", default=[1000], metavar="N",
+                        help="synthetic dataset sizes for the scale benchmark")
+    parser.add_argument("--results", metavar="PATH",
+                        help="write the scale benchmark's timings to a JSON file")
+    parser.add_argument("benchmark", choices=["compact", "parser", "scale"],
+                        help="which benchmark to run")
+    args = parser.parse_args()
+    if args.benchmark == "compact":
+        bench_compact(args.rounds)
+    elif args.benchmark == "parser":
+        bench_parser(args.rounds)
+    elif args.benchmark == "scale":
+        bench_scale(args.rounds, args.animals, args.results)
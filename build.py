@@ -3,14 +3,362 @@
 # This Red Panda Lineage dataset builder takes all source input data and
 # creates a JSON file intended for family tree querying.
 
-import configparser
+import argparse
+import bisect
+import compact
 import datetime
+import hashlib
 import json
+import multiprocessing
 import os
+import photos
+import profiler
+import residency
+import search
+import snapshot
 import sys
+import time
+import validation
 
+from datafile import read_date, read_fields
 from shared import *
 
+# Panda name fields the site shows in every language, whatever the display
+# language is (see Show.nicknames and Show.othernames in js/show.js)
+ALL_LANGUAGE_FIELDS = ["name", "nicknames", "othernames"]
+
+# Vertex fields kept in the core file of a split export, besides names
+CORE_FIELDS = ["_id", "birthday", "death", "flag", "gender",
+               "language.order", "panda.tags", "species"]
+
+# Data folders in the order they're imported, with the kind of entity each
+# holds and the RedPandaGraph method that parses its files
+DATA_TREES = [
+    ("zoo", ZOO_PATH, "parse_zoo"),
+    ("wild", WILD_PATH, "parse_wild"),
+    ("panda", PANDA_PATH, "parse_redpanda"),
+    ("media", MEDIA_PATH, "parse_media")
+]
+
+# Edge labels, stored in each Edge as their position in this list. Any other
+# label found in the data is added to the end when it is first seen.
+EDGE_LABELS = ["birthplace", "family", "litter", "wild", "zoo"]
+
+# Red panda pregnancies last up to about five months
+GESTATION_DAYS = 160
+
+# Site sources whose characters vitamin() gathers for the web font. Fragments
+# in a language's folder only count toward that language's glyphs.
+VITAMIN_SOURCES = [
+    "index.html",
+    "js/pandas.js",
+    "js/show.js",
+    "fragments/en/about.html",
+    "fragments/jp/about.html",
+    "fragments/en/links.html",
+    "fragments/jp/links.html"
+]
+
+# Seconds between scans for changed files in --watch mode
+WATCH_INTERVAL = 0.5
+
+class Edge:
+    """One edge of the graph: a panda, its label, and what it points to.
+
+    Edges are by far the most numerous objects in the graph, so they have
+    slots rather than a dict, share interned id strings with the vertices,
+    and keep their label as an index into EDGE_LABELS. They become the
+    {"_in", "_label", "_out"} dicts of redpanda.json only when exported
+    (see as_dict). Reading them like those dicts, as edge['_in'], still
+    works for scripts written against the exported layout.
+    """
+    __slots__ = ["in_id", "label", "out_id"]
+
+    def __init__(self, out_id, in_id, label):
+        self.in_id = sys.intern(in_id)
+        self.label = label_code(label)
+        self.out_id = sys.intern(out_id)
+
+    def __eq__(self, other):
+        return (isinstance(other, Edge) and self.in_id == other.in_id and
+                self.label == other.label and self.out_id == other.out_id)
+
+    def __getitem__(self, key):
+        if key == '_in':
+            return self.in_id
+        elif key == '_label':
+            return self.label_name()
+        elif key == '_out':
+            return self.out_id
+        raise KeyError(key)
+
+    def __hash__(self):
+        return hash((self.out_id, self.label, self.in_id))
+
+    def __reduce__(self):
+        # Worker processes may number unexpected labels differently, so
+        # edges are pickled with their label's name
+        return (Edge, (self.out_id, self.in_id, self.label_name()))
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def as_dict(self):
+        """The edge in its exported form."""
+        edge = {}
+        edge['_in'] = self.in_id
+        edge['_label'] = self.label_name()
+        edge['_out'] = self.out_id
+        return edge
+
+    def label_name(self):
+        return EDGE_LABELS[self.label]
+
+    @staticmethod
+    def from_dict(edge):
+        """Read back an edge in its exported form."""
+        return Edge(edge['_out'], edge['_in'], edge['_label'])
+
+# Label codes for the edges that the dataset checks look for
+Edge.BIRTHPLACE = EDGE_LABELS.index("birthplace")
+Edge.FAMILY = EDGE_LABELS.index("family")
+Edge.LITTER = EDGE_LABELS.index("litter")
+Edge.WILD = EDGE_LABELS.index("wild")
+Edge.ZOO = EDGE_LABELS.index("zoo")
+
+class EdgeStore:
+    """The graph's edges, indexed by label in both directions.
+
+    Edges are added and removed a file at a time, as the edges one data
+    file produced. For each label, tables point at those edges:
+      - forward: out id -> edges leaving that vertex, like a panda's children
+      - reverse: in id -> edges arriving there, like a zoo's residents
+      - undirected: id -> edges at either end, only for SYMMETRIC_LABELS,
+        like litters, where either panda may list the other
+    Checking for an edge is a dict lookup, and walking a vertex's neighbors
+    only touches its own edges. Iterating over the store gives every edge
+    in the order a full build imports the files, which is the export order.
+    Each label also keeps its own edges from each file, and the files with
+    edges of that label in this order, so listing one label's edges only
+    visits those edges.
+    """
+    SYMMETRIC_LABELS = [Edge.LITTER]
+
+    def __init__(self):
+        self.counts = {}
+        self.file_labels = {}
+        self.files = {}
+        self.forward = {}
+        self.labels = {}
+        self.order = []
+        self.reverse = {}
+        self.size = 0
+        self.undirected = {}
+
+    def __iter__(self):
+        for (_, path) in self.order:
+            for edge in self.files[path][1]:
+                yield edge
+
+    def __len__(self):
+        return self.size
+
+    def add_file(self, path, sort_key, edges):
+        """Add the edges from one data file, sorted into place by sort_key."""
+        if path in self.files:
+            self.remove_file(path)
+        self.file_labels[path] = {}
+        for edge in edges:
+            self.file_labels[path].setdefault(edge.label, []).append(edge)
+            index_edge(self.forward, edge.label, edge.out_id, edge)
+            index_edge(self.reverse, edge.label, edge.in_id, edge)
+            if edge.label in self.SYMMETRIC_LABELS:
+                index_edge(self.undirected, edge.label, edge.out_id, edge)
+                if edge.in_id != edge.out_id:
+                    index_edge(self.undirected, edge.label, edge.in_id, edge)
+            key = (edge.out_id, edge.label, edge.in_id)
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.files[path] = (sort_key, edges)
+        insert_sorted(self.order, (sort_key, path))
+        for label in self.file_labels[path]:
+            insert_sorted(self.labels.setdefault(label, []), (sort_key, path))
+        self.size = self.size + len(edges)
+
+    def between(self, one_id, other_id, label):
+        """Edges with a label between two vertices, in either direction."""
+        found = [e for e in self.forward.get(label, {}).get(one_id, [])
+                 if e.in_id == other_id]
+        if one_id != other_id:
+            found.extend(e for e in self.forward.get(label, {}).get(other_id, [])
+                         if e.in_id == one_id)
+        return found
+
+    def exists(self, out_id, in_id, label):
+        """Whether there's an edge with a label from one vertex to another."""
+        return (out_id, label, in_id) in self.counts
+
+    def incoming(self, vertex_id):
+        """Edges of every label arriving at a vertex."""
+        for label in sorted(self.reverse):
+            for edge in self.reverse[label].get(vertex_id, []):
+                yield edge
+
+    def labelled(self, label):
+        """Every edge with a label, in export order."""
+        for (_, path) in self.labels.get(label, []):
+            for edge in self.file_labels[path][label]:
+                yield edge
+
+    def linked(self, one_id, other_id, label):
+        """Whether two vertices have an edge with a label, in either direction."""
+        return (self.exists(one_id, other_id, label) or
+                self.exists(other_id, one_id, label))
+
+    def neighbors(self, label, vertex_id):
+        """Ids of the vertices at the other end of a vertex's edges, either way."""
+        if label in self.SYMMETRIC_LABELS:
+            edges = self.undirected.get(label, {}).get(vertex_id, [])
+        else:
+            edges = (self.forward.get(label, {}).get(vertex_id, []) +
+                     self.reverse.get(label, {}).get(vertex_id, []))
+        found = []
+        for edge in edges:
+            other_id = edge.in_id if edge.out_id == vertex_id else edge.out_id
+            if other_id not in found:
+                found.append(other_id)
+        return found
+
+    def remove_file(self, path):
+        """Take out the edges that one data file added."""
+        (sort_key, edges) = self.files.pop(path)
+        del self.order[bisect.bisect_left(self.order, (sort_key, path))]
+        for label in self.file_labels.pop(path):
+            files = self.labels[label]
+            del files[bisect.bisect_left(files, (sort_key, path))]
+            if len(files) == 0:
+                del self.labels[label]
+        for edge in edges:
+            unindex_edge(self.forward, edge.label, edge.out_id, edge)
+            unindex_edge(self.reverse, edge.label, edge.in_id, edge)
+            if edge.label in self.SYMMETRIC_LABELS:
+                unindex_edge(self.undirected, edge.label, edge.out_id, edge)
+                if edge.in_id != edge.out_id:
+                    unindex_edge(self.undirected, edge.label, edge.in_id, edge)
+            key = (edge.out_id, edge.label, edge.in_id)
+            self.counts[key] = self.counts[key] - 1
+            if self.counts[key] == 0:
+                del self.counts[key]
+        self.size = self.size - len(edges)
+
+    def sources(self, label, in_id):
+        """Ids of the vertices with an edge of a label to this one."""
+        return [e.out_id for e in self.reverse.get(label, {}).get(in_id, [])]
+
+    def targets(self, label, out_id):
+        """Ids of the vertices this one has an edge of a label to."""
+        return [e.in_id for e in self.forward.get(label, {}).get(out_id, [])]
+
+    def touching(self, vertex_ids):
+        """Edges of every label with either end in a set of vertices.
+
+        Each edge is listed once, going through the vertices in id order.
+        """
+        found = []
+        seen = set()
+        for vertex_id in sorted(vertex_ids):
+            for table in [self.forward, self.reverse]:
+                for label in sorted(table):
+                    for edge in table[label].get(vertex_id, []):
+                        if id(edge) not in seen:
+                            seen.add(id(edge))
+                            found.append(edge)
+        return found
+
+class ImportCache:
+    """On-disk cache of parsed data files, for incremental builds.
+
+    Each entry is keyed by the data file's path, and holds the SHA-1 of the
+    file contents along with the record that parsing the file produced: its
+    vertex, edges, photo credits, and summary years. A file whose contents are
+    unchanged since the last build gets its record replayed from the cache
+    rather than being parsed again.
+
+    The cache is discarded whenever the builder's own source files change, so
+    that a change in parsing rules never replays stale records.
+    """
+    SOURCES = ["build.py", "datafile.py", "shared.py"]
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.fresh = {}
+        self.fingerprint = self.source_fingerprint()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as rfh:
+                saved = json.load(rfh)
+            if saved['fingerprint'] == self.fingerprint:
+                self.entries = saved['entries']
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable caches just mean a cold build
+            self.entries = {}
+
+    def source_fingerprint(self):
+        """Hash the builder sources that decide how data files are parsed."""
+        digest = hashlib.sha1()
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for source in self.SOURCES:
+            with open(os.path.join(folder, source), 'rb') as rfh:
+                digest.update(rfh.read())
+        return digest.hexdigest()
+
+    def content_hash(self, path):
+        with open(path, 'rb') as rfh:
+            return hashlib.sha1(rfh.read()).hexdigest()
+
+    def fetch(self, path):
+        """Return the cached record for an unchanged file, or None."""
+        digest = self.content_hash(path)
+        entry = self.entries.get(path)
+        if entry == None or entry['hash'] != digest:
+            self.fresh[path] = {'hash': digest, 'record': None}
+            return None
+        self.fresh[path] = entry
+        record = entry['record']
+        record['edges'] = [e if isinstance(e, Edge) else Edge.from_dict(e)
+                           for e in record['edges']]
+        return record
+
+    def store(self, path, record):
+        """Keep a newly parsed record, for saving once the build succeeds."""
+        if path not in self.fresh:
+            self.fresh[path] = {'hash': self.content_hash(path)}
+        self.fresh[path]['record'] = record
+
+    def save(self):
+        """Write out entries seen in this build. Deleted files drop out."""
+        saved = {}
+        saved['fingerprint'] = self.fingerprint
+        saved['entries'] = self.fresh
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as wfh:
+            json.dump(saved, wfh, ensure_ascii=False, default=Edge.as_dict)
+        os.replace(temp_path, self.path)
+
+class ListedEntry:
+    """The parts of os.DirEntry that scan_tree uses, for Pythons before 3.5."""
+    def __init__(self, dirpath, name):
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        return os.path.isfile(self.path)
+
+    def stat(self):
+        return os.stat(self.path)
+
 class RedPandaGraph:
     """Class with the redpanda database and format/consistency checks.
 
@@ -26,92 +374,484 @@ class RedPandaGraph:
                  { "_id":10,"en.name":"Karin", ...}],
       edges: [{"_out":10,"_in":1,"_label":"family"}]}
     """
-    def __init__(self):
-        self.edges = []
+    def __init__(self, cache=None, jobs=1, adjacency=False, lineage=False, profile=None,
+                 report=None):
+        self.adjacency = adjacency
+        self.cache = cache
+        # Adjacency and lineage tables, built once for all export formats,
+        # and dropped whenever a file is merged or retracted
+        self.derived = {}
+        # Edges by label and direction, see EdgeStore
+        self.edges = EdgeStore()
+        # Sort keys of each kind's files (see tree_order), in step with the
+        # file lists, so a file's position can be found by bisection
+        self.file_orders = {}
+        self.file_orders["media"] = []
+        self.file_orders["panda"] = []
+        self.file_orders["wild"] = []
+        self.file_orders["zoo"] = []
+        # Lookup tables of id -> vertex, for each kind of entity
+        self.index = {}
+        self.index["media"] = {}
+        self.index["panda"] = {}
+        self.index["wild"] = {}
+        self.index["zoo"] = {}
+        self.jobs = jobs
+        self.lineage = lineage
         self.media = []
         self.media_files = []
         self.panda_files = []
+        # Lookup tables of id -> the files with that id, in import order, for
+        # each kind of entity. More than one file means a duplicate id.
+        self.paths = {}
+        self.paths["media"] = {}
+        self.paths["panda"] = {}
+        self.paths["wild"] = {}
+        self.paths["zoo"] = {}
         self.photo = {}
         self.photo["credit"] = {}
         self.photo["max"] = 0
+        self.pool = None
+        # Timings for --profile. When not profiling, this records nothing.
+        self.profile = profile
+        if self.profile == None:
+            self.profile = profiler.Profile(enabled=False)
+        # Every file's parsed record, by path, so a file can be retracted
+        self.records = {}
+        # Errors found by --all-errors. By default, errors are just raised.
+        self.report = report
+        if self.report == None:
+            self.report = validation.Report()
         self.summary = {}
         self.summary["birthday"] = 1970
         self.summary["death"] = 1970
+        # How many files have each birth year, death year, and photo count,
+        # so the latest can be found again after a file is retracted
+        self.tallies = {}
+        self.tallies["birthday"] = {}
+        self.tallies["death"] = {}
+        self.tallies["photo_max"] = {}
         self.vertices = []
         self.wilds = []
         self.wild_files = []
         self.zoos = []
         self.zoo_files = []
 
+    def apply_file_change(self, path):
+        """Bring the graph up to date with one data file that changed on disk.
+
+        The file's old vertex and edges are retracted, the file is imported
+        again if it still exists, and then only the checks that the change
+        could break are rerun (see verify_neighborhood). Errors are raised
+        just as they would be in a full build.
+        """
+        kind = tree_kind(path)
+        vertex_ids = set()
+        panda_ids = set()
+        if path in self.records:
+            old = self.records[path]
+            panda_ids.update(self.neighborhood(old))
+            vertex_ids.add(old['vertex'].get('_id'))
+            self.retract_record(old)
+        if os.path.isfile(path):
+            for [tree_type, _, method_name] in DATA_TREES:
+                if tree_type == kind:
+                    record = getattr(self, method_name)(path)
+            self.merge_record(record)
+            panda_ids.update(self.neighborhood(record))
+            vertex_ids.add(record['vertex']['_id'])
+        self.verify_neighborhood(kind, vertex_ids, panda_ids)
+
+    def build_adjacency(self):
+        """Precompute each vertex's neighbors, as offsets into self.vertices.
+
+        Clients can use these tables instead of indexing every edge on load:
+          - children / parents: family edges, for pandas
+          - litter: litter-mates, in either direction, for pandas
+          - residents: pandas whose zoo or wild location is this vertex
+          - births: pandas whose birthplace is this vertex
+          - tagged: pandas tagged in a media vertex's panda.tags
+        Each table maps a vertex offset (as a string, since these are JSON
+        object keys) to a list of vertex offsets, and only lists vertices
+        that have neighbors. Building the tables is linear in the edges.
+        """
+        offsets = {}
+        for offset, vertex in enumerate(self.vertices):
+            offsets.setdefault(vertex['_id'], offset)
+        adjacency = {}
+        for table in ["births", "children", "litter", "parents", "residents", "tagged"]:
+            adjacency[table] = {}
+        # Links already made, so busy zoos don't search their resident lists
+        linked = set()
+        def link(table, source_id, target_id):
+            if (table, source_id, target_id) in linked:
+                return
+            linked.add((table, source_id, target_id))
+            adjacency[table].setdefault(str(offsets[source_id]), []).append(offsets[target_id])
+        for edge in self.edges:
+            if edge.out_id not in offsets or edge.in_id not in offsets:
+                raise LinkError("ERROR: edge refers to a missing vertex: %s" % edge)
+            if edge.label == Edge.FAMILY:
+                link("children", edge.out_id, edge.in_id)
+                link("parents", edge.in_id, edge.out_id)
+            elif edge.label == Edge.LITTER:
+                link("litter", edge.out_id, edge.in_id)
+                link("litter", edge.in_id, edge.out_id)
+            elif edge.label == Edge.BIRTHPLACE:
+                link("births", edge.in_id, edge.out_id)
+            elif edge.label in [Edge.WILD, Edge.ZOO]:
+                link("residents", edge.in_id, edge.out_id)
+        for media in self.media:
+            for panda_id in media['panda.tags'].replace(" ", "").split(","):
+                if panda_id not in offsets:
+                    raise LinkError("ERROR: %s: tagged panda doesn't exist: %s"
+                                    % (media['_id'], panda_id))
+                link("tagged", media['_id'], panda_id)
+        self.check_adjacency(adjacency)
+        return adjacency
+
     def build_graph(self):
         """Reads in all files to build a red panda graph."""
-        self.import_tree(ZOO_PATH, self.import_zoo, self.verify_zoos)
-        self.import_tree(WILD_PATH, self.import_wild, self.verify_wilds)
-        self.import_tree(PANDA_PATH, self.import_redpanda, self.verify_pandas)
-        self.import_tree(MEDIA_PATH, self.import_media, self.verify_media)
+        with self.profile.phase("build_graph", {'jobs': self.jobs}):
+            if self.jobs > 1:
+                self.pool = multiprocessing.Pool(self.jobs)
+            try:
+                self.import_tree(ZOO_PATH, self.parse_zoo, self.verify_zoos)
+                self.import_tree(WILD_PATH, self.parse_wild, self.verify_wilds)
+                self.import_tree(PANDA_PATH, self.parse_redpanda, self.verify_pandas)
+                self.import_tree(MEDIA_PATH, self.parse_media, self.verify_media)
+            finally:
+                if self.pool != None:
+                    self.pool.terminate()
+                    self.pool.join()
+                    self.pool = None
+            if self.cache != None and len(self.report.errors) == 0:
+                self.cache.save()
+
+    def build_lineage(self):
+        """Precompute every panda's ancestry in one pass down the family tree.
 
-    def check_dataset_dates(self):
+        The tables, all keyed by vertex offset (as a string) like the
+        adjacency tables, are:
+          - order: the offsets of all pandas, parents before children
+          - depth: the panda's generation, counting from 0 for pandas with
+            no known parents, as one more than their deepest parent
+          - ancestors: the offsets of every panda the panda descends from
+          - descendants: the offsets of every panda descended from the panda
+          - founders: the offsets of the ancestors with no known parents
+        Offset lists are sorted, and pandas with an empty list are left out,
+        so the tables grow with the size of each panda's family rather than
+        with the whole dataset. Asking whether A is an ancestor of B is a
+        binary search of B's ancestors, and the common ancestors of two
+        pandas are a merge of their two ancestor lists.
+
+        Pandas are visited in topological order (Kahn's algorithm), so each
+        panda's parents are finished before it is. A second pass, in
+        reverse order, gathers descendants.
+        """
+        offsets = {}
+        for offset, vertex in enumerate(self.vertices):
+            offsets.setdefault(vertex['_id'], offset)
+        children = {}
+        parents = {}
+        in_degree = {}
+        for panda_id in self.index["panda"]:
+            children[panda_id] = self.edges.targets(Edge.FAMILY, panda_id)
+            parents[panda_id] = self.edges.sources(Edge.FAMILY, panda_id)
+            in_degree[panda_id] = len(parents[panda_id])
+        ancestors = {}
+        depth = {}
+        founders = {}
+        order = []
+        queue = sorted((p for p in in_degree if in_degree[p] == 0), key=lambda p: offsets[p])
+        while len(queue) > 0:
+            panda_id = queue.pop()
+            order.append(panda_id)
+            ancestors[panda_id] = set()
+            depth[panda_id] = 0
+            founders[panda_id] = set()
+            for parent_id in parents[panda_id]:
+                ancestors[panda_id].update(ancestors[parent_id])
+                ancestors[panda_id].add(offsets[parent_id])
+                depth[panda_id] = max(depth[panda_id], depth[parent_id] + 1)
+                founders[panda_id].update(founders[parent_id])
+                if len(parents[parent_id]) == 0:
+                    founders[panda_id].add(offsets[parent_id])
+            for child_id in children[panda_id]:
+                in_degree[child_id] = in_degree[child_id] - 1
+                if in_degree[child_id] == 0:
+                    queue.append(child_id)
+        if len(order) != len(in_degree):
+            # check_dataset_children_ids reports these when verifying pandas
+            raise LinkError("ERROR: the family tree has loops")
+        descendants = {}
+        for panda_id in reversed(order):
+            descendants[panda_id] = set()
+            for child_id in children[panda_id]:
+                descendants[panda_id].update(descendants[child_id])
+                descendants[panda_id].add(offsets[child_id])
+        lineage = {}
+        lineage['order'] = [offsets[p] for p in order]
+        lineage['depth'] = dict((str(offsets[p]), depth[p]) for p in order)
+        for (table, found) in [("ancestors", ancestors),
+                               ("descendants", descendants),
+                               ("founders", founders)]:
+            lineage[table] = dict((str(offsets[p]), sorted(found[p]))
+                                  for p in order if len(found[p]) > 0)
+        return lineage
+
+    def check_adjacency(self, adjacency):
+        """Check the adjacency tables against the raw edges they came from.
+
+        Every family, litter, birthplace, zoo, and wild edge must show up in
+        the tables, and the tables can't hold anything more than that.
+        """
+        expected = {}
+        for table in adjacency:
+            expected[table] = set()
+        for edge in self.edges:
+            if edge.label == Edge.FAMILY:
+                expected["children"].add((edge.out_id, edge.in_id))
+                expected["parents"].add((edge.in_id, edge.out_id))
+            elif edge.label == Edge.LITTER:
+                expected["litter"].add((edge.out_id, edge.in_id))
+                expected["litter"].add((edge.in_id, edge.out_id))
+            elif edge.label == Edge.BIRTHPLACE:
+                expected["births"].add((edge.in_id, edge.out_id))
+            elif edge.label in [Edge.WILD, Edge.ZOO]:
+                expected["residents"].add((edge.in_id, edge.out_id))
+        for media in self.media:
+            for panda_id in media['panda.tags'].replace(" ", "").split(","):
+                expected["tagged"].add((media['_id'], panda_id))
+        for table in adjacency:
+            found = set()
+            for source, targets in adjacency[table].items():
+                source_id = self.vertices[int(source)]['_id']
+                for target in targets:
+                    found.add((source_id, self.vertices[target]['_id']))
+            if found != expected[table]:
+                raise LinkError("ERROR: %s adjacency doesn't match the edges: %s"
+                                % (table, sorted(found ^ expected[table])[:10]))
+
+    def check_dataset_ancestry(self, panda_ids):
+        """Check that none of the given pandas is their own ancestor.
+
+        A quicker form of the loop check in check_dataset_children_ids, for
+        when only a few pandas have changed: any new family loop must pass
+        through a panda whose children were changed. Only the descendants
+        of those pandas are walked.
+        """
+        loops = []
+        involved = set()
+        for start_id in sorted(panda_ids):
+            # Breadth-first walk, remembering which parent reached each panda
+            reached = {start_id: None}
+            queue = [start_id]
+            while len(queue) > 0:
+                panda_id = queue.pop(0)
+                if self.edges.exists(panda_id, start_id, Edge.FAMILY):
+                    loop = [start_id]
+                    while panda_id != None:
+                        loop.insert(0, panda_id)
+                        panda_id = reached[panda_id]
+                    loops.append(" -> ".join(loop))
+                    involved.update(loop)
+                    break
+                for child_id in self.edges.targets(Edge.FAMILY, panda_id):
+                    if child_id not in reached:
+                        reached[child_id] = panda_id
+                        queue.append(child_id)
+        if len(loops) > 0:
+            raise LinkError("ERROR: pandas are their own ancestors:\n  %s"
+                            % "\n  ".join(loops), paths=self.panda_paths(involved))
+
+    def check_dataset_dates(self, pandas=None, edges=None):
         """Run checks against the complete tree of red panda dates.
 
         - Birth date and date of death should not be reversed.
         - Child pandas should not be born before the parent.
-        - Child pandas should not be born after the parent died.
+        - Child pandas should not be born after the parent died. Since
+          fathers can die while the mother is still pregnant, a child may be
+          born up to GESTATION_DAYS after their father's death.
 
-        This requires the entire panda dataset to have been read.
+        This requires the entire panda dataset to have been read. Every
+        problem found is listed in the error, rather than just the first.
+        To only check some pandas and the edges around them, pass those in.
         """
-        # TODO: graph traverse and date checking
-        pass
+        if pandas == None:
+            pandas = self.index["panda"].values()
+        if edges == None:
+            edges = self.edges.labelled(Edge.FAMILY)
+        problems = []
+        involved = set()
+        for panda in pandas:
+            birthday = read_date(panda.get('birthday'))
+            death = read_date(panda.get('death'))
+            if birthday != None and death != None and death < birthday:
+                problems.append("%s (%s) died %s before being born %s"
+                                % (display_name(panda), panda['_id'],
+                                   panda['death'], panda['birthday']))
+                involved.add(panda['_id'])
+        for edge in edges:
+            if edge.label != Edge.FAMILY:
+                continue
+            parent = self.index["panda"].get(edge.out_id)
+            child = self.index["panda"].get(edge.in_id)
+            if parent == None or child == None:
+                # Missing IDs are reported by check_dataset_children_ids
+                continue
+            child_birthday = read_date(child.get('birthday'))
+            if child_birthday == None:
+                continue
+            parent_birthday = read_date(parent.get('birthday'))
+            parent_death = read_date(parent.get('death'))
+            if parent_birthday != None and parent_birthday >= child_birthday:
+                problems.append("%s (%s) born %s, not before their child %s (%s) born %s"
+                                % (display_name(parent), parent['_id'], parent['birthday'],
+                                   display_name(child), child['_id'], child['birthday']))
+                involved.update([parent['_id'], child['_id']])
+            if parent_death != None:
+                grace = 0
+                if parent.get('gender') == "Male":
+                    grace = GESTATION_DAYS
+                if (child_birthday - parent_death).days > grace:
+                    problems.append("%s (%s) died %s, before their child %s (%s) was born %s"
+                                    % (display_name(parent), parent['_id'], parent['death'],
+                                       display_name(child), child['_id'], child['birthday']))
+                    involved.update([parent['_id'], child['_id']])
+        if len(problems) > 0:
+            raise DateConsistencyError("ERROR: inconsistent family dates:\n  %s"
+                                       % "\n  ".join(problems),
+                                       paths=self.panda_paths(involved))
 
     def check_dataset_children_ids(self):
         """Check the panda children IDs to ensure they form a family tree.
 
         - The children IDs should be valid for only one red panda file
         - There should be no loops / I'm my own grandpa situations
-        - Each child should have a mother and a father
+        - A child should have no more than one mother and one father
 
         This requires the entire children edge dataset to have been read.
-        We make stacks of child -> parent -> grandparent ... paths,
-        and look for any duplicate IDs in the stacks.
-        """
-        # Start with the set of pandas that have no children
-        childless_ids = [p['_id'] for p in self.vertices
-                       if (p['children'] == "none" 
-                           or p['children'] == "unknown")]
-        # Finish with the pandas that have no recorded parents
-        all_child_ids = [x['_out'] for x in self.edges]
-        parentless_ids = [y for y in range(1, self.sum_pandas())
-                            if y not in all_child_ids]
-        # Sets of edges we can start or finish on
-        starting_edges = [s for s in self.edges 
-                            if s['_out'] in childless_ids]
-        finishing_edges = [f for f in self.edges
-                             if f['in'] in parentless_ids]
-        # This is hard to write :)
-        pass
-
-    def check_dataset_litter_ids(self):
-        """Check that pandas in the same litter have the same birthday."""
-        litter_edges = [a for a in self.edges if a['_label'] == "litter"]
-        seen_pairs = []
+        A single topological sort (Kahn's algorithm) peels away pandas with
+        no remaining parents, generation by generation. Any pandas left over
+        are on or below a family loop, and a depth-first walk of just those
+        pandas finds the loops to report.
+
+        Studbooks sometimes list more than one possible sire or dam for a
+        panda, so a child with two fathers or two mothers is a warning in the
+        validation report rather than an error.
+        """
+        children = {}
+        parents = {}
+        in_degree = {}
+        missing = []
+        involved = set()
+        for edge in self.edges.labelled(Edge.FAMILY):
+            if edge.in_id not in self.index["panda"]:
+                missing.append("%s lists a child id that doesn't exist: %s"
+                               % (edge.out_id, edge.in_id))
+                involved.add(edge.out_id)
+        if len(missing) > 0:
+            raise IdError("ERROR: children ids not in the database:\n  %s"
+                          % "\n  ".join(missing), paths=self.panda_paths(involved))
+        for panda_id in self.index["panda"]:
+            children[panda_id] = self.edges.targets(Edge.FAMILY, panda_id)
+            parents[panda_id] = self.edges.sources(Edge.FAMILY, panda_id)
+            in_degree[panda_id] = len(parents[panda_id])
+        # Kahn's algorithm: repeatedly remove pandas with no unvisited parents
+        queue = [p for p in in_degree if in_degree[p] == 0]
+        while len(queue) > 0:
+            panda_id = queue.pop()
+            for child_id in children[panda_id]:
+                in_degree[child_id] = in_degree[child_id] - 1
+                if in_degree[child_id] == 0:
+                    queue.append(child_id)
+        remaining = set(p for p in in_degree if in_degree[p] > 0)
+        loops = []
+        # Iterative DFS over the leftover pandas. Reaching a panda that is
+        # still on the stack closes a loop.
+        state = {}
+        for start_id in sorted(remaining):
+            if start_id in state:
+                continue
+            path = [start_id]
+            stack = [iter(children[start_id])]
+            state[start_id] = "open"
+            while len(stack) > 0:
+                child_id = next(stack[-1], None)
+                if child_id == None:
+                    state[path.pop()] = "done"
+                    stack.pop()
+                elif child_id not in remaining or state.get(child_id) == "done":
+                    continue
+                elif state.get(child_id) == "open":
+                    loop = path[path.index(child_id):] + [child_id]
+                    loops.append(" -> ".join(loop))
+                    involved.update(loop)
+                else:
+                    state[child_id] = "open"
+                    path.append(child_id)
+                    stack.append(iter(children[child_id]))
+        if len(loops) > 0:
+            raise LinkError("ERROR: pandas are their own ancestors:\n  %s"
+                            % "\n  ".join(loops), paths=self.panda_paths(involved))
+        for child_id in sorted(parents):
+            genders = {}
+            for parent_id in parents[child_id]:
+                gender = self.index["panda"][parent_id].get('gender')
+                if gender != None:
+                    genders.setdefault(gender, []).append(parent_id)
+            for gender in sorted(genders):
+                if len(genders[gender]) > 1:
+                    self.report.warn("ParentWarning",
+                                     "WARNING: %s (%s) has more than one %s parent: %s"
+                                     % (display_name(self.index["panda"][child_id]), child_id,
+                                        gender.lower(), ", ".join(genders[gender])),
+                                     self.panda_path(child_id))
+
+    def check_dataset_litter_ids(self, edges=None):
+        """Check that pandas in the same litter have the same birthday.
+
+        Every problem found is listed in the error, rather than just the
+        first. Litter-mates whose ids don't exist make it a LinkError.
+        """
+        if edges == None:
+            edges = self.edges.labelled(Edge.LITTER)
+        litter_edges = [a for a in edges if a.label == Edge.LITTER]
+        seen_pairs = set()
+        missing = []
+        problems = []
+        involved = set()
         for edge in litter_edges:
-            if (edge['_in'], edge['_out']) not in seen_pairs:
-                try:
-                    panda_in = [p for p in self.vertices 
-                                  if p['_id'] == edge['_in']][0]
-                    panda_out = [p for p in self.vertices 
-                                   if p['_id'] == edge['_out']][0]
-                except IndexError as e:
+            if (edge.in_id, edge.out_id) not in seen_pairs:
+                panda_in = self.index["panda"].get(edge.in_id)
+                panda_out = self.index["panda"].get(edge.out_id)
+                if panda_in == None or panda_out == None:
                     # One panda in a litter isn't pointing back at the other
-                    raise LinkError("""Litter values inconsistent between two pandas,
-                                       \nor one panda ID is not in the database: %s""" % edge)
-                if self.check_dataset_litter_timeframes(panda_in['birthday'], panda_out['birthday']) == False:
-                    raise DateConsistencyError("Pandas in litter don't share birthday: %s, %s"
-                                               % (panda_in['en.name'], panda_out['en.name']))
+                    missing.append("%s lists a litter-mate id that doesn't exist: %s"
+                                   % (edge.out_id, edge.in_id))
+                    involved.add(edge.out_id)
+                elif (read_date(panda_in.get('birthday')) != None and
+                      read_date(panda_out.get('birthday')) != None and
+                      self.check_dataset_litter_timeframes(panda_in['birthday'],
+                                                           panda_out['birthday']) == False):
+                    problems.append("%s (%s) born %s and %s (%s) born %s"
+                                    % (display_name(panda_in), panda_in['_id'],
+                                       panda_in['birthday'], display_name(panda_out),
+                                       panda_out['_id'], panda_out['birthday']))
+                    involved.update([panda_in['_id'], panda_out['_id']])
             # Litter relationships are recorded both directions, but we don't need
             # to check the reverse-direction litter relationship
-            seen_pairs.append((edge['_in'], edge['_out']))
-            seen_pairs.append((edge['_out'], edge['_in']))
-        pass
+            seen_pairs.add((edge.in_id, edge.out_id))
+            seen_pairs.add((edge.out_id, edge.in_id))
+        if len(missing) > 0:
+            raise LinkError("ERROR: litter-mates not in the database:\n  %s"
+                            % "\n  ".join(missing + problems),
+                            paths=self.panda_paths(involved))
+        if len(problems) > 0:
+            raise DateConsistencyError("ERROR: pandas in litter don't share birthday:\n  %s"
+                                       % "\n  ".join(problems),
+                                       paths=self.panda_paths(involved))
 
     def check_dataset_litter_timeframes(self, date_one, date_two):
         """Valid litter dates are no more than two days apart."""
@@ -125,32 +865,57 @@ class RedPandaGraph:
         else:
             return True 
 
+    def check_dataset_locations(self, pandas=None):
+        """Check each panda's location history for moves that don't add up.
+
+        - Locations should be numbered in order, and name zoos or wild
+          locations that exist.
+        - Moves should be in date order, between the panda's birth and death.
+        - The last location should be the panda's current zoo.
+
+        Old records are often vague about when pandas moved, so problems are
+        warnings in the validation report rather than stopping the build.
+        """
+        if pandas == None:
+            pandas = self.pandas()
+        for panda in pandas:
+            (_, problems) = self.location_history(panda)
+            for problem in problems:
+                self.report.warn("LocationWarning",
+                                 "WARNING: %s (%s) %s"
+                                 % (display_name(panda), panda['_id'], problem),
+                                 self.panda_path(panda['_id']))
+
     def check_dataset_duplicate_ids(self, dataset):
         """Check for duplicate IDs in any of the datasets."""
-        ids = [a['_id'] for a in dataset]
-        # Construct list of duplicates
-        dupe_ids = [a for n, a in enumerate(ids) 
-                      if a in ids[:n]]
+        seen_ids = set()
+        dupe_ids = set()
+        for vertex in dataset:
+            if vertex['_id'] in seen_ids:
+                dupe_ids.add(vertex['_id'])
+            seen_ids.add(vertex['_id'])
         if len(dupe_ids) > 0:
             # Get list of names for the duplicate pandas
-            dupe_names = [a['en.name'] for a in dataset 
-                                       if a['_id'] in dupe_ids]
+            dupe_names = [display_name(a) for a in dataset 
+                                          if a['_id'] in dupe_ids]
+            dupe_paths = [path for kind in self.paths for vertex_id in dupe_ids
+                          for path in self.paths[kind].get(vertex_id, [])]
             raise IdError("ERROR: duplicate ids for en.names: %s" 
-                          % str(dupe_names)) 
+                          % str(dupe_names), paths=sorted(dupe_paths))
 
-    def check_imported_date(self, date, date_type, sourcepath):
+    def check_imported_date(self, date, sourcepath):
         """
         Dates should all be in the form of YYYY/MM/DD.
-        Also, track most recent year that a panda was born or died (datetype).
+        Return the year, so the most recent year that a panda was born or died
+        can be tracked.
         """
         try:
             [year, month, day] = date.split("/")
             datetime.datetime(int(year), int(month), int(day))
-            if self.summary[date_type] < int(year):
-                self.summary[date_type] = int(year)
+            return int(year)
         except ValueError as e:
-            raise DateFormatError("ERROR: %s: invalid YYYY/MM/DD date: %s/%s/%s"
-                                  % (sourcepath, year, month, day))
+            raise DateFormatError("ERROR: %s: invalid YYYY/MM/DD date: %s"
+                                  % (sourcepath, date))
 
     def check_imported_gender(self, gender, sourcepath):
         """Validate the gender string is correct.
@@ -181,7 +946,7 @@ class RedPandaGraph:
     
     def check_imported_wild_id(self, wild_id, sourcepath):
         """Validate that the ID for a panda's zoo is valid."""
-        if wild_id not in [wild['_id'] for wild in self.wilds]:
+        if wild_id not in self.index["wild"]:
             raise IdError("ERROR: %s: wild id doesn't exist: %s"
                               % (sourcepath, wild_id))
 
@@ -193,8 +958,8 @@ class RedPandaGraph:
 
     def check_imported_zoo_id(self, zoo_id, sourcepath):
         """Validate that the ID for a panda's zoo is valid."""
-        check_id = str(int(zoo_id) * -1)
-        if check_id not in [zoo['_id'] for zoo in self.zoos]:
+        check_id = zoo_vertex_id(zoo_id, sourcepath)
+        if check_id not in self.index["zoo"]:
             raise IdError("ERROR: %s: zoo id doesn't exist: %s"
                               % (sourcepath, zoo_id))
 
@@ -204,11 +969,11 @@ class RedPandaGraph:
             raise IdError("ERROR: %s: file path and zoo id don't match: %s"
                               % (sourcepath, zoo_id))
 
-    def export_json_graph(self, destpath):
-        """Write a JSON representation of the Red Panda graph."""
+    def export_document(self):
+        """Gather the vertices, edges, and totals that make up an export."""
         export = {}
         export['vertices'] = self.vertices
-        export['edges'] = self.edges
+        export['edges'] = [edge.as_dict() for edge in self.edges]
         export['_totals'] = {}
         export['_photo'] = {}
         export['_photo']['credit'] = self.photo['credit']
@@ -220,73 +985,363 @@ class RedPandaGraph:
         export['_totals']['pandas'] = self.sum_pandas()
         export['_totals']['last_born'] = self.summary['birthday']
         export['_totals']['last_died'] = self.summary['death']
-        with open(destpath, 'wb') as wfh:
-            wfh.write(json.dumps(export, 
-                                 ensure_ascii=False,
-                                 indent=4,
-                                 sort_keys=True).encode('utf8'))
+        if self.adjacency:
+            if 'adjacency' not in self.derived:
+                self.derived['adjacency'] = self.build_adjacency()
+            export['_adjacency'] = self.derived['adjacency']
+        if self.lineage:
+            if 'lineage' not in self.derived:
+                self.derived['lineage'] = self.build_lineage()
+            export['_lineage'] = self.derived['lineage']
+        return export
+
+    def export_json_graph(self, destpath, version=1):
+        """Write a JSON representation of the Red Panda graph.
+
+        Version 1 is the indented redpanda.json that the website loads. It is
+        written one vertex and edge at a time (see write_indented_json), so
+        the whole file never sits in memory at once. Version 2 is the same
+        data, minified and packed with string tables (see compact.py for the
+        format and a decoder).
+        """
+        export = self.export_document()
+        if version == compact.FORMAT:
+            write_compact_json(destpath, compact.encode(export))
+        else:
+            write_indented_json(destpath, export)
         print("Dataset exported: %d pandas at %d locations (%d wild, %d zoo)"
               % (export['_totals']['pandas'], export['_totals']['locations'],
                  export['_totals']['wilds'], export['_totals']['zoos']))
 
-    def import_tree(self, path, import_method, verify_method):
+    def export_ndjson_graph(self, destpath):
+        """Write the graph as newline-delimited JSON, one entity per line.
+
+        The first line holds the sections starting with "_", like _totals.
+        Every line after that is one vertex, and then one edge, minified
+        with sorted keys, in the same order as redpanda.json. Tools can read
+        the file line by line, and a change to one panda changes only the
+        lines for that panda's vertex and edges.
+        """
+        export = self.export_document()
+        header = {}
+        for key in export:
+            if key.startswith("_"):
+                header[key] = export[key]
+        with open(destpath, 'w', encoding='utf-8', newline='\n') as wfh:
+            for entry in [header] + export['vertices'] + export['edges']:
+                wfh.write(json.dumps(entry,
+                                     ensure_ascii=False,
+                                     separators=(',', ':'),
+                                     sort_keys=True))
+                wfh.write("\n")
+        print("NDJSON dataset exported: %d vertices and %d edges"
+              % (len(export['vertices']), len(export['edges'])))
+
+    def export_photo_index(self, destpath):
+        """Write indexes of photos by the pandas in them, and by their tags.
+
+        See photos.py for the layout, and for how tags in any language are
+        matched to the tag names in Language.L.tags.
+        """
+        index = photos.build_index(self.vertices, self.index["panda"], photos.read_synonyms())
+        info = write_compact_json(destpath, index)
+        print("Photo index exported: %d pandas and %d tags, %d bytes"
+              % (len(index['appearances']), len(index['tags']), info['size']))
+
+    def export_residency_index(self, destpath):
+        """Write an index of which pandas lived at each zoo, and when.
+
+        See residency.py for the layout, and how to look up who lived at a
+        zoo on a given date.
+        """
+        histories = []
+        for panda in self.pandas():
+            (intervals, _) = self.location_history(panda)
+            histories.append((panda['_id'], intervals, 'death' not in panda))
+        index = residency.build_index(histories)
+        info = write_compact_json(destpath, index)
+        print("Residency index exported: %d pandas at %d locations, %d bytes"
+              % (len(index['pandas']), len(index['places']), info['size']))
+
+    def export_search_index(self, destpath):
+        """Write a sorted name search index for type-ahead searches.
+
+        See search.py for how names are normalized and how the index is laid
+        out. Media entries have no names, so only names of pandas, zoos, and
+        wild locations end up in the index.
+        """
+        index = search.build_index(self.vertices)
+        info = write_compact_json(destpath, index)
+        print("Search index exported: %d tokens in %d languages, %d bytes"
+              % (len(index['tokens']), len(index['languages']), info['size']))
+
+    def export_snapshot(self, destpath):
+        """Write the graph as a memory-mappable binary snapshot.
+
+        Analysis tools can open the snapshot with snapshot.load, and walk the
+        graph without building it or parsing redpanda.json. See snapshot.py
+        for the file layout.
+        """
+        export = self.export_document()
+        kinds = []
+        for [kind, _, _] in DATA_TREES:
+            kinds.append((kind, len(self.kind_lists(kind)[0])))
+        size = snapshot.write(destpath, export, kinds)
+        print("Snapshot exported: %d vertices and %d edges, %d bytes"
+              % (len(export['vertices']), len(export['edges']), size))
+
+    def export_split_graph(self, corepath, detailpath, manifestpath):
+        """Write the graph as a lean core file plus per-entity detail files.
+
+        The core file has the same layout as the full export, but each vertex
+        only keeps the fields needed to search and draw family trees: ids,
+        names, genders, and dates (see is_core_field). Everything else, such as
+        photos, videos, location history, and addresses, goes into one detail
+        file per entity, named after its id, for the website to fetch when
+        that panda or zoo is viewed.
+
+        The manifest lists the core file and every detail file, along with a
+        hash of each file's contents that clients can use for caching.
+        """
+        export = self.export_document()
+        manifest = {}
+        manifest['detail'] = {}
+        if not os.path.isdir(detailpath):
+            os.makedirs(detailpath)
+        stale = set(f for f in os.listdir(detailpath) if f.endswith(".json"))
+        core_vertices = []
+        for vertex in self.vertices:
+            core = {}
+            detail = {}
+            for key, value in vertex.items():
+                if is_core_field(key):
+                    core[key] = value
+                else:
+                    detail[key] = value
+            core_vertices.append(core)
+            if len(detail) == 0:
+                continue
+            detail['_id'] = vertex['_id']
+            filename = vertex['_id'] + ".json"
+            destpath = os.path.join(detailpath, filename)
+            relpath = os.path.relpath(destpath, os.path.dirname(manifestpath))
+            manifest['detail'][vertex['_id']] = write_compact_json(destpath, detail)
+            manifest['detail'][vertex['_id']]['path'] = relpath.replace(os.sep, "/")
+            stale.discard(filename)
+        # Entities that were deleted or lost their detail fields
+        for filename in stale:
+            os.remove(os.path.join(detailpath, filename))
+        export['vertices'] = core_vertices
+        manifest['core'] = write_compact_json(corepath, export)
+        manifest['core']['path'] = os.path.relpath(
+            corepath, os.path.dirname(manifestpath)).replace(os.sep, "/")
+        write_compact_json(manifestpath, manifest)
+        print("Split dataset exported: core is %d bytes, with %d detail files"
+              % (manifest['core']['size'], len(manifest['detail'])))
+
+    def import_tree(self, path, parse_method, verify_method):
         """Given starting path, import all files into the graph.
         
-        By adjusting path and import_method, this is used to import either the
-        panda data or the zoo data.
-        """
-        for _, subdir in enumerate(sorted(os.listdir(path))):
-            subpath = os.path.join(path, subdir)
-            if os.path.isdir(subpath):
-                for _, subfile in enumerate(sorted(os.listdir(subpath))):
-                    subsubpath = os.path.join(subpath, subfile)
-                    if os.path.isfile(subsubpath) and subsubpath.lower().endswith(".txt"):
-                        # Import zoos
-                        import_method(subsubpath)
-                    if os.path.isdir(subsubpath):
-                        for _, subsubfile in enumerate(sorted(os.listdir(subsubpath))):
-                            datapath = os.path.join(subsubpath, subsubfile)
-                            if os.path.isfile(datapath) and datapath.lower().endswith(".txt"):
-                                # Import pandas
-                                import_method(datapath)
+        By adjusting path and parse_method, this is used to import either the
+        panda data or the zoo data. When an import cache is in use, files that
+        haven't changed since the last build are replayed from the cache
+        instead of being parsed again.
+
+        Files may be parsed in worker processes, but their records are always
+        merged in sorted path order, so the graph is the same either way.
+        """
+        with self.profile.phase("import_tree " + path) as args:
+            datapaths = list_tree(path)
+            cached = {}
+            if self.cache != None:
+                for datapath in datapaths:
+                    record = self.cache.fetch(datapath)
+                    if record != None:
+                        cached[datapath] = record
+            args['cached'] = len(cached)
+            args['files'] = len(datapaths)
+            parsed = self.parse_files(parse_method,
+                                      [d for d in datapaths if d not in cached])
+            for datapath in datapaths:
+                if datapath in cached:
+                    record = cached[datapath]
+                else:
+                    errors = len(self.report.errors)
+                    record = next(parsed)
+                    if record == None:
+                        # Unreadable, and reported with --all-errors
+                        continue
+                    if self.cache != None and len(self.report.errors) == errors:
+                        self.cache.store(datapath, record)
+                with self.report.check(datapath):
+                    self.merge_record(record)
         # Post-import, validate the entire dataset
-        verify_method()
+        with self.profile.phase(verify_method.__name__):
+            verify_method()
 
     def import_media(self, path):
+        """Import a single media file into the graph."""
+        self.merge_record(self.parse_media(path))
+
+    def import_redpanda(self, path):
+        """Import a single red panda file into the graph."""
+        self.merge_record(self.parse_redpanda(path))
+
+    def import_wild(self, path):
+        """Import a single wild location file into the graph."""
+        self.merge_record(self.parse_wild(path))
+
+    def import_zoo(self, path):
+        """Import a single zoo file into the graph."""
+        self.merge_record(self.parse_zoo(path))
+
+    def location_history(self, panda):
+        """A panda's intervals at each location, and any problems with them.
+
+        Pandas without location fields are placed at their zoo, or their
+        wild location, for their whole life. See residency.read_history.
+        """
+        current = (self.edges.targets(Edge.ZOO, panda['_id']) +
+                   self.edges.targets(Edge.WILD, panda['_id']))
+        fallback = None
+        if len(current) > 0:
+            fallback = current[0]
+        places = [self.index["zoo"], self.index["wild"]]
+        return residency.read_history(panda, fallback, places)
+
+    def merge_record(self, record):
+        """Add the vertex, edges, and photo credits of one parsed file.
+
+        Checks that depend on other files, such as a panda's zoo or wild
+        location existing, are run here rather than while parsing, so that
+        cached records are validated against the current dataset.
+        """
+        path = record['path']
+        self.derived.clear()
+        for [ref_type, ref_id] in record['refs']:
+            with self.report.check(path, ref_type):
+                if ref_type == "wild":
+                    self.check_imported_wild_id(ref_id, path)
+                else:
+                    self.check_imported_zoo_id(ref_id, path)
+        for date_type, year in record['summary'].items():
+            if self.summary[date_type] < year:
+                self.summary[date_type] = year
+            tally(self.tallies[date_type], year, 1)
+        tally(self.tallies["photo_max"], record['photo_max'], 1)
+        for author in record['credits']:
+            if author in self.photo["credit"].keys():
+                self.photo["credit"][author] = self.photo["credit"][author] + 1
+            else:
+                self.photo["credit"][author] = 1
+        if record['photo_max'] > self.photo["max"]:
+            self.photo["max"] = record['photo_max']
+        # Every vertex repeats the same few dozen field names, so they share
+        # one interned copy of each, as ids do with the edges
+        vertex = dict((sys.intern(k), v) for k, v in record['vertex'].items())
+        if '_id' not in vertex:
+            raise IdError("ERROR: %s: no _id field" % path)
+        vertex['_id'] = sys.intern(vertex['_id'])
+        record['vertex'] = vertex
+        kind = record['kind']
+        # With duplicate ids, the first vertex imported stays in the index
+        self.index[kind].setdefault(vertex['_id'], vertex)
+        # Files are normally merged in import order, and just appended. A
+        # file re-imported by --watch goes back where a full build puts it.
+        [files, kind_vertices] = self.kind_lists(kind)
+        order = tree_order(path)
+        position = bisect.bisect_right(self.file_orders[kind], order)
+        self.file_orders[kind].insert(position, order)
+        same_id = self.paths[kind].setdefault(vertex['_id'], [])
+        same_id.append(path)
+        same_id.sort(key=tree_order)
+        self.edges.add_file(path, import_order(kind, path), record['edges'])
+        self.vertices.insert(self.vertex_offset(kind) + position, vertex)
+        if kind_vertices != None:
+            kind_vertices.insert(position, vertex)
+        files.insert(position, path)
+        self.records[path] = record
+
+    def neighborhood(self, record):
+        """Ids of the pandas whose checks depend on one file's vertex and edges.
+
+        For a panda, that's the panda itself plus its litter-mates, parents,
+        and children. For a zoo or wild location, it's the pandas born or
+        living there.
+        """
+        vertex_id = record['vertex'].get('_id')
+        panda_ids = set()
+        if record['kind'] == "panda":
+            panda_ids.add(vertex_id)
+            for edge in record['edges']:
+                if edge.label in [Edge.FAMILY, Edge.LITTER]:
+                    panda_ids.add(edge.in_id)
+        for edge in self.edges.incoming(vertex_id):
+            panda_ids.add(edge.out_id)
+        return panda_ids
+
+    def parse_files(self, parse_method, datapaths):
+        """Yield the parsed record for each file, in the order given.
+
+        Without a worker pool, files are parsed one at a time as records are
+        asked for. With a pool, workers parse ahead while records are merged,
+        and any error is raised when its file's turn comes up, just as it
+        would be in a serial build. With --all-errors, a file that can't be
+        parsed is reported, and yields None.
+
+        Each file's parse time is recorded in the profile, if there is one.
+        """
+        if self.pool == None:
+            for datapath in datapaths:
+                start = time.perf_counter()
+                record = None
+                with self.report.check(datapath):
+                    record = parse_method(datapath)
+                self.profile.add_file(datapath, time.perf_counter() - start)
+                yield record
+        else:
+            jobs = [(parse_method.__name__, datapath, self.report.collect)
+                    for datapath in datapaths]
+            chunksize = max(1, len(jobs) // (self.jobs * 4))
+            results = self.pool.imap(parse_file, jobs, chunksize)
+            for datapath, [result, elapsed, errors] in zip(datapaths, results):
+                self.report.errors.extend(errors)
+                if isinstance(result, Exception):
+                    self.report.fail(result, datapath)
+                    result = None
+                self.profile.add_file(datapath, elapsed)
+                yield result
+
+    def parse_media(self, path):
         """Take a single media file and convert it into a Python dict.
 
         Media files are expected to have a header of [media]. Any fields defined
         under that header will be consumed into a list of photos or videos. All
         of these media files should have two or more pandas in them.
         """
-        media_vertex = {}
-        infile = configparser.ConfigParser()
-        infile.read(path, encoding='utf-8')
+        record = new_record("media", path)
+        media_vertex = record['vertex']
+        infile = read_fields(path, "media")
         # Use the path name for error messages or assignments
-        for field in infile.items("media"):
+        for field in infile.items():
             if (field[0].find("photo") != -1 and
                 len(field[0].split(".")) == 2):
                     # Process a small set of photo credits for all the pandas
-                    # author = infile.get("media", field[0] + ".author")
-                    # if author in self.photo["credit"].keys():
-                    #     self.photo["credit"][author] = self.photo["credit"][author] + 1
-                    # else:
-                    #     self.photo["credit"][author] = 1
+                    # author = infile[field[0] + ".author"]
+                    # record['credits'].append(author)
                     # Track what the max number of panda photos an object has is
                     # test_count = int(field[0].split(".")[1])
-                    # if test_count > self.photo["max"]:
-                    #    self.photo["max"] = test_count
+                    # if test_count > record['photo_max']:
+                    #    record['photo_max'] = test_count
                     # Accept the data and continue
                     media_vertex[field[0]] = field[1]
             # TODO: track video info for apple counting as well
             else:
                 # Accept the data and move along
                 media_vertex[field[0]] = field[1]
-        self.media.append(media_vertex)
-        self.vertices.append(media_vertex)
-        self.media_files.append(path)
+        return record
 
-    def import_redpanda(self, path):
+    def parse_redpanda(self, path):
         """Take a single red panda file and convert it into a Python dict.
 
         Panda files are expected to have a header of [panda]. Any fields defined
@@ -300,176 +1355,210 @@ class RedPandaGraph:
         Since pandas live at zoos and we need to check zoo references, the list
         of zoos must be imported prior to any red pandas being imported. 
         """
-        panda_edges = []
-        panda_vertex = {}
-        infile = configparser.ConfigParser()
-        infile.read(path, encoding='utf-8')
-        panda_name = infile.get("panda", "en.name")   # For error messages
-        panda_id = infile.get("panda", "_id")         # or assignments
-        for field in infile.items("panda"):
-            if (field[0].find("death") != -1 or
-                field[0].find("birthday") != -1):
-                # Record that an animal has died or was born, 
-                # regardless if the date has been recorded or not.
-                if field[1] != "unknown":
-                    self.check_imported_date(field[1], field[0], path)
-                panda_vertex[field[0]] = field[1]
-            if field[1] == "unknown" or field[1] == "none":
-                # Basic null checks. Don't add this to the vertex
-                continue
-            elif field[0].find("name") != -1:
-                # Name rule checking
-                self.check_imported_name(field[1], field[0], path)
-                panda_vertex[field[0]] = field[1]
-            elif field[0].find("gender") != -1:
-                # Gender rules
-                gender = self.check_imported_gender(field[1], path)
-                panda_vertex[field[0]] = gender
-            elif (field[0].find("birthplace") != -1):
-                if (field[1].find("wild.") != -1):
-                  # Wild ID rules
-                  wild_id = field[1]
-                  self.check_imported_wild_id(field[1], path)
-                  # Add a wild edge to the list that's a wild location
-                  wild_edge = {}
-                  wild_edge['_out'] = panda_id
-                  wild_edge['_in'] = wild_id
-                  wild_edge['_label'] = field[0]
-                  panda_edges.append(wild_edge)
-                else:
-                  # Zoo ID rules
-                  # To differentiate Zoo IDs from pandas, use negative IDs
-                  zoo_id = str(int(field[1]) * -1)
-                  self.check_imported_zoo_id(field[1], path)
-                  # Add a birthplace or zoo edge to the list that's a zoo
-                  zoo_edge = {}
-                  zoo_edge['_out'] = panda_id
-                  zoo_edge['_in'] = zoo_id
-                  zoo_edge['_label'] = field[0]
-                  panda_edges.append(zoo_edge)
-            elif field[0].find("children") != -1:   
-                # Process children IDs
-                children = field[1].replace(" ","").split(",")
-                for child_id in children:
-                    panda_edge = {}
-                    panda_edge['_out'] = panda_id
-                    panda_edge['_in'] = child_id
-                    panda_edge['_label'] = "family"
-                    panda_edges.append(panda_edge)
-            elif field[0].find("litter") != -1:   
-                # Process whether pandas were in the same litter or not
-                litter = field[1].replace(" ","").split(",")
-                for sibling_id in litter:
-                    panda_edge = {}
-                    panda_edge['_out'] = panda_id
-                    panda_edge['_in'] = sibling_id
-                    panda_edge['_label'] = "litter"
-                    panda_edges.append(panda_edge)
-            elif (field[0].find("photo") != -1 and
-                  len(field[0].split(".")) == 2):
-                # Process a small set of photo credits for all the pandas
-                author = infile.get("panda", field[0] + ".author")
-                if author in self.photo["credit"].keys():
-                    self.photo["credit"][author] = self.photo["credit"][author] + 1
+        record = new_record("panda", path)
+        panda_edges = record['edges']
+        panda_vertex = record['vertex']
+        infile = read_fields(path, "panda")
+        panda_name = infile["en.name"]   # For error messages
+        panda_id = infile["_id"]         # or assignments
+        for field in infile.items():
+            try:
+                if (field[0].find("death") != -1 or
+                    field[0].find("birthday") != -1):
+                    # Record that an animal has died or was born, 
+                    # regardless if the date has been recorded or not.
+                    if field[1] != "unknown":
+                        year = self.check_imported_date(field[1], path)
+                        if record['summary'].get(field[0], 0) < year:
+                            record['summary'][field[0]] = year
+                    panda_vertex[field[0]] = field[1]
+                if field[1] == "unknown" or field[1] == "none":
+                    # Basic null checks. Don't add this to the vertex
+                    continue
+                elif field[0].find("name") != -1:
+                    # Name rule checking
+                    self.check_imported_name(field[1], field[0], path)
+                    panda_vertex[field[0]] = field[1]
+                elif field[0].find("gender") != -1:
+                    # Gender rules
+                    gender = self.check_imported_gender(field[1], path)
+                    panda_vertex[field[0]] = gender
+                elif (field[0].find("birthplace") != -1):
+                    if (field[1].find("wild.") != -1):
+                      # Wild ID rules
+                      wild_id = field[1]
+                      record['refs'].append(["wild", field[1]])
+                      # Add a wild edge to the list that's a wild location
+                      panda_edges.append(Edge(panda_id, wild_id, field[0]))
+                    else:
+                      # Zoo ID rules
+                      # To differentiate Zoo IDs from pandas, use negative IDs
+                      zoo_id = zoo_vertex_id(field[1], path)
+                      record['refs'].append(["zoo", field[1]])
+                      # Add a birthplace or zoo edge to the list that's a zoo
+                      panda_edges.append(Edge(panda_id, zoo_id, field[0]))
+                elif field[0].find("children") != -1:   
+                    # Process children IDs
+                    children = field[1].replace(" ","").split(",")
+                    for child_id in children:
+                        panda_edges.append(Edge(panda_id, child_id, "family"))
+                elif field[0].find("litter") != -1:   
+                    # Process whether pandas were in the same litter or not
+                    litter = field[1].replace(" ","").split(",")
+                    for sibling_id in litter:
+                        panda_edges.append(Edge(panda_id, sibling_id, "litter"))
+                elif (field[0].find("photo") != -1 and
+                      len(field[0].split(".")) == 2):
+                    # Process a small set of photo credits for all the pandas
+                    author = infile[field[0] + ".author"]
+                    record['credits'].append(author)
+                    # Track what the max number of panda photos an object has is
+                    test_count = photo_number(field[0], path)
+                    if test_count > record['photo_max']:
+                        record['photo_max'] = test_count
+                    # Accept the data and continue
+                    panda_vertex[field[0]] = field[1]
+                elif (field[0].find("wild") != -1):
+                    # Wild ID rules
+                    wild_id = field[1]
+                    record['refs'].append(["wild", field[1]])
+                    self.check_imported_panda_wild_path(field[1], path)
+                    # Add a wild edge to the list that's a wild location
+                    panda_edges.append(Edge(panda_id, wild_id, field[0]))
+                elif (field[0].find("zoo") != -1):
+                    # Zoo ID rules
+                    # To differentiate Zoo IDs from pandas, use negative IDs
+                    zoo_id = zoo_vertex_id(field[1], path)
+                    record['refs'].append(["zoo", field[1]])
+                    self.check_imported_panda_zoo_path(field[1], path)
+                    # Add a birthplace or zoo edge to the list that's a zoo
+                    panda_edges.append(Edge(panda_id, zoo_id, field[0]))
                 else:
-                    self.photo["credit"][author] = 1
-                # Track what the max number of panda photos an object has is
-                test_count = int(field[0].split(".")[1])
-                if test_count > self.photo["max"]:
-                    self.photo["max"] = test_count
-                # Accept the data and continue
-                panda_vertex[field[0]] = field[1]
-            elif (field[0].find("wild") != -1):
-                # Wild ID rules
-                wild_id = field[1]
-                self.check_imported_wild_id(field[1], path)
-                self.check_imported_panda_wild_path(field[1], path)
-                # Add a wild edge to the list that's a wild location
-                wild_edge = {}
-                wild_edge['_out'] = panda_id
-                wild_edge['_in'] = wild_id
-                wild_edge['_label'] = field[0]
-                panda_edges.append(wild_edge)
-            elif (field[0].find("zoo") != -1):
-                # Zoo ID rules
-                # To differentiate Zoo IDs from pandas, use negative IDs
-                zoo_id = str(int(field[1]) * -1)
-                self.check_imported_zoo_id(field[1], path)
-                self.check_imported_panda_zoo_path(field[1], path)
-                # Add a birthplace or zoo edge to the list that's a zoo
-                zoo_edge = {}
-                zoo_edge['_out'] = panda_id
-                zoo_edge['_in'] = zoo_id
-                zoo_edge['_label'] = field[0]
-                panda_edges.append(zoo_edge)
-            else:
-                # Accept the data and move along
-                panda_vertex[field[0]] = field[1]
-        self.edges.extend(panda_edges)
-        self.vertices.append(panda_vertex)
-        self.panda_files.append(path)
+                    # Accept the data and move along
+                    panda_vertex[field[0]] = field[1]
+            except DataError as e:
+                # With --all-errors, a field that fails its checks is left out
+                self.report.fail(e, path, field[0])
+        return record
 
-    def import_wild(self, path):
+    def parse_wild(self, path):
         """Take a single wild location file and convert it into a Python dict.
         
         Wild files are expected to have a header of [wild]. Any fields defined
         under that header will be consumed into the wild datastore. Every panda
         must have a link to a zoo or a wild location.
         """
-        wild_entry = {}
-        infile = configparser.ConfigParser()
-        infile.read(path, encoding='utf-8')
-        for field in infile.items("wild"):
+        record = new_record("wild", path)
+        wild_entry = record['vertex']
+        infile = read_fields(path, "wild")
+        for field in infile.items():
             # Use negative numbers for zoo IDs, to distinguish from pandas
             [ key, value ] = [field[0], field[1]]
             if (key.find("photo") != -1 and
                 len(key.split(".")) == 2):
-                author = infile.get("wild", key + ".author")
-                if author in self.photo["credit"].keys():
-                    self.photo["credit"][author] = self.photo["credit"][author] + 1
-                else:
-                    self.photo["credit"][author] = 1
+                author = infile[key + ".author"]
+                record['credits'].append(author)
             wild_entry[key] = value
-        self.wilds.append(wild_entry)
-        self.wild_files.append(path)
-        self.vertices.append(wild_entry)
+        return record
         
-    def import_zoo(self, path):
+    def parse_zoo(self, path):
         """Take a single zoo file and convert it into a Python dict.
         
         Zoo files are expected to have a header of [zoo]. Any fields defined
         under that header will be consumed into the zoo datastore. Every panda
         must have a link to a zoo or a wild location.
         """
-        zoo_entry = {}
-        infile = configparser.ConfigParser()
-        infile.read(path, encoding='utf-8')
-        for field in infile.items("zoo"):
+        record = new_record("zoo", path)
+        zoo_entry = record['vertex']
+        infile = read_fields(path, "zoo")
+        for field in infile.items():
             # Use negative numbers for zoo IDs, to distinguish from pandas
             [ key, value ] = [field[0], field[1]]
             if key == '_id':
-                value = str(int(field[1]) * -1)
+                value = zoo_vertex_id(field[1], path)
             elif (key.find("photo") != -1 and
                   len(key.split(".")) == 2):
-                author = infile.get("zoo", key + ".author")
-                if author in self.photo["credit"].keys():
-                    self.photo["credit"][author] = self.photo["credit"][author] + 1
-                else:
-                    self.photo["credit"][author] = 1
+                author = infile[key + ".author"]
+                record['credits'].append(author)
             zoo_entry[key] = value
-        self.zoos.append(zoo_entry)
-        self.zoo_files.append(path)
-        self.vertices.append(zoo_entry)
+        return record
 
     def find_matching_edges(self, outp, inp, label):
         """Find matching edges in either direction.
 
         Ex: If _in=8 and _out=2, match either that edge or _in=2 and _out=8
         """
-        return [a for a in self.edges
-                if ((a['_label'] == label) and
-                    ((a['_out'] == outp and a['_in'] == inp) or  
-                     (a['_in'] == outp and a['_out'] == inp)))]
+        return self.edges.between(outp, inp, label_code(label))
+
+    def kind_lists(self, kind):
+        """The list of files imported for a kind, and its vertex list if it has one."""
+        if kind == "media":
+            return [self.media_files, self.media]
+        elif kind == "panda":
+            return [self.panda_files, None]
+        elif kind == "wild":
+            return [self.wild_files, self.wilds]
+        else:
+            return [self.zoo_files, self.zoos]
+
+    def panda_path(self, panda_id):
+        """The file a panda came from, or None if there's no such panda."""
+        paths = self.paths["panda"].get(panda_id)
+        if paths == None:
+            return None
+        return paths[0]
+
+    def panda_paths(self, panda_ids):
+        """The files some pandas came from, sorted, for error reports."""
+        paths = [self.panda_path(panda_id) for panda_id in panda_ids]
+        return sorted(set(path for path in paths if path != None))
+
+    def pandas(self):
+        """Every panda vertex, in export order."""
+        return [v for v in self.vertices if self.index["panda"].get(v['_id']) is v]
+
+    def recount_summary(self):
+        """Find the latest birth and death years and the photo maximum again.
+
+        These only ever grow while files are merged, so after a file is
+        retracted they are taken from the tallies of what's left.
+        """
+        self.photo["max"] = max([0] + list(self.tallies["photo_max"]))
+        self.summary["birthday"] = max([1970] + list(self.tallies["birthday"]))
+        self.summary["death"] = max([1970] + list(self.tallies["death"]))
+
+    def retract_record(self, record):
+        """Undo merge_record, taking one file's vertex, edges, and credits out."""
+        path = record['path']
+        self.derived.clear()
+        kind = record['kind']
+        [files, kind_vertices] = self.kind_lists(kind)
+        position = bisect.bisect_left(self.file_orders[kind], tree_order(path))
+        del self.file_orders[kind][position]
+        self.edges.remove_file(path)
+        del self.vertices[self.vertex_offset(kind) + position]
+        if kind_vertices != None:
+            del kind_vertices[position]
+        del files[position]
+        del self.records[path]
+        for date_type, year in record['summary'].items():
+            tally(self.tallies[date_type], year, -1)
+        tally(self.tallies["photo_max"], record['photo_max'], -1)
+        for author in record['credits']:
+            self.photo["credit"][author] = self.photo["credit"][author] - 1
+            if self.photo["credit"][author] == 0:
+                del self.photo["credit"][author]
+        vertex = record['vertex']
+        same_id = self.paths[kind][vertex['_id']]
+        same_id.remove(path)
+        if len(same_id) == 0:
+            del self.paths[kind][vertex['_id']]
+        if self.index[kind].get(vertex['_id']) is vertex:
+            del self.index[kind][vertex['_id']]
+            # If another file had the same id, its vertex takes over
+            if len(same_id) > 0:
+                self.index[kind][vertex['_id']] = self.records[same_id[0]]['vertex']
+        self.recount_summary()
 
     def sum_pandas(self):
         """Panda count is just the count of the number of panda files imported."""
@@ -477,63 +1566,547 @@ class RedPandaGraph:
 
     def verify_media(self):
         """All checks to ensure that the group media vertices are good."""
-        self.check_dataset_duplicate_ids(self.media)
+        with self.report.check():
+            self.check_dataset_duplicate_ids(self.media)
+
+    def verify_neighborhood(self, kind, vertex_ids, panda_ids):
+        """Rerun just the dataset checks that a change to one file could break.
+
+        The changed file's old and new ids are checked for duplicates, and the
+        pandas around it are checked the way verify_pandas checks all of them:
+        their locations and relatives must exist, litter-mates must share a
+        birthday, family dates must agree, and no panda whose children
+        changed can be their own ancestor.
+        """
+        # Pandas are checked against every vertex, like verify_pandas does
+        kinds = [kind]
+        if kind == "panda":
+            kinds = [tree_type for [tree_type, _, _] in DATA_TREES]
+        same_ids = []
+        for tree_type in kinds:
+            for vertex_id in vertex_ids:
+                same_ids.extend(self.paths[tree_type].get(vertex_id, []))
+        if len(same_ids) > 1:
+            self.check_dataset_duplicate_ids([self.records[path]['vertex']
+                                              for path in same_ids])
+        pandas = [self.index["panda"][p] for p in sorted(panda_ids)
+                  if p in self.index["panda"]]
+        edges = self.edges.touching(panda_ids)
+        missing = []
+        for edge in edges:
+            if edge.label == Edge.LITTER:
+                # Reported by check_dataset_litter_ids
+                continue
+            elif edge.label == Edge.FAMILY:
+                targets = self.index["panda"]
+            elif edge.in_id.startswith("wild."):
+                targets = self.index["wild"]
+            else:
+                targets = self.index["zoo"]
+            if edge.in_id not in targets:
+                missing.append("%s lists a %s id that doesn't exist: %s"
+                               % (edge.out_id, edge.label_name(), edge.in_id))
+        if len(missing) > 0:
+            raise IdError("ERROR: ids not in the database:\n  %s"
+                          % "\n  ".join(missing))
+        self.check_dataset_litter_ids(edges)
+        self.check_dataset_dates(pandas, edges)
+        self.check_dataset_locations([self.index["panda"][p] for p in sorted(vertex_ids)
+                                      if p in self.index["panda"]])
+        if kind == "panda":
+            self.check_dataset_ancestry(set(p for p in vertex_ids
+                                            if p in self.index["panda"]))
 
     def verify_pandas(self):
         """All checks to ensure that the panda dataset is good."""
-        self.check_dataset_duplicate_ids(self.vertices)
-        # self.check_dataset_children_ids()
-        self.check_dataset_litter_ids()
-        self.check_dataset_dates()
+        with self.report.check():
+            self.check_dataset_duplicate_ids(self.vertices)
+        with self.report.check():
+            self.check_dataset_children_ids()
+        with self.report.check():
+            self.check_dataset_litter_ids()
+        with self.report.check():
+            self.check_dataset_dates()
+        self.check_dataset_locations()
 
     def verify_wilds(self):
         """All checks to ensure that the zoo dataset is good."""
-        self.check_dataset_duplicate_ids(self.wilds)
+        with self.report.check():
+            self.check_dataset_duplicate_ids(self.wilds)
 
     def verify_zoos(self):
         """All checks to ensure that the zoo dataset is good."""
-        self.check_dataset_duplicate_ids(self.zoos)
+        with self.report.check():
+            self.check_dataset_duplicate_ids(self.zoos)
+
+    def vertex_offset(self, kind):
+        """Where a kind's vertices start in self.vertices."""
+        offset = 0
+        for [tree_type, _, _] in DATA_TREES:
+            if tree_type == kind:
+                return offset
+            offset = offset + len(self.kind_lists(tree_type)[0])
+
 
+def display_name(vertex):
+    """A vertex's English name for messages, even if it failed its checks."""
+    return vertex.get('en.name', "(no en.name)")
+
+def insert_sorted(items, item):
+    """bisect.insort, but quick when the item goes at the end, as in full builds."""
+    if len(items) == 0 or items[-1] < item:
+        items.append(item)
+    else:
+        bisect.insort(items, item)
+
+def is_core_field(key):
+    """Whether a vertex field belongs in the core file of a split export."""
+    if key in CORE_FIELDS:
+        return True
+    return key.split(".")[-1] in ["name", "nicknames", "othernames", "oldnames"]
+
+def label_code(label):
+    """An edge label's index in EDGE_LABELS, adding the label if it's new."""
+    try:
+        return EDGE_LABELS.index(label)
+    except ValueError:
+        EDGE_LABELS.append(sys.intern(label))
+        return len(EDGE_LABELS) - 1
+
+def import_order(kind, path):
+    """Sort key that puts any data files in the order a full build imports them."""
+    kinds = [tree_type for [tree_type, _, _] in DATA_TREES]
+    return (kinds.index(kind), tree_order(path))
+
+def index_edge(table, label, vertex_id, edge):
+    """Index an edge under a label and vertex, in one of EdgeStore's tables."""
+    table.setdefault(label, {}).setdefault(vertex_id, []).append(edge)
+
+def list_tree(path):
+    """List the data files under a path, in the order they get imported.
+
+    Zoo and wild files sit one directory deep, while pandas and media files
+    sit two directories deep, under the zoo they belong to.
+    """
+    datapaths = []
+    for _, subdir in enumerate(sorted(os.listdir(path))):
+        subpath = os.path.join(path, subdir)
+        if os.path.isdir(subpath):
+            for _, subfile in enumerate(sorted(os.listdir(subpath))):
+                subsubpath = os.path.join(subpath, subfile)
+                if os.path.isfile(subsubpath) and subsubpath.lower().endswith(".txt"):
+                    # Zoos
+                    datapaths.append(subsubpath)
+                if os.path.isdir(subsubpath):
+                    for _, subsubfile in enumerate(sorted(os.listdir(subsubpath))):
+                        datapath = os.path.join(subsubpath, subsubfile)
+                        if os.path.isfile(datapath) and datapath.lower().endswith(".txt"):
+                            # Pandas
+                            datapaths.append(datapath)
+    return datapaths
+
+def scan_tree(path):
+    """Map each data file under a path to its modification time and size.
+
+    This walks the same files as list_tree, but with os.scandir where it's
+    available (Python 3.5 and up), which reads the file details along with
+    the directory listing. Files and folders removed during the walk are
+    left out, as if they were already gone.
+    """
+    stats = {}
+    def walk(dirpath, depth):
+        try:
+            if hasattr(os, "scandir"):
+                entries = list(os.scandir(dirpath))
+            else:
+                entries = [ListedEntry(dirpath, name) for name in os.listdir(dirpath)]
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if depth < 2:
+                        walk(entry.path, depth + 1)
+                elif depth > 0 and entry.is_file() and entry.name.lower().endswith(".txt"):
+                    stat = entry.stat()
+                    stats[entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+    walk(path, 0)
+    return stats
+
+def parse_file(job):
+    """Parse one data file in a worker process.
+
+    The job is the name of a RedPandaGraph parse method, a file path, and
+    whether errors are being collected (see validation.Report). Returns the
+    record, how long parsing took, and any errors collected. Errors that
+    stop the parse are handed back in place of the record rather than
+    raised, so the main process can report them in file order.
+    """
+    [method_name, path, collect] = job
+    start = time.perf_counter()
+    graph = RedPandaGraph(report=validation.Report(collect))
+    try:
+        result = getattr(graph, method_name)(path)
+    except Exception as e:
+        result = e
+    return [result, time.perf_counter() - start, graph.report.errors]
+
+def photo_number(field_name, sourcepath):
+    """The N of a photo.N field."""
+    try:
+        return int(field_name.split(".")[1])
+    except ValueError:
+        raise DataFormatError("ERROR: %s: photo field isn't numbered: %s"
+                              % (sourcepath, field_name))
+
+def new_record(kind, path):
+    """An empty record for everything one data file adds to the graph."""
+    record = {}
+    record['credits'] = []
+    record['edges'] = []
+    record['kind'] = kind
+    record['path'] = path
+    record['photo_max'] = 0
+    record['refs'] = []
+    record['summary'] = {}
+    record['vertex'] = {}
+    return record
+
+def tally(table, value, change):
+    """Count a value in or out of a table of value -> count."""
+    table[value] = table.get(value, 0) + change
+    if table[value] == 0:
+        del table[value]
+
+def tree_kind(path):
+    """The kind of entity a data file holds, going by its folder."""
+    for [kind, tree_path, _] in DATA_TREES:
+        if path.startswith(os.path.join(tree_path, "")):
+            return kind
+    raise ValueError("ERROR: %s: not in a data folder" % path)
+
+def tree_order(path):
+    """Sort key that puts a folder's data files in list_tree order."""
+    return path.split(os.sep)
+
+def unindex_edge(table, label, vertex_id, edge):
+    """Remove an edge that index_edge() added, dropping any emptied entries."""
+    edges = table[label][vertex_id]
+    for position, other in enumerate(edges):
+        if other is edge:
+            del edges[position]
+            break
+    if len(edges) == 0:
+        del table[label][vertex_id]
+
+def watch(graph, export_method, interval=WATCH_INTERVAL):
+    """Keep a built graph up to date as data files are saved, until interrupted.
+
+    The data folders are scanned every interval seconds (WATCH_INTERVAL,
+    half a second, by default) for files that were added, changed, or
+    removed. Each one is applied to the graph in import order, and then the
+    exports are written again. If a change breaks a check, the
+    error is printed and the exports are left alone. Files that failed are
+    retried with every later change, so fixing any file that caused the
+    error lets the exports update again.
+    """
+    def scan():
+        stats = {}
+        for [_, tree_path, _] in DATA_TREES:
+            stats.update(scan_tree(tree_path))
+        return stats
+    def changed_order(path):
+        return import_order(tree_kind(path), path)
+    seen = scan()
+    failed = set()
+    print("Watching for changes to data files. Press Ctrl-C to stop.")
+    while True:
+        time.sleep(interval)
+        current = scan()
+        changed = set(p for p in current if seen.get(p) != current[p])
+        changed.update(p for p in seen if p not in current)
+        seen = current
+        if len(changed) == 0:
+            continue
+        start = time.perf_counter()
+        retry = failed
+        failed = set()
+        for path in sorted(changed | retry, key=changed_order):
+            try:
+                graph.apply_file_change(path)
+            except (IndexError, KeyError, ValueError) as e:
+                print(e.args[0] if len(e.args) > 0 else repr(e))
+                failed.add(path)
+            except OSError as e:
+                # Usually a file renamed or removed since the scan. It's
+                # retried, and the next scan sees where it went.
+                print("ERROR: %s: %s" % (path, e))
+                failed.add(path)
+        elapsed = (time.perf_counter() - start) * 1000
+        if len(failed) > 0:
+            print("Not exporting until the errors are fixed (%d files)" % len(failed))
+            continue
+        print("Applied %d changed files in %.1f ms" % (len(changed), elapsed))
+        export_method()
+
+def zoo_vertex_id(zoo_id, sourcepath):
+    """A zoo's vertex id. These are negative, to tell them apart from pandas."""
+    try:
+        return str(int(zoo_id) * -1)
+    except ValueError:
+        raise IdError("ERROR: %s: zoo id isn't a number: %s" % (sourcepath, zoo_id))
+
+def write_indented_json(destpath, export):
+    """Write an export document as indented JSON, streaming its big lists.
+
+    The output is byte for byte what json.dumps(export, indent=4,
+    sort_keys=True) would give, but vertices and edges are serialized one
+    at a time and written out as they go, rather than as one huge string.
+    """
+    with open(destpath, 'w', encoding='utf-8', newline='\n') as wfh:
+        wfh.write("{")
+        for position, key in enumerate(sorted(export)):
+            if position > 0:
+                wfh.write(",")
+            wfh.write("\n    %s: " % json.dumps(key, ensure_ascii=False))
+            value = export[key]
+            if not isinstance(value, list) or len(value) == 0:
+                wfh.write(json.dumps(value,
+                                     ensure_ascii=False,
+                                     indent=4,
+                                     sort_keys=True).replace("\n", "\n    "))
+                continue
+            wfh.write("[")
+            for item_position, item in enumerate(value):
+                if item_position > 0:
+                    wfh.write(",")
+                wfh.write("\n        ")
+                wfh.write(json.dumps(item,
+                                     ensure_ascii=False,
+                                     indent=4,
+                                     sort_keys=True).replace("\n", "\n        "))
+            wfh.write("\n    ]")
+        wfh.write("\n}")
+
+def write_compact_json(destpath, data):
+    """Write minified JSON, returning the size and hash of what was written."""
+    content = json.dumps(data,
+                         ensure_ascii=False,
+                         separators=(',', ':'),
+                         sort_keys=True).encode('utf8')
+    with open(destpath, 'wb') as wfh:
+        wfh.write(content)
+    info = {}
+    info['hash'] = hashlib.sha1(content).hexdigest()
+    info['size'] = len(content)
+    return info
+
+def glyph_subsets(path, text):
+    """Sort the characters of one vitamin() source into glyph subsets.
+
+    Characters in a language's fields of the dataset, such as jp.location, or
+    in that language's page fragments, go in the language's subset. Where a
+    field is missing or unknown in one language, the site shows it in the
+    next language of the vertex's language.order instead, so those
+    characters go in the missing language's subset too. Panda names are
+    listed in every language on each panda's page, so they're common, like
+    everything else, which every page needs.
+    """
+    subsets = {}
+    if path == OUTPUT_PATH:
+        export = json.loads(text)
+        languages = set()
+        for vertex in export['vertices']:
+            if 'language.order' in vertex:
+                languages.update(vertex['language.order'].replace(" ", "").split(","))
+        languages.discard("")
+        for vertex in export['vertices']:
+            fields = set()
+            for key, value in vertex.items():
+                [language, _, field] = key.partition(".")
+                if language in languages:
+                    fields.add(field)
+                if language not in languages:
+                    language = "common"
+                elif field in ALL_LANGUAGE_FIELDS and vertex['_id'].isdigit():
+                    # Pandas have positive ids, and zoos negative ones
+                    language = "common"
+                subsets.setdefault(language, set()).update(value)
+            order = [l for l in vertex.get('language.order', "").replace(" ", "").split(",")
+                     if l in languages]
+            for language in languages:
+                for field in fields:
+                    if vertex.get(language + "." + field, "unknown") != "unknown":
+                        continue
+                    for fallback in order:
+                        value = vertex.get(fallback + "." + field, "unknown")
+                        if fallback != language and value != "unknown":
+                            subsets.setdefault(language, set()).update(value)
+                            break
+    else:
+        parts = os.path.normpath(path).split(os.sep)
+        if len(parts) == 3 and parts[0] == "fragments":
+            subsets[parts[1]] = set(text)
+        else:
+            subsets["common"] = set(text)
+    return dict((name, "".join(sorted(chars))) for name, chars in subsets.items())
 
 def vitamin():
     """
     Based on a completed Red Panda database, and on the contents of all Javascript and
-    HTML sources here, build a unique set of characters for display in the lineage
-    interface. This character set is necessary to instruct TypeSquare on which characters
+    HTML sources here, build unique sets of characters for display in the lineage
+    interface. These character sets are necessary to instruct TypeSquare on which characters
     we want to download in our font.
+
+    Characters every page needs go into index.html. Characters only needed for one
+    language go into that language's set in vitamins.json, which the page loads once
+    a display language is chosen, so visitors only download glyphs for their language.
+    The character sets of each source file are cached by content hash, so unchanged
+    files aren't scanned again.
     """
     vitamin = "&amp;&copy;&lsquo;&rsquo;&ldquo;&rdquo;&nacute;"  # &-encoded HTML characters to start
-    lists = []
-    manifest = [
-        "export/redpanda.json",
-        "index.html",
-        "js/pandas.js",
-        "js/show.js",
-        "fragments/en/about.html",
-        "fragments/jp/about.html",
-        "fragments/en/links.html",
-        "fragments/jp/links.html"
-    ]
-    for fn in manifest:
-        with open(fn, 'r') as rfh:
+    # Changes to glyph_subsets live in build.py, so cached subsets made by
+    # another version of it are thrown out
+    with open(os.path.abspath(__file__), 'rb') as rfh:
+        fingerprint = hashlib.sha1(rfh.read()).hexdigest()
+    cache = {}
+    try:
+        with open(VITAMIN_CACHE_PATH, 'r', encoding='utf-8') as rfh:
+            saved = json.load(rfh)
+        if saved['fingerprint'] == fingerprint:
+            cache = saved['entries']
+    except (OSError, ValueError, KeyError, TypeError):
+        # Missing or corrupt caches just mean scanning every source again
+        cache = {}
+    fresh = {}
+    subsets = {}
+    subsets["common"] = set()
+    for fn in [OUTPUT_PATH] + VITAMIN_SOURCES:
+        with open(fn, 'rb') as rfh:
             raw = rfh.read()
-            lists += list(set(raw))  # Uniquify values
-    lists = list(set(lists))   # Uniquify lists of values
-    lists.sort()
-    vitamin += ''.join(lists).replace("\n", "")
+        digest = hashlib.sha1(raw).hexdigest()
+        entry = cache.get(fn)
+        if entry == None or entry['hash'] != digest:
+            entry = {}
+            entry['hash'] = digest
+            entry['subsets'] = glyph_subsets(fn, raw.decode('utf-8'))
+        fresh[fn] = entry
+        for name, chars in entry['subsets'].items():
+            subsets.setdefault(name, set()).update(chars)
+    common = subsets.pop("common")
+    common.discard("\n")
+    vitamin += ''.join(sorted(common))
+    languages = {}
+    for name, chars in subsets.items():
+        chars.discard("\n")
+        # The common set is already in the page
+        languages[name] = ''.join(sorted(chars - common))
+    write_compact_json(VITAMINS_PATH, languages)
+    saved = {}
+    saved['entries'] = fresh
+    saved['fingerprint'] = fingerprint
+    temp_path = VITAMIN_CACHE_PATH + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as wfh:
+        json.dump(saved, wfh, ensure_ascii=False)
+    os.replace(temp_path, VITAMIN_CACHE_PATH)
     page = ""
     with open("index.html", mode='r', encoding='utf-8') as rfh:
         page = rfh.read()
         page = page.replace('${vitamins}', vitamin)
     with open("index.html", mode='w', encoding="utf-8") as wfh:
         wfh.write(page)
+    print("Font character sets: %d common, %s"
+          % (len(common), ", ".join("%d %s" % (len(languages[name]), name)
+                                    for name in sorted(languages))))
 
 if __name__ == '__main__':
     """Initialize all library settings, build, and export the database."""
-    p = RedPandaGraph()
+    parser = argparse.ArgumentParser(description="Build the Red Panda Lineage dataset.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="reuse parsed data for files unchanged since the last build")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="parse data files using N worker processes")
+    parser.add_argument("--adjacency", action="store_true",
+                        help="include precomputed neighbor tables in the exports")
+    parser.add_argument("--lineage", action="store_true",
+                        help="include precomputed ancestry tables in the exports")
+    parser.add_argument("--compact", action="store_true",
+                        help="also export the dataset in the packed v2 format")
+    parser.add_argument("--ndjson", action="store_true",
+                        help="also export the dataset as one JSON vertex or edge per line")
+    parser.add_argument("--photos", action="store_true",
+                        help="also export indexes of photos by panda and by tag")
+    parser.add_argument("--residency", action="store_true",
+                        help="also export an index of which pandas lived at each zoo, and when")
+    parser.add_argument("--search", action="store_true",
+                        help="also export a name search index")
+    parser.add_argument("--split", action="store_true",
+                        help="also export a lean core file plus per-entity detail files")
+    parser.add_argument("--snapshot", action="store_true",
+                        help="also export a binary snapshot for analysis tools")
+    parser.add_argument("--publish", action="store_true",
+                        help="also update the font character set in index.html")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each stage and write a trace to %s" % PROFILE_PATH)
+    parser.add_argument("--watch", action="store_true",
+                        help="after building, keep exporting as data files change")
+    parser.add_argument("--all-errors", action="store_true",
+                        help="report every data error, in %s, instead of stopping at the first"
+                             % VALIDATION_PATH)
+    args = parser.parse_args()
+    cache = None
+    if args.incremental:
+        cache = ImportCache(CACHE_PATH)
+    profile = None
+    if args.profile:
+        profile = profiler.Profile()
+    report = validation.Report(args.all_errors)
+    p = RedPandaGraph(cache, args.jobs, args.adjacency, args.lineage, profile, report)
     p.build_graph()
-    p.export_json_graph(OUTPUT_PATH)
+    if args.all_errors:
+        report.write(VALIDATION_PATH)
+        print(report.summary())
+        if len(report.errors) > 0:
+            sys.exit(1)
+        # Changes seen by --watch stop at their first error, as usual
+        p.report = validation.Report()
+    def export():
+        with p.profile.phase("export_json_graph"):
+            p.export_json_graph(OUTPUT_PATH)
+        if args.compact:
+            with p.profile.phase("export_json_graph v2"):
+                p.export_json_graph(COMPACT_PATH, compact.FORMAT)
+        if args.ndjson:
+            with p.profile.phase("export_ndjson_graph"):
+                p.export_ndjson_graph(NDJSON_PATH)
+        if args.photos:
+            with p.profile.phase("export_photo_index"):
+                p.export_photo_index(PHOTOS_PATH)
+        if args.residency:
+            with p.profile.phase("export_residency_index"):
+                p.export_residency_index(RESIDENCY_PATH)
+        if args.search:
+            with p.profile.phase("export_search_index"):
+                p.export_search_index(SEARCH_PATH)
+        if args.split:
+            with p.profile.phase("export_split_graph"):
+                p.export_split_graph(CORE_PATH, DETAIL_PATH, MANIFEST_PATH)
+        if args.snapshot:
+            with p.profile.phase("export_snapshot"):
+                p.export_snapshot(SNAPSHOT_PATH)
+    export()
     # Only do this in CI when publishing a real page
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "--publish":
+    if args.publish:
+        with p.profile.phase("vitamin"):
             vitamin()
+    if profile != None:
+        profile.write_trace(PROFILE_PATH)
+        print(profile.summary())
+        print("Trace written to %s" % PROFILE_PATH)
+    if args.watch:
+        try:
+            watch(p, export)
+        except KeyboardInterrupt:
+            pass
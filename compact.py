@@ -0,0 +1,197 @@
+# Compact (v2) encoding of the Red Panda Lineage JSON export.
+#
+# A v2 document holds exactly the same data as the v1 redpanda.json, packed
+# to avoid repeating field names, common values, and URL stems:
+#
+#   {
+#     "_format": 2,
+#     "_photo": { ... },            same as v1, as are any other
+#     "_totals": { ... },           sections starting with "_"
+#     "keys": [field names],
+#     "strings": [values that appear more than once],
+#     "prefixes": ["", URL stems like "https://www.instagram.com/p/"],
+#     "suffixes": ["", URL endings like "/media/?size=m"],
+#     "vertices": [[key, value, key, value, ...], ...],
+#     "edges": {"_in": [...], "_label": [...], "_out": [...]}
+#   }
+#
+# Each vertex is a flat array of key/value pairs, where each key is an index
+# into "keys". Each value is one of:
+#   - a string, used as is
+#   - an integer n, meaning strings[n]
+#   - an array [p, middle] or [p, middle, s], meaning
+#     prefixes[p] + middle + suffixes[s]
+# Edges are stored as three columns. Each "_out" and "_in" entry is an index
+# into "vertices" (or, rarely, an id string for a vertex not in the dataset),
+# and each "_label" entry is a value as described above.
+#
+# The decoder below, and Pandas.decodeCompact in js/pandas.js, expand a v2
+# document back into the v1 layout.
+
+from collections import Counter
+
+FORMAT = 2
+# Stems shorter than this aren't worth a table entry
+MIN_STEM_LENGTH = 8
+
+def decode(doc):
+    """Expand a v2 document into the v1 layout of vertices and edges."""
+    keys = doc['keys']
+    strings = doc['strings']
+    prefixes = doc['prefixes']
+    suffixes = doc['suffixes']
+    def value(encoded):
+        if isinstance(encoded, int):
+            return strings[encoded]
+        if isinstance(encoded, list):
+            if len(encoded) > 2:
+                return prefixes[encoded[0]] + encoded[1] + suffixes[encoded[2]]
+            return prefixes[encoded[0]] + encoded[1]
+        return encoded
+    vertices = []
+    for row in doc['vertices']:
+        vertex = {}
+        for i in range(0, len(row), 2):
+            vertex[keys[row[i]]] = value(row[i + 1])
+        vertices.append(vertex)
+    def vertex_id(encoded):
+        if isinstance(encoded, int):
+            return vertices[encoded]['_id']
+        return encoded
+    edges = []
+    columns = doc['edges']
+    for i in range(len(columns['_label'])):
+        edge = {}
+        edge['_in'] = vertex_id(columns['_in'][i])
+        edge['_label'] = value(columns['_label'][i])
+        edge['_out'] = vertex_id(columns['_out'][i])
+        edges.append(edge)
+    export = {}
+    for key in doc:
+        if key.startswith("_") and key != "_format":
+            export[key] = doc[key]
+    export['edges'] = edges
+    export['vertices'] = vertices
+    return export
+
+def encode(export):
+    """Pack a v1 export (vertices, edges, _photo, _totals) into a v2 document."""
+    values = Counter()
+    key_counts = Counter()
+    for vertex in export['vertices']:
+        key_counts.update(vertex.keys())
+        values.update(vertex.values())
+    values.update(edge['_label'] for edge in export['edges'])
+    keys = ranked(key_counts)
+    # Values that repeat go in the string table, most common first. The rest
+    # are candidates for having their stems shared.
+    strings = ranked(Counter(dict((v, c) for v, c in values.items() if c > 1)))
+    unique = [v for v, c in values.items() if c == 1]
+    candidate_prefixes = stem_counts(unique, url_prefixes)
+    candidate_suffixes = stem_counts(unique, url_suffixes)
+    # Pick the longest shared stems for each value, then only keep the stems
+    # that ended up being picked
+    stems = {}
+    for raw in unique:
+        prefix = longest_match(url_prefixes(raw), candidate_prefixes)
+        suffix = longest_match(url_suffixes(raw), candidate_suffixes)
+        if len(prefix) + len(suffix) > len(raw):
+            # Stems overlap on a short value; only use the prefix
+            suffix = ""
+        if prefix != "" or suffix != "":
+            stems[raw] = (prefix, suffix)
+    prefixes = [""] + ranked(Counter(p for p, _ in stems.values() if p != ""))
+    suffixes = [""] + ranked(Counter(s for _, s in stems.values() if s != ""))
+    key_index = index_of(keys)
+    string_index = index_of(strings)
+    prefix_index = index_of(prefixes)
+    suffix_index = index_of(suffixes)
+    def value(raw):
+        if raw in string_index:
+            return string_index[raw]
+        if raw not in stems:
+            return raw
+        (prefix, suffix) = stems[raw]
+        middle = raw[len(prefix):len(raw) - len(suffix)]
+        if suffix == "":
+            return [prefix_index[prefix], middle]
+        return [prefix_index[prefix], middle, suffix_index[suffix]]
+    vertex_index = {}
+    rows = []
+    for position, vertex in enumerate(export['vertices']):
+        vertex_index.setdefault(vertex['_id'], position)
+        row = []
+        for key in sorted(vertex.keys()):
+            row.append(key_index[key])
+            row.append(value(vertex[key]))
+        rows.append(row)
+    columns = {}
+    columns['_in'] = [vertex_index.get(e['_in'], e['_in']) for e in export['edges']]
+    columns['_label'] = [value(e['_label']) for e in export['edges']]
+    columns['_out'] = [vertex_index.get(e['_out'], e['_out']) for e in export['edges']]
+    doc = {}
+    for key in export:
+        # Other sections, like _photo and _totals, are kept as they are
+        if key.startswith("_"):
+            doc[key] = export[key]
+    doc['_format'] = FORMAT
+    doc['edges'] = columns
+    doc['keys'] = keys
+    doc['prefixes'] = prefixes
+    doc['strings'] = strings
+    doc['suffixes'] = suffixes
+    doc['vertices'] = rows
+    return doc
+
+def index_of(table):
+    return dict((entry, i) for i, entry in enumerate(table))
+
+def longest_match(candidates, table):
+    """The longest of the candidate stems that made it into a stem table."""
+    best = ""
+    for candidate in candidates:
+        if candidate in table and len(candidate) > len(best):
+            best = candidate
+    return best
+
+def ranked(counts):
+    """Table entries ordered most common first, so they get short indexes."""
+    return [entry for entry, _ in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+
+def stem_counts(raw_values, stems):
+    """Count the stems shared by more than one value."""
+    counts = Counter()
+    for raw in raw_values:
+        counts.update(stems(raw))
+    return Counter(dict((s, c) for s, c in counts.items() if c > 1))
+
+def url_prefixes(raw):
+    """Each way to cut a URL after a slash, past the scheme and host."""
+    start = raw.find("://")
+    if start == -1:
+        return []
+    stems = []
+    cut = raw.find("/", start + 3)
+    while cut != -1:
+        stem = raw[:cut + 1]
+        if len(stem) >= MIN_STEM_LENGTH and len(stem) < len(raw):
+            stems.append(stem)
+        cut = raw.find("/", cut + 1)
+    return stems
+
+def url_suffixes(raw):
+    """Each way to cut a URL before a slash, keeping the ending."""
+    start = raw.find("://")
+    if start == -1:
+        return []
+    host_end = raw.find("/", start + 3)
+    if host_end == -1:
+        return []
+    stems = []
+    cut = raw.rfind("/")
+    while cut > host_end:
+        stem = raw[cut:]
+        if len(stem) >= MIN_STEM_LENGTH:
+            stems.append(stem)
+        cut = raw.rfind("/", 0, cut)
+    return stems
@@ -0,0 +1,139 @@
+# Reader and writer for the Red Panda Lineage data file format, shared by the
+# dataset builder and the dataset management tool.
+
+import datetime
+import re
+
+from collections import OrderedDict
+from shared import DataFormatError, FieldError, SectionNameError
+
+COMMENT_PREFIXES = ("#", ";")
+DELIMITERS = (":", "=")
+SECTION = re.compile(r"\[(?P<header>.+)\]")
+
+class DataFields(OrderedDict):
+    """
+    The fields of one data file, in the order they were read. Looking up a field
+    that isn't in the file raises a FieldError naming the file, rather than a
+    bare KeyError.
+    """
+    path = None
+
+    def __missing__(self, key):
+        raise FieldError("ERROR: %s: missing field: %s" % (self.path, key))
+
+def field_sort_key(field_name):
+    """
+    If there's a number in the field name, translate it to its ASCII value.
+    This way, the sorting of the number is preserved, rather than treating
+    the digits like characters themselves. So photo.2 sorts before photo.10.
+    """
+    components = field_name.split(".")
+    output = []
+    for val in components:
+        if val.isdigit():
+            val = chr(int(val))
+        output.append(val)
+    return ".".join(output)
+
+def parse_fields(lines, path, section=None, delimiters=DELIMITERS):
+    """
+    Parse the lines of a data file in a single pass.
+
+    Data files are a single [section] header followed by flat `key: value`
+    lines. This follows the same rules configparser used for our files:
+      - Keys are case-folded to lowercase, and both keys and values are
+        stripped of surrounding whitespace.
+      - Each line is split on the first delimiter found in it.
+      - Lines indented deeper than the field they follow continue its value,
+        joined with newlines. Blank lines inside a value are kept, but
+        trailing whitespace on the value is not.
+      - Lines starting with # or ; are comments.
+      - Duplicate keys are an error.
+    Unlike configparser, a % sign in a value is just a % sign.
+
+    If a section name is given, the file's header must match it.
+    """
+    raw = OrderedDict()
+    header = None
+    values = None
+    indent_level = 0
+    for lineno, line in enumerate(lines, start=1):
+        value = line.strip()
+        if value == "":
+            # Blank lines only matter if a continuation line comes next
+            if values != None:
+                values.append("")
+            continue
+        if value.startswith(COMMENT_PREFIXES):
+            continue
+        indent = len(line) - len(line.lstrip())
+        if values != None and indent > indent_level:
+            values.append(value)
+            continue
+        indent_level = indent
+        match = SECTION.match(value)
+        if match:
+            if header != None:
+                raise DataFormatError("ERROR: %s: line %d: more than one section header"
+                                      % (path, lineno))
+            header = match.group('header')
+            if section != None and header != section:
+                raise SectionNameError("ERROR: %s: expected [%s] header, found [%s]"
+                                       % (path, section, header))
+            values = None
+            continue
+        if header == None:
+            raise DataFormatError("ERROR: %s: line %d: field before any section header"
+                                  % (path, lineno))
+        split = -1
+        for delimiter in delimiters:
+            index = value.find(delimiter)
+            if index != -1 and (split == -1 or index < split):
+                split = index
+        if split <= 0:
+            raise DataFormatError("ERROR: %s: line %d: not a 'key: value' line: %s"
+                                  % (path, lineno, value))
+        key = value[:split].rstrip().lower()
+        if key in raw:
+            raise DataFormatError("ERROR: %s: line %d: duplicate field: %s"
+                                  % (path, lineno, key))
+        values = [value[split + 1:].strip()]
+        raw[key] = values
+    if header == None and section != None:
+        raise SectionNameError("ERROR: %s: missing [%s] header" % (path, section))
+    fields = DataFields()
+    fields.path = path
+    for key, values in raw.items():
+        if len(values) == 1:
+            fields[key] = values[0]
+        else:
+            fields[key] = "\n".join(values).rstrip()
+    return fields
+
+def read_date(date):
+    """Convert a YYYY/MM/DD date into a datetime.date, or None if unknown."""
+    if date == None or date == "unknown":
+        return None
+    [year, month, day] = date.split("/")
+    return datetime.date(int(year), int(month), int(day))
+
+def read_fields(path, section=None, delimiters=DELIMITERS):
+    """Read a data file into an ordered mapping of its fields."""
+    with open(path, 'r', encoding='utf-8') as rfh:
+        return parse_fields(rfh, path, section, delimiters)
+
+def sorted_fields(fields):
+    """Return the fields in the order they are written back to data files."""
+    return OrderedDict(sorted(fields.items(),
+                              key=lambda item: field_sort_key(item[0])))
+
+def write_fields(wfh, section, fields):
+    """
+    Write a data file: the section header, then one `key: value` line per field,
+    in the order given. Multi-line values get tab-indented continuation lines.
+    """
+    lines = ["[%s]\n" % section]
+    for key, value in fields.items():
+        lines.append("%s: %s\n" % (key, str(value).replace("\n", "\n\t")))
+    wfh.write("".join(lines))
@@ -1251,6 +1251,41 @@ Language.L.update = function() {
   // Write localStorage for your chosen language. This is better than a cookie
   // since the server never has to see what language you're using in each request.
   this.storage.setItem('language', this.display);
+  // Load font glyphs for the chosen language
+  this.vitamins();
+}
+
+// The page only carries font glyphs that every language needs. Characters
+// used by just one language are listed in vitamins.json, and are added to the
+// page when that language is displayed, so TypeSquare loads their glyphs.
+Language.L.vitamins = function() {
+  var language = this.display;
+  var holder = document.getElementById('languageVitamins');
+  if ((holder == undefined) || (holder.dataset.language == language)) {
+    return;
+  }
+  var apply = function(glyphs) {
+    if ((glyphs == null) || (glyphs[language] == undefined)) {
+      return;
+    }
+    holder.innerText = glyphs[language];
+    holder.dataset.language = language;
+    if (typeof Ts != "undefined") {
+      Ts.loadFont();   // Have TypeSquare pick up the new characters
+    }
+  }
+  if (this.glyphs != undefined) {
+    apply(this.glyphs);
+    return;
+  }
+  var request = new XMLHttpRequest();
+  request.open('GET', "/export/vitamins.json");
+  request.responseType = 'json';
+  request.send();
+  request.onload = function() {
+    L.glyphs = request.response;
+    apply(L.glyphs);
+  }
 }
 
 /*
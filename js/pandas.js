@@ -28,12 +28,63 @@ Pandas.init = function() {
   request.send();
   request.onload = function() {
     pandas.db = request.response;
+    if (pandas.db["_format"] == 2) {
+      pandas.db = Pandas.decodeCompact(pandas.db);
+    }
     window.dispatchEvent(Pandas.loaded);   // Report the data has loaded
   }
 
   return pandas;
 }
 
+Pandas.decodeCompact = function(doc) {
+  /* Expand a packed v2 dataset into the usual vertices and edges layout.
+
+  Vertices are flat [key, value, key, value...] arrays, with keys as indexes
+  into doc.keys. A value is either a plain string, an index into doc.strings,
+  or a [prefix, middle, suffix] array whose ends index into doc.prefixes and
+  doc.suffixes. Edges are columns, with _in and _out as vertex indexes.
+  The format is described in full in compact.py.
+  */
+  var value = function(encoded) {
+    if (typeof encoded == "number") {
+      return doc.strings[encoded];
+    }
+    if (Array.isArray(encoded)) {
+      var suffix = (encoded.length > 2) ? doc.suffixes[encoded[2]] : "";
+      return doc.prefixes[encoded[0]] + encoded[1] + suffix;
+    }
+    return encoded;
+  }
+  var vertices = doc.vertices.map(function(row) {
+    var vertex = {};
+    for (var i = 0; i < row.length; i += 2) {
+      vertex[doc.keys[row[i]]] = value(row[i + 1]);
+    }
+    return vertex;
+  });
+  var vertex_id = function(encoded) {
+    return (typeof encoded == "number") ? vertices[encoded]["_id"] : encoded;
+  }
+  var edges = doc.edges["_label"].map(function(label, i) {
+    return {
+      "_in": vertex_id(doc.edges["_in"][i]),
+      "_label": value(label),
+      "_out": vertex_id(doc.edges["_out"][i])
+    };
+  });
+  var db = {
+    "edges": edges,
+    "vertices": vertices
+  };
+  Object.keys(doc).forEach(function(key) {
+    if ((key[0] == "_") && (key != "_format")) {
+      db[key] = doc[key];   // _photo, _totals, and other sections
+    }
+  });
+  return db;
+}
+
 /*
     Defaults for a panda or zoo if a piece of information is missing
 */
@@ -4,61 +4,146 @@
 # revisions, such as ensuring that a field exists in each panda or zoo file, or removing
 # photos taken by a specific credited author.
 
-import configparser
+import io
+import json
+import multiprocessing
 import os
+import profiler
 import re
+import shutil
 import sys
+import time
 
 from collections import OrderedDict
-from shared import MEDIA_PATH, PANDA_PATH, ZOO_PATH, SectionNameError
+from datafile import read_fields, sorted_fields, write_fields
+from shared import AUTHOR_INDEX_PATH, MEDIA_PATH, PANDA_PATH, PROFILE_PATH, ZOO_PATH, SectionNameError
 
-class ProperlyDelimitedConfigParser(configparser.ConfigParser):
+# Batch operations that name the file or folder they apply to
+BATCH_OPERATIONS = ["copy-field", "delete-field", "move-field", "remove-photo"]
+# Fields belonging to one photo: photo.N, or photo.N.author and so on
+PHOTO_FIELD = re.compile(r"^photo\.(\d+)(\.(.+))?$")
+
+class AuthorIndex():
     """
-    Standardizes use of ConfigParser for all panda/zoo/media data files, specifically
-    the use of colon+space ': ' as the delimiter between key and value. The base
-    ConfigParser class surprisingly didn't support this. Also, we change the newline
-    writing behavior, because each data file we write only has a single [config] section.
+    A reverse index from photo authors to the data files and photo indexes that
+    credit them, saved between runs. Each file's entry records the file's mtime
+    and size, so refreshing the index only re-reads files that changed since.
+    Operations on one author can then open just the files that author is in.
     """
-    def write(self, fp, space_around_delimiters=True):
-        if space_around_delimiters:
-            d = "{} ".format(self._delimiters[0])
-        else:
-            d = self._delimiters[0]
-        if self._defaults:
-            self._write_section(fp, self.default_section,
-                                self._defaults.items(), d)
-
-    def _write_section(self, fp, section_name, section_items, delimiter):
-        """Write a single section to the specified `fp'."""
-        fp.write("[{}]\n".format(section_name))
-        for key, value in section_items:
-            value = self._interpolation.before_write(self, section_name, key,
-                                                     value)
-            if value is not None or not self._allow_no_value:
-                value = delimiter + str(value).replace('\n', '\n\t')
-            else:
-                value = ""
-            fp.write("{}{}\n".format(key, value))
+    def __init__(self, index_path, data_paths):
+        self.data_paths = data_paths
+        self.files = {}
+        self.index_path = index_path
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as rfh:
+                self.files = json.load(rfh)['files']
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable index means reading every file once
+            self.files = {}
+
+    def authors_in(self, path):
+        """
+        Read the photo authors in one data file, as author -> photo indexes.
+        """
+        authors = {}
+        fields = read_fields(path, section_for_path(path), delimiters=(':',))
+        for field_name, value in fields.items():
+            components = field_name.split(".")
+            if (len(components) == 3 and components[0] == "photo" and
+                components[2] == "author"):
+                authors.setdefault(value, []).append(int(components[1]))
+        return authors
+
+    def find(self, author):
+        """
+        Return (path, photo index) pairs for every photo credited to an author.
+        """
+        found = []
+        for path in sorted(self.files.keys()):
+            for photo_index in self.files[path]['authors'].get(author, []):
+                found.append((path, photo_index))
+        return found
+
+    def refresh(self):
+        """
+        Bring the index up to date, re-reading only new or changed files and
+        dropping files that no longer exist.
+        """
+        seen = set()
+        for data_path in self.data_paths:
+            for root, dirs, files in os.walk(data_path):
+                for filename in files:
+                    if not filename.lower().endswith(".txt"):
+                        # Photos, READMEs and editor files aren't data files
+                        continue
+                    path = root + os.sep + filename
+                    seen.add(path)
+                    self.update(path)
+        for path in list(self.files.keys()):
+            if path not in seen:
+                del self.files[path]
+
+    def save(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as wfh:
+            json.dump({"files": self.files}, wfh, ensure_ascii=False, sort_keys=True)
+        replace_file(temp_path, self.index_path)
+
+    def update(self, path):
+        """
+        Re-read a file's authors if it changed since it was last indexed.
+        """
+        stat = os.stat(path)
+        entry = self.files.get(path)
+        if (entry != None and entry['mtime'] == stat.st_mtime_ns and
+            entry['size'] == stat.st_size):
+            return
+        entry = {}
+        entry['authors'] = self.authors_in(path)
+        entry['mtime'] = stat.st_mtime_ns
+        entry['size'] = stat.st_size
+        self.files[path] = entry
 
 class PhotoFile():
     """
     Handles a config file for a panda/zoo/media entry. Track the photos inside one
-    of these files, and support deletion operations. Since the ConfigParser API is
-    a little bit clunky and since we have an object for dealing with these PhotoFiles
-    anyways, wrap the ConfigParser primitives with easier-to-read sugar.
+    of these files, and support deletion operations. The fields are read once, and
+    wrapped here with easier-to-read sugar. Fields are delimited by colon+space ': ',
+    and each file has a single [section] header.
+
+    Photo fields (photo.N, photo.N.author, photo.N.link, photo.N.tags, and any other
+    photo.N.* field like photo.N.tags.<id>.location) are kept in a photo table, which
+    maps each photo index to that photo's fields. Deleting or renumbering photos moves
+    whole table entries, rather than probing for one field at a time.
     """
     def __init__(self, section, file_path):
         if section == None:
             raise SectionNameError("""Using wrong section ID to look for photos: %s""" % str(section))
 
         self.section = section
-        # TODO: throw exception for section = None
-        self.config = ProperlyDelimitedConfigParser(default_section=self.section, delimiters=(':'))
-        self.config.read(file_path, encoding="utf-8")
+        self.fields = OrderedDict()
+        self.photos = {}
+        for field_name, value in read_fields(file_path, self.section, delimiters=(':',)).items():
+            self.set_field(field_name, value)
         self.file_path = file_path
-        
+
+    def __photo_field(self, field_name):
+        """
+        Split a photo field name into its photo index and the rest of the name,
+        like "photo.3.author" -> (3, "author"), or "photo.3" -> (3, "").
+        Return None for fields that aren't about a photo.
+        """
+        match = PHOTO_FIELD.match(field_name)
+        if match == None:
+            return None
+        return (int(match.group(1)), match.group(3) or "")
+
     def has_field(self, field_name):
-        return self.config.has_option(self.section, field_name)
+        photo_field = self.__photo_field(field_name)
+        if photo_field != None:
+            (index, name) = photo_field
+            return index in self.photos and name in self.photos[index]
+        return field_name in self.fields
 
     def get_array(self, field_name):
         """
@@ -66,7 +151,7 @@ class PhotoFile():
         an array of values.
         """
         if self.has_field(field_name):
-            result = self.config.get(self.section, field_name)
+            result = self.get_field(field_name)
             if (result.find(",") != -1):
                 return result.replace(" ", "").split(",")
             else:
@@ -79,17 +164,25 @@ class PhotoFile():
         comma-separated values, return a list of values. If the value doesn't exist,
         return [] so that other loops can iterate on an empty value.
         """
-        if self.has_field(field_name):
-            return self.config.get(self.section, field_name)
-        else:
+        if self.has_field(field_name) == False:
             return None
+        photo_field = self.__photo_field(field_name)
+        if photo_field != None:
+            (index, name) = photo_field
+            return self.photos[index][name]
+        return self.fields[field_name]
 
     def set_field(self, field_name, value):
         """
         Set a value in the data file.
         """
         # print("DEBUG SET: " + str(field_name) + " -- " + str(value))
-        self.config.set(self.section, field_name, value)
+        photo_field = self.__photo_field(field_name)
+        if photo_field != None:
+            (index, name) = photo_field
+            self.photos.setdefault(index, OrderedDict())[name] = value
+        else:
+            self.fields[field_name] = value
 
     def copy_field(self, dest_field, source_field):
         """
@@ -106,8 +199,16 @@ class PhotoFile():
         Given a field name, and given the existence of that as a key-value pair in
         the data file, remove that field from the file.
         """
-        if self.has_field(field_name):
-            self.config.remove_option(self.section, field_name)
+        if self.has_field(field_name) == False:
+            return
+        photo_field = self.__photo_field(field_name)
+        if photo_field != None:
+            (index, name) = photo_field
+            del self.photos[index][name]
+            if len(self.photos[index]) == 0:
+                del self.photos[index]
+        else:
+            del self.fields[field_name]
 
     def move_field(self, dest_field, source_field):
         """
@@ -118,179 +219,272 @@ class PhotoFile():
             self.delete_field(source_field)
         return self.has_field(dest_field)
 
-    def __strings_number_sensitive(self, input):
-        """
-        If there's a number in the filename, translate it to its ASCII value.
-        This way, the sorting of the number is preserved, rather than treating 
-        the digits like characters themselves
-        """
-        components = input[0].split(".")
-        output = []
-        for val in components:
-            if val.isdigit():
-                val = chr(int(val))
-            output.append(val)
-        return ".".join(output)
-
     def update_file(self):
         """
         Write the config file out, in alphabetical sorted order just as they are read in.
+        The photo table is turned back into photo.N fields first. The file is only written
+        if its contents changed, and is replaced atomically by writing a temporary file
+        and renaming it. Return True if the file was written.
         """
-        with open(self.file_path, 'w', encoding='utf-8') as wfh:
-            # Sort the sections before writing
-            self.config._defaults = OrderedDict(
-                sorted(self.config._defaults.items(), key=self.__strings_number_sensitive))
-            self.config.write(wfh)
+        fields = OrderedDict(self.fields)
+        for index, photo in self.photos.items():
+            for name, value in photo.items():
+                if name == "":
+                    fields["photo." + str(index)] = value
+                else:
+                    fields["photo." + str(index) + "." + name] = value
+        fields = sorted_fields(fields)
+        output = io.StringIO()
+        write_fields(output, self.section, fields)
+        content = output.getvalue().encode('utf-8')
+        with open(self.file_path, 'rb') as rfh:
+            if rfh.read() == content:
+                return False
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, 'wb') as wfh:
+            wfh.write(content)
+        replace_file(temp_path, self.file_path)
+        return True
 
     def delete_photo(self, index):
         """
-        Given an index, delete a photo from the data file. 
-        If the baseline photo.X field isn't found, then assume none of the other 
-        fields are defined and return False.
+        Given an index, delete a photo and all of its photo.N.* fields from the data
+        file, including the location tags for group photos. If the baseline photo.X
+        field isn't found, then assume none of the other fields are defined and
+        return False.
         """
-        photo_option = "photo." + str(index)
-        if self.has_field(photo_option) == False:
+        index = int(index)
+        if self.has_field("photo." + str(index)) == False:
             return False
-        author_option = photo_option + ".author"
-        author_link = photo_option + ".link"
-        author_tags = photo_option + ".tags"
-        panda_tags = "panda.tags"
-        # print("DEBUG REMOVE: " + path + " -- " + photo_author + " -- " + photo_option)
-        self.delete_field(photo_option)
-        self.delete_field(author_option)
-        self.delete_field(author_link)
-        self.delete_field(author_tags)
-        # For location group-photo tag lines, look for the numbers in the tag section, 
-        # and remove any corresponding location tags from the groups section
-        for panda_id in self.get_array(panda_tags):
-            photo_location_tag = author_tags + "." + panda_id + ".location"
-            self.delete_field(photo_location_tag)
+        del self.photos[index]
         return True
 
-    def __fetch_next_photo_index(self, start_point, stop_point):
-        """
-        Given we deleted pandas from a dataset entry, find the first available hole in
-        the list of photos, and the next available photo to move into that hole.
-        """
-        photo_index = start_point
-        photo_option = "photo." + str(photo_index)
-        is_photo = self.has_field(photo_option)
-        if is_photo == True:
-            # Find the first hole (slot without a photo)
-            while is_photo == True:
-                photo_index = photo_index + 1
-                photo_option = "photo." + str(photo_index)
-                is_photo = self.has_field(photo_option)
-                if photo_index > stop_point:
-                    return 0
-        # Now that we're in holes, find the next valid photo
-        while is_photo == False:
-            photo_index = photo_index + 1
-            photo_option = "photo." + str(photo_index)
-            is_photo = self.has_field(photo_option)
-            # If start point went beyond the last photo, return zero
-            if photo_index > stop_point:
-                return 0
-        return photo_index
-
-    def renumber_photos(self, stop_point):
+    def renumber_photos(self):
         """
         After a deletion operation, renumber all photos in the file so that
-        there are no gaps in the photo numbering.
+        there are no gaps in the photo numbering, keeping them in order.
         """
-        start_index = 1
-        photo_index = start_index
-        while photo_index <= stop_point:
-            # If a photo doesn't exist, find the next photo that exists and swap its value
-            photo_option = "photo." + str(photo_index)
-            photo_author = photo_option + ".author"
-            photo_link = photo_option + ".link"
-            photo_tags = photo_option + ".tags"
-            panda_tags = "panda.tags"
-            if self.has_field(photo_option) == False:
-                next_index = self.__fetch_next_photo_index(photo_index, stop_point)
-                next_option = "photo." + str(next_index)
-                next_author = next_option + ".author"
-                next_link = next_option + ".link"
-                next_tags = next_option + ".tags"
-                if self.has_field(next_option) == True:
-                    self.move_field(photo_option, next_option)
-                    self.move_field(photo_author, next_author)
-                    self.move_field(photo_link, next_link)
-                    self.move_field(photo_tags, next_tags)
-                    for panda_id in self.get_array(panda_tags):
-                        photo_location_tag = photo_tags + "." + panda_id + ".location"
-                        next_location_tag = next_tags + "." + panda_id + ".location"
-                        self.move_field(photo_location_tag, next_location_tag)
-            photo_index = photo_index + 1
-            
+        renumbered = {}
+        for new_index, old_index in enumerate(sorted(self.photos.keys()), start=1):
+            renumbered[new_index] = self.photos[old_index]
+        self.photos = renumbered
+
     def remove_author(self, author):
         """
         Given all entries in a photo file with a matching author entry, remove those 
-        fields from the photos list.
+        fields from the photos list. Return how many photos were removed, so the
+        caller can renumber the ones that are still there.
         """
-        start_index = 1
-        removals = 0
-        photo_index = start_index
-        author_option = "photo." + str(photo_index) + ".author"
-        while self.has_field(author_option):
-            photo_author = self.get_field(author_option)
-            if author == photo_author:
-                self.delete_photo(photo_index)
-                removals = removals + 1
-            photo_index = photo_index + 1
-            author_option = "photo." + str(photo_index) + ".author"
-        # Next, renumber the ones that are still there
-        if removals > 0:
-            self.renumber_photos(photo_index)
-
-def remove_author_from_lineage(author):
+        removals = [index for index, photo in self.photos.items()
+                    if photo.get("author") == author]
+        for index in removals:
+            del self.photos[index]
+        return len(removals)
+
+def apply_batch(manifest_path, jobs=1, profile=None):
+    """
+    Apply a manifest of many operations in a single pass over the dataset.
+
+    The manifest is a JSON list of operations, applied in order:
+      {"op": "remove-author", "author": "name"}
+      {"op": "remove-photo", "path": "./pandas/.../0001_harumaki.txt", "photo": 3}
+      {"op": "copy-field", "path": "./zoos", "dest": "field", "source": "field"}
+      {"op": "move-field", "path": "./zoos", "dest": "field", "source": "field"}
+      {"op": "delete-field", "path": "./pandas", "field": "field"}
+    A path may be a single data file, or a folder whose files all get the
+    operation. Authors are found through the author index.
+
+    Operations are grouped by the file they touch, and each file is read
+    once, has its operations applied, and is written only if it changed.
+    Files are processed by a pool of worker processes.
+
+    Photo numbers in remove-photo operations are the numbers the photos
+    had before the batch. A file's photos are renumbered once, after all
+    of its operations, so removing photos 1 and 3 removes the original
+    photos 1 and 3.
+    """
+    if profile == None:
+        profile = profiler.Profile(enabled=False)
+    with open(manifest_path, 'r', encoding='utf-8') as rfh:
+        operations = json.load(rfh)
+    index = AuthorIndex(AUTHOR_INDEX_PATH, [PANDA_PATH, ZOO_PATH, MEDIA_PATH])
+    with profile.phase("AuthorIndex.refresh"):
+        index.refresh()
+    per_file = {}
+    for operation in operations:
+        if operation['op'] == "remove-author":
+            paths = sorted(set(path for (path, _) in index.find(operation['author'])))
+        elif operation['op'] in BATCH_OPERATIONS:
+            paths = data_files_under(operation['path'])
+        else:
+            raise ValueError("Unknown batch operation: %s" % operation['op'])
+        for path in paths:
+            per_file.setdefault(index_path(path), []).append(operation)
+    work = sorted(per_file.items())
+    with profile.phase("apply_operations", {'files': len(work), 'jobs': jobs}):
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(apply_operations, work)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [apply_operations(job) for job in work]
+    for (path, _, elapsed) in results:
+        profile.add_file(path, elapsed)
+    changed = [path for (path, written, _) in results if written == True]
+    with profile.phase("AuthorIndex.save"):
+        for path in changed:
+            index.update(path)
+        index.save()
+    print("Applied %d operations to %d files, %d of which changed"
+          % (len(operations), len(work), len(changed)))
+
+def apply_operations(job):
+    """
+    Apply a list of batch operations to one data file, writing it only if its
+    contents changed. Return the path, whether the file was written, and
+    how long it took.
+    """
+    [path, operations] = job
+    start = time.perf_counter()
+    photo_list = PhotoFile(section_for_path(path), path)
+    removed = False
+    for operation in operations:
+        if operation['op'] == "copy-field":
+            photo_list.copy_field(operation['dest'], operation['source'])
+        elif operation['op'] == "delete-field":
+            photo_list.delete_field(operation['field'])
+        elif operation['op'] == "move-field":
+            photo_list.move_field(operation['dest'], operation['source'])
+        elif operation['op'] == "remove-author":
+            if photo_list.remove_author(operation['author']) > 0:
+                removed = True
+        elif operation['op'] == "remove-photo":
+            if photo_list.delete_photo(operation['photo']) == True:
+                removed = True
+    # Renumber once, so every operation used the original photo numbers
+    if removed:
+        photo_list.renumber_photos()
+    written = photo_list.update_file()
+    return (path, written, time.perf_counter() - start)
+
+def data_files_under(path):
+    """
+    List a single data file, or all of the data files in a folder.
+    """
+    if os.path.isfile(path):
+        return [path]
+    found = []
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            if filename.lower().endswith(".txt"):
+                found.append(root + os.sep + filename)
+    return sorted(found)
+
+def index_path(path):
+    """
+    A data file's path in the form the author index uses, like ./pandas/...,
+    so that the same file given as pandas/... or ./pandas/./... is always
+    grouped under one path.
+    """
+    return os.path.join(".", os.path.relpath(path))
+
+def remove_author_from_lineage(author, profile=None):
     """
     Occasionally users will remove or rename their photo files online.
     For cases where the original files cannot be recovered, it may be
     simpler to remove photos by an author and add them back later.
 
     Given a author (typically an Instagram username), remove their photos
-    from every panda or zoo data entry.
+    from every panda or zoo data entry. The author index is used to find
+    which files credit the author, and only those files are rewritten.
     """
-    for file_path in [PANDA_PATH, ZOO_PATH, MEDIA_PATH]:
-        section = None
-        for section_name in ["media", "zoos", "pandas"]:
-            if section_name in file_path.split("/"):
-                section = section_name.split("s")[0]   # HACK
-        # Enter the pandas subdirectories
-        for root, dirs, files in os.walk(file_path):
-            for filename in files:
-                path = root + os.sep + filename
-                photo_list = PhotoFile(section, path)
-                photo_list.remove_author(author)
-                # Done? Let's write config
-                photo_list.update_file()
-
-def remove_photo_from_file(path, photo_id):
+    if profile == None:
+        profile = profiler.Profile(enabled=False)
+    index = AuthorIndex(AUTHOR_INDEX_PATH, [PANDA_PATH, ZOO_PATH, MEDIA_PATH])
+    with profile.phase("AuthorIndex.refresh"):
+        index.refresh()
+    paths = sorted(set(path for (path, _) in index.find(author)))
+    with profile.phase("remove_author", {'files': len(paths)}):
+        for path in paths:
+            start = time.perf_counter()
+            photo_list = PhotoFile(section_for_path(path), path)
+            if photo_list.remove_author(author) > 0:
+                photo_list.renumber_photos()
+            # Done? Let's write config
+            photo_list.update_file()
+            index.update(path)
+            profile.add_file(path, time.perf_counter() - start)
+    with profile.phase("AuthorIndex.save"):
+        index.save()
+    print("Removed photos by %s from %d files" % (author, len(paths)))
+
+def remove_photo_from_file(path, photo_id, profile=None):
     """
     Given a file path and a photo index ID, remove the photo and renumber
     all photos inside the file. Determine what the proper configuration
     section header should be from the path itself.
     """
+    if profile == None:
+        profile = profiler.Profile(enabled=False)
+    with profile.phase("remove_photo"):
+        start = time.perf_counter()
+        photo_list = PhotoFile(section_for_path(path), path)
+        if photo_list.delete_photo(photo_id) == True:
+            with profile.phase("renumber_photos"):
+                photo_list.renumber_photos()
+            photo_list.update_file()
+        profile.add_file(path, time.perf_counter() - start)
+
+def replace_file(temp_path, path):
+    """
+    Move a rewritten file over the original, keeping the original's permissions.
+    """
+    if os.path.exists(path):
+        shutil.copymode(path, temp_path)
+    os.replace(temp_path, path)
+
+def section_for_path(path):
+    """
+    Determine the configuration section header for a data file from the
+    folder it sits in, like "panda" for files under pandas/.
+    """
     section = None
     for section_name in ["wild", "media", "zoos", "pandas"]:
         if section_name in path.split("/"):
             section = section_name.split("s")[0]   # HACK
-    photo_list = PhotoFile(section, path)
-    if photo_list.delete_photo(photo_id) == True:
-        # TODO: find max index
-        photo_list.renumber_photos(130)
-        photo_list.update_file()
+    return section
 
 if __name__ == '__main__':
     """Choose a utility funciton."""
+    # --profile can go with any command, and times its stages
+    profile = profiler.Profile(enabled=False)
+    if "--profile" in sys.argv:
+        sys.argv.remove("--profile")
+        profile = profiler.Profile()
+    if len(sys.argv) == 2:
+        if sys.argv[1] == "--index-authors":
+            index = AuthorIndex(AUTHOR_INDEX_PATH, [PANDA_PATH, ZOO_PATH, MEDIA_PATH])
+            with profile.phase("AuthorIndex.refresh"):
+                index.refresh()
+            with profile.phase("AuthorIndex.save"):
+                index.save()
     if len(sys.argv) == 3:
+        if sys.argv[1] == "--batch":
+            apply_batch(sys.argv[2], profile=profile)
         if sys.argv[1] == "--remove-author":
             author = sys.argv[2]
-            remove_author_from_lineage(author)
+            remove_author_from_lineage(author, profile)
     if len(sys.argv) == 4:
+        if sys.argv[1] == "--batch":
+            apply_batch(sys.argv[2], int(sys.argv[3]), profile)
         if sys.argv[1] == "--remove-photo":
             file_path = sys.argv[2]
             photo_id = sys.argv[3]
-            remove_photo_from_file(file_path, photo_id)
+            remove_photo_from_file(file_path, photo_id, profile)
+    if profile.enabled:
+        profile.write_trace(PROFILE_PATH)
+        print(profile.summary())
+        print("Trace written to %s" % PROFILE_PATH)
@@ -0,0 +1,109 @@
+# Photo indexes for the Red Panda Lineage dataset.
+#
+# Two inverted indexes save the website from scanning every vertex's photo
+# fields to find photos of a panda, or photos with a tag:
+#
+#   {
+#     "appearances": {"1": [["1", 1], ["1", 2], ["media.1.xyz", 1], ...]},
+#     "tags": {"apple time": [["1", 3], ["-12", 2], ...]}
+#   }
+#
+# Each photo is an [entity id, photo number] pair, meaning the photo.N field
+# of that entity. A panda appears in its own photos, and in the group photos
+# of media entities that tag it. Tags are stored under the key they have in
+# Language.L.tags (js/language.js), so a photo tagged with any language's
+# word for a tag, such as "apple" or "りんご", is found under "apple time".
+# Tags missing from Language.L.tags are kept as they were written.
+
+import re
+
+from search import normalize
+
+# Where the website keeps its tag names and their translations
+TAGS_SOURCE = "js/language.js"
+# Photo URL fields, like photo.1
+PHOTO_FIELD = re.compile(r"^photo\.(\d+)$")
+# Where each panda sits in a media photo, like photo.1.tags.280.location
+LOCATION_FIELD = re.compile(r"^photo\.(\d+)\.tags\.(.+)\.location$")
+# One tag's entry in Language.L.tags, and its per-language word lists
+TAG_ENTRY = re.compile(r'^  "([^"]+)": \{(.*?)^  \}', re.MULTILINE | re.DOTALL)
+TAG_WORDS = re.compile(r'"(\w+)": \[(.*?)\]', re.DOTALL)
+QUOTED = re.compile(r'"([^"]*)"')
+
+def build_index(vertices, panda_ids, synonyms):
+    """Index every vertex's photos by the pandas in them and by their tags.
+
+    The panda_ids are the ids of the vertices that are pandas, whose own
+    photos are of them, unlike zoo photos. The synonyms map each normalized
+    tag word to its tag key (see read_synonyms). Photos are listed in
+    vertex order, then photo order.
+    """
+    appearances = {}
+    tags = {}
+    listed = set()
+    for vertex in vertices:
+        photos = []
+        pictured = {}
+        for key in vertex.keys():
+            field = PHOTO_FIELD.match(key)
+            location = LOCATION_FIELD.match(key)
+            if field != None:
+                photos.append(int(field.group(1)))
+            elif location != None:
+                pictured.setdefault(int(location.group(1)), []).append(location.group(2))
+        for number in sorted(photos):
+            photo = [vertex['_id'], number]
+            if 'panda.tags' in vertex:
+                # Group photos: the pandas located in this photo, or if none
+                # are, every panda the media entity tags
+                pictured_ids = pictured.get(number, vertex['panda.tags'].replace(" ", "").split(","))
+            elif vertex['_id'] in panda_ids:
+                pictured_ids = [vertex['_id']]
+            else:
+                pictured_ids = []
+            for panda_id in pictured_ids:
+                if ("panda", panda_id, vertex['_id'], number) not in listed:
+                    listed.add(("panda", panda_id, vertex['_id'], number))
+                    appearances.setdefault(panda_id, []).append(photo)
+            field = "photo.%d.tags" % number
+            if field not in vertex:
+                continue
+            for word in vertex[field].split(","):
+                tag = tag_key(word, synonyms)
+                if tag != "" and ("tag", tag, vertex['_id'], number) not in listed:
+                    listed.add(("tag", tag, vertex['_id'], number))
+                    tags.setdefault(tag, []).append(photo)
+    index = {}
+    index['appearances'] = appearances
+    index['tags'] = tags
+    return index
+
+def read_synonyms(path=TAGS_SOURCE):
+    """Map every word for each tag in Language.L.tags to the tag's key.
+
+    Words are normalized the same way search strings are (see
+    search.normalize), so case, width, and kana differences don't matter.
+    Emoji and untranslated "TOWRITE" placeholders are skipped.
+    """
+    with open(path, 'r', encoding='utf-8') as rfh:
+        text = rfh.read()
+    start = text.find("Language.L.tags = {")
+    if start == -1:
+        return {}
+    block = text[start:text.find("\n}", start)]
+    synonyms = {}
+    for entry in TAG_ENTRY.finditer(block):
+        key = entry.group(1)
+        synonyms[normalize(key)] = key
+        for language, words in TAG_WORDS.findall(entry.group(2)):
+            if language == "emoji":
+                continue
+            for word in QUOTED.findall(words):
+                if word != "TOWRITE" and normalize(word) != "":
+                    synonyms.setdefault(normalize(word), key)
+    return synonyms
+
+def tag_key(word, synonyms):
+    """The key a tag word is indexed under."""
+    word = word.strip()
+    return synonyms.get(normalize(word), word.lower())
@@ -0,0 +1,143 @@
+# Phase profiler for the Red Panda Lineage scripts.
+#
+# With --profile, build.py and manage.py time each stage of their work, and
+# each data file they process. The stages are written as a trace file that
+# chrome://tracing or https://ui.perfetto.dev can open, and a text summary
+# is printed with the slowest stages, a histogram of per-file times, the
+# slowest files, and peak memory use.
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory goes unreported
+    resource = None
+
+# Upper bounds, in milliseconds, of the per-file time histogram's buckets
+HISTOGRAM_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100]
+# How many of the slowest files the summary lists
+SLOWEST_FILES = 10
+
+class Profile:
+    """Collects timed phases and per-file times for one run of a script.
+
+    A disabled profile accepts the same calls and records nothing, so code
+    can be instrumented without checking whether profiling was asked for.
+    """
+    def __init__(self, enabled=True):
+        self.depth = 0
+        self.enabled = enabled
+        self.events = []
+        self.files = []
+        self.phases = []
+        self.start = time.perf_counter()
+
+    def add_file(self, path, seconds):
+        """Record how long one data file took to process."""
+        if self.enabled:
+            self.files.append((seconds, path))
+
+    @contextlib.contextmanager
+    def phase(self, name, args=None):
+        """Time a block of work as a named phase.
+
+        Phases can nest. The args dict is saved with the phase in the trace,
+        and is yielded, so that counts found during the phase can be added.
+        """
+        if args == None:
+            args = {}
+        if not self.enabled:
+            yield args
+            return
+        started = time.perf_counter()
+        depth = self.depth
+        self.depth = self.depth + 1
+        try:
+            yield args
+        finally:
+            self.depth = depth
+            elapsed = time.perf_counter() - started
+            peak = peak_memory()
+            if peak != None:
+                args['peak_memory_kb'] = peak
+            event = {}
+            event['args'] = args
+            event['cat'] = "phase"
+            event['dur'] = microseconds(elapsed)
+            event['name'] = name
+            event['ph'] = "X"
+            event['pid'] = os.getpid()
+            event['tid'] = 0
+            event['ts'] = microseconds(started - self.start)
+            self.events.append(event)
+            self.phases.append((started, depth, name, elapsed, args))
+
+    def summary(self):
+        """A text report of phase times, per-file times, and memory use."""
+        lines = []
+        wall = time.perf_counter() - self.start
+        peak = peak_memory()
+        if peak != None:
+            lines.append("Profile: %.1f ms wall time, %d KB peak memory" % (wall * 1000, peak))
+        else:
+            lines.append("Profile: %.1f ms wall time" % (wall * 1000))
+        for (_, depth, name, elapsed, args) in sorted(self.phases, key=lambda p: p[0]):
+            details = ", ".join("%s=%s" % (key, args[key]) for key in sorted(args)
+                                if key != 'peak_memory_kb')
+            if details != "":
+                details = "  (%s)" % details
+            lines.append("  %-40s %10.1f ms%s"
+                         % ("  " * depth + name, elapsed * 1000, details))
+        if len(self.files) == 0:
+            return "\n".join(lines)
+        total = sum(seconds for (seconds, _) in self.files)
+        lines.append("%d files, %.1f ms in total, %.3f ms mean:"
+                     % (len(self.files), total * 1000, total * 1000 / len(self.files)))
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for (seconds, _) in self.files:
+            bucket = 0
+            while (bucket < len(HISTOGRAM_BUCKETS) and
+                   seconds * 1000 > HISTOGRAM_BUCKETS[bucket]):
+                bucket = bucket + 1
+            counts[bucket] = counts[bucket] + 1
+        for bucket, count in enumerate(counts):
+            if bucket < len(HISTOGRAM_BUCKETS):
+                label = "<= %g ms" % HISTOGRAM_BUCKETS[bucket]
+            else:
+                label = "> %g ms" % HISTOGRAM_BUCKETS[-1]
+            lines.append("  %-12s %6d %s" % (label, count, "#" * (60 * count // len(self.files))))
+        lines.append("Slowest files:")
+        for (seconds, path) in sorted(self.files, reverse=True)[:SLOWEST_FILES]:
+            lines.append("  %8.3f ms  %s" % (seconds * 1000, path))
+        return "\n".join(lines)
+
+    def write_trace(self, destpath):
+        """Write the phases in the Chrome trace event format."""
+        trace = {}
+        trace['displayTimeUnit'] = "ms"
+        trace['otherData'] = {}
+        trace['otherData']['files'] = len(self.files)
+        trace['otherData']['peak_memory_kb'] = peak_memory()
+        trace['traceEvents'] = self.events
+        with open(destpath, 'w', encoding='utf-8') as wfh:
+            json.dump(trace, wfh, ensure_ascii=False, sort_keys=True)
+
+
+def microseconds(seconds):
+    """Trace timestamps and durations are whole microseconds."""
+    return int(round(seconds * 1000000))
+
+def peak_memory():
+    """Peak memory (resident set size) of this process so far, in KB."""
+    if resource == None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # Reported in bytes on macOS, and KB everywhere else
+        peak = peak // 1024
+    return peak
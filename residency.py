@@ -0,0 +1,184 @@
+# Zoo residency intervals for the Red Panda Lineage dataset.
+#
+# Panda files list where a panda has lived as location.N fields, each with a
+# zoo id (or a wild location id, or "unknown") and the date the panda got
+# there:
+#
+#   location.1: 10, 1992/7/1
+#   location.2: 57, 1993/12/26
+#
+# A panda stays at each location until the date of its next one, or until
+# it dies. Pandas with no location fields are taken to have lived at their
+# zoo or wild location from birth to death, as the website assumes.
+#
+# The exported index holds every panda's intervals, and each location's
+# intervals sorted by start date, with dates as YYYY-MM-DD strings so they
+# sort as text. An end of null means the panda hasn't left (or died on an
+# unknown date):
+#
+#   {
+#     "pandas": {"786": [["-10", "1992-07-01", "1993-12-26"], ...]},
+#     "places": {
+#       "-57": {
+#         "current": ["801", ...],
+#         "intervals": [["1993-12-26", "2009-11-19", "786"], ...],
+#         "reach": ["2009-11-19", ...]
+#       }
+#     }
+#   }
+#
+# To find who lived at a place on a date, binary search the intervals for
+# the last one starting on or before that date. Then walk back from there,
+# keeping intervals that end after the date, and stop once "reach", the
+# latest end date among all intervals up to that point, is on or before the
+# date. A reach of null means some interval so far is still open.
+
+import datetime
+import re
+
+from datafile import read_date
+
+# Fields holding a panda's location history, like location.1
+LOCATION_FIELD = re.compile(r"^location\.(\d+)$")
+
+def build_index(histories):
+    """Index residency intervals by panda and by location.
+
+    The histories are (panda id, intervals, alive) for each panda, where
+    the intervals come from read_history.
+    """
+    pandas = {}
+    places = {}
+    for (panda_id, intervals, alive) in histories:
+        pandas[panda_id] = [[place, iso_date(start), iso_date(end)]
+                            for (place, start, end) in intervals]
+        for (place, start, end) in intervals:
+            if place == None or start == None:
+                # Without a start date, the stay can't be placed in time
+                continue
+            entry = places.setdefault(place, {'current': [], 'stays': []})
+            entry['stays'].append((start, panda_id, end))
+        if alive and len(intervals) > 0 and intervals[-1][0] in places:
+            places[intervals[-1][0]]['current'].append(panda_id)
+    index = {}
+    index['pandas'] = pandas
+    index['places'] = {}
+    for place, entry in places.items():
+        entry['stays'].sort(key=lambda stay: (stay[0], stay[1]))
+        reach = []
+        latest = datetime.date.min
+        for (_, _, end) in entry['stays']:
+            if latest == None or end == None:
+                latest = None
+            elif end > latest:
+                latest = end
+            reach.append(iso_date(latest))
+        index['places'][place] = {}
+        index['places'][place]['current'] = entry['current']
+        index['places'][place]['intervals'] = [[iso_date(start), iso_date(end), panda_id]
+                                               for (start, panda_id, end) in entry['stays']]
+        index['places'][place]['reach'] = reach
+    return index
+
+def iso_date(date):
+    """A date as YYYY-MM-DD, or None."""
+    if date == None:
+        return None
+    return "%04d-%02d-%02d" % (date.year, date.month, date.day)
+
+def read_history(panda, fallback, places):
+    """Work out the intervals a panda spent at each location.
+
+    The fallback is the id of the panda's zoo or wild location, which is
+    used when there are no location fields, and checked against the last
+    one when there are. The places are lookup tables of the zoo and wild
+    ids that exist. Returns a list of [place id, start, end] intervals, in
+    the order they're listed, and a list of the problems found, such as
+    moves that are out of order, or that come before the panda's birth or
+    after its death. Place ids are None for unknown locations, and dates
+    are datetime.date, or None if unknown.
+    """
+    problems = []
+    birthday = None
+    death = None
+    try:
+        birthday = read_date(panda.get('birthday'))
+        death = read_date(panda.get('death'))
+    except ValueError:
+        # Reported when the panda file is imported
+        pass
+    entries = []
+    for key in panda.keys():
+        match = LOCATION_FIELD.match(key)
+        if match != None:
+            entries.append((int(match.group(1)), panda[key]))
+    entries.sort()
+    if len(entries) == 0:
+        if fallback == None:
+            return ([], problems)
+        return ([[fallback, birthday, death]], problems)
+    numbers = [number for (number, _) in entries]
+    if numbers != list(range(1, len(entries) + 1)):
+        problems.append("location fields aren't numbered 1 to %d: %s"
+                        % (len(entries), ", ".join("location.%d" % n for n in numbers)))
+    stays = []
+    for (number, value) in entries:
+        parts = [part.strip() for part in value.split(",")]
+        place = None
+        if parts[0].startswith("wild."):
+            place = parts[0]
+        elif parts[0] != "unknown":
+            try:
+                place = str(int(parts[0]) * -1)
+            except ValueError:
+                pass
+        if place == None and parts[0] != "unknown":
+            problems.append("location.%d has an unreadable location: %s" % (number, parts[0]))
+        elif place != None and not any(place in table for table in places):
+            problems.append("location.%d is not a known zoo or wild location: %s"
+                            % (number, parts[0]))
+            place = None
+        start = None
+        if len(parts) > 1:
+            try:
+                start = read_date(parts[1])
+            except ValueError:
+                problems.append("location.%d has an unreadable date: %s" % (number, parts[1]))
+        stays.append([number, place, start])
+    if stays[0][2] == None:
+        # Usually a wild location, where the panda was born
+        stays[0][2] = birthday
+    previous = None
+    for (number, place, start) in stays:
+        if start == None:
+            continue
+        if birthday != None and start < birthday:
+            problems.append("location.%d on %s is before their birthday %s"
+                            % (number, iso_date(start), iso_date(birthday)))
+        if death != None and start > death:
+            problems.append("location.%d on %s is after their death %s"
+                            % (number, iso_date(start), iso_date(death)))
+        if previous != None and start < previous[1]:
+            problems.append("location.%d on %s is before location.%d on %s"
+                            % (number, iso_date(start), previous[0], iso_date(previous[1])))
+        previous = (number, start)
+    if fallback != None and stays[-1][1] != None and stays[-1][1] != fallback:
+        problems.append("location.%d is %s, but their current location is %s"
+                        % (stays[-1][0], written_id(stays[-1][1]), written_id(fallback)))
+    intervals = []
+    for position, (number, place, start) in enumerate(stays):
+        if position + 1 < len(stays):
+            end = stays[position + 1][2]
+        else:
+            end = death
+        if start != None and end != None and end < start:
+            # Out of order, and reported above
+            continue
+        intervals.append([place, start, end])
+    return (intervals, problems)
+
+def written_id(place):
+    """A place's vertex id as it's written in the data files."""
+    if place.startswith("wild."):
+        return place
+    return str(int(place) * -1)
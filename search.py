@@ -0,0 +1,166 @@
+# Name search index for the Red Panda Lineage dataset.
+#
+# The index maps normalized name tokens to the ids of the pandas, zoos, and
+# other entities with that name. It is stored as two parallel arrays, with
+# the tokens sorted, so a type-ahead search is a binary search for the first
+# token starting with what was typed:
+#
+#   {
+#     "languages": ["en", "jp", ...],
+#     "tokens": ["harumaki", "はるまき", ...],
+#     "ids": [["1"], ["1"], ...]
+#   }
+#
+# Search strings must be normalized with the same rules (see normalize) before
+# looking them up.
+
+import bisect
+import re
+import unicodedata
+
+# Name fields indexed for each language, such as en.name or jp.othernames
+NAME_FIELDS = ["name", "nicknames", "othernames", "oldnames"]
+# Characters that separate the words of a name
+SEPARATORS = re.compile(r"[\s\-_.,・･/()「」『』【】\[\]\"']+")
+
+# Hepburn romaji for hiragana. Katakana is folded to hiragana first.
+ROMAJI = {
+    "あ": "a", "い": "i", "う": "u", "え": "e", "お": "o",
+    "か": "ka", "き": "ki", "く": "ku", "け": "ke", "こ": "ko",
+    "が": "ga", "ぎ": "gi", "ぐ": "gu", "げ": "ge", "ご": "go",
+    "さ": "sa", "し": "shi", "す": "su", "せ": "se", "そ": "so",
+    "ざ": "za", "じ": "ji", "ず": "zu", "ぜ": "ze", "ぞ": "zo",
+    "た": "ta", "ち": "chi", "つ": "tsu", "て": "te", "と": "to",
+    "だ": "da", "ぢ": "ji", "づ": "zu", "で": "de", "ど": "do",
+    "な": "na", "に": "ni", "ぬ": "nu", "ね": "ne", "の": "no",
+    "は": "ha", "ひ": "hi", "ふ": "fu", "へ": "he", "ほ": "ho",
+    "ば": "ba", "び": "bi", "ぶ": "bu", "べ": "be", "ぼ": "bo",
+    "ぱ": "pa", "ぴ": "pi", "ぷ": "pu", "ぺ": "pe", "ぽ": "po",
+    "ま": "ma", "み": "mi", "む": "mu", "め": "me", "も": "mo",
+    "や": "ya", "ゆ": "yu", "よ": "yo",
+    "ら": "ra", "り": "ri", "る": "ru", "れ": "re", "ろ": "ro",
+    "わ": "wa", "ゐ": "i", "ゑ": "e", "を": "o", "ん": "n", "ゔ": "vu",
+    "ぁ": "a", "ぃ": "i", "ぅ": "u", "ぇ": "e", "ぉ": "o",
+    "ゃ": "ya", "ゅ": "yu", "ょ": "yo", "ゎ": "wa"
+}
+# Small ya/yu/yo after an -i kana make one sound, like きゃ -> kya
+YOON = {"ゃ": "a", "ゅ": "u", "ょ": "o"}
+
+def build_index(vertices):
+    """Build a search index over the name fields of every vertex.
+
+    Every language listed in any vertex's language.order is indexed, using
+    fields like <language>.name and <language>.othernames. Each name is
+    indexed whole, word by word, and for Japanese kana, in romaji too.
+    """
+    languages = set()
+    for vertex in vertices:
+        if 'language.order' in vertex:
+            languages.update(vertex['language.order'].replace(" ", "").split(","))
+    languages = sorted(l for l in languages if l != "")
+    postings = {}
+    posted = set()
+    for vertex in vertices:
+        for language in languages:
+            for field in NAME_FIELDS:
+                key = language + "." + field
+                if key not in vertex or vertex[key] in ["none", "unknown"]:
+                    continue
+                for name in vertex[key].split(","):
+                    for token in tokens(name):
+                        if (token, vertex['_id']) not in posted:
+                            posted.add((token, vertex['_id']))
+                            postings.setdefault(token, []).append(vertex['_id'])
+    index = {}
+    index['languages'] = languages
+    index['tokens'] = sorted(postings)
+    index['ids'] = [postings[token] for token in index['tokens']]
+    return index
+
+def lookup(index, text):
+    """Find ids for every token that starts with the normalized search text."""
+    prefix = normalize(text)
+    found = []
+    seen = set()
+    if prefix == "":
+        return found
+    position = bisect.bisect_left(index['tokens'], prefix)
+    while (position < len(index['tokens']) and
+           index['tokens'][position].startswith(prefix)):
+        for vertex_id in index['ids'][position]:
+            if vertex_id not in seen:
+                seen.add(vertex_id)
+                found.append(vertex_id)
+        position = position + 1
+    return found
+
+def normalize(text):
+    """Fold a string so that equivalent spellings compare equal.
+
+    Full-width and half-width forms are unified, case is folded, accents
+    are dropped from Latin letters, katakana becomes hiragana, and word
+    separators are removed.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    # Drop accents: decompose, then remove the Latin combining marks. Kana
+    # voicing marks decompose too, but are kept and recomposed.
+    text = "".join(c for c in unicodedata.normalize("NFD", text)
+                   if not "\u0300" <= c <= "\u036f")
+    text = unicodedata.normalize("NFC", text)
+    text = "".join(to_hiragana(c) for c in text)
+    return SEPARATORS.sub("", text)
+
+def romanize(kana):
+    """Spell a hiragana string in romaji, or return None if it isn't all kana."""
+    output = []
+    double_next = False
+    i = 0
+    while i < len(kana):
+        char = kana[i]
+        if char == "っ":
+            double_next = True
+            i = i + 1
+            continue
+        if char == "ー":
+            # Long vowel mark repeats the previous vowel
+            if len(output) == 0:
+                return None
+            output.append(output[-1][-1])
+            i = i + 1
+            continue
+        if char not in ROMAJI:
+            return None
+        sound = ROMAJI[char]
+        if i + 1 < len(kana) and kana[i + 1] in YOON and sound.endswith("i") and len(sound) > 1:
+            base = sound[:-1]
+            if base in ["sh", "ch", "j"]:
+                sound = base + YOON[kana[i + 1]]
+            else:
+                sound = base + "y" + YOON[kana[i + 1]]
+            i = i + 1
+        if double_next:
+            sound = ("t" if sound.startswith("ch") else sound[0]) + sound
+            double_next = False
+        output.append(sound)
+        i = i + 1
+    return "".join(output)
+
+def to_hiragana(char):
+    """Shift a katakana character to its hiragana equivalent."""
+    if "ァ" <= char <= "ヶ":
+        return chr(ord(char) - 0x60)
+    return char
+
+def tokens(name):
+    """All of the tokens a single name is indexed under."""
+    words = [normalize(word) for word in SEPARATORS.split(name)]
+    words = [word for word in words if word != ""]
+    whole = "".join(words)
+    found = set(words)
+    if whole != "":
+        found.add(whole)
+    for token in list(found):
+        romaji = romanize(token)
+        if romaji != None and romaji != token:
+            found.add(romaji)
+    return sorted(found)
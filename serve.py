@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+
+# This Red Panda Lineage query service builds the dataset once, and answers
+# small lineage questions over HTTP, so clients don't have to download the
+# whole of redpanda.json to look up a single panda. It only uses the Python
+# standard library, and is meant to sit behind a reverse proxy.
+#
+# Every response is JSON. Lists of pandas or zoos carry the core fields of
+# each one (names, genders, dates; see build.is_core_field), and the full
+# record is available by id:
+#
+#   GET /pandas/<id>                 one panda, with every field
+#   GET /pandas?name=<text>          pandas with a name starting with text
+#   GET /pandas/<id>/parents
+#   GET /pandas/<id>/children
+#   GET /pandas/<id>/siblings        litter-mates, and pandas sharing a parent
+#   GET /zoos/<id>                   one zoo, with every field
+#   GET /zoos?name=<text>
+#   GET /zoos/<id>/residents         pandas whose current zoo this is
+#   GET /photos?author=<name>        photos credited to an author
+#
+# Responses have an ETag, and a request whose If-None-Match matches it gets
+# an empty 304 Not Modified response.
+
+import argparse
+import hashlib
+import json
+import re
+import search
+import snapshot
+import socketserver
+import traceback
+
+from build import Edge, RedPandaGraph, ImportCache, is_core_field
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from shared import CACHE_PATH
+from urllib.parse import parse_qs, unquote, urlsplit
+
+# Photo URL fields, like photo.1, whose credits are in photo.1.author
+PHOTO_FIELD = re.compile(r"^photo\.\d+$")
+
+class LineageIndex:
+    """Lookup tables over a built graph, for answering queries quickly.
+
+    Relatives and residents come straight from the graph's edge store (see
+    build.EdgeStore). Names go in a search index (see search.py), and photos
+    are indexed by author, when the service starts.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.names = search.build_index(graph.vertices)
+        self.photos = {}
+        for vertex in graph.vertices:
+            for key in sorted(vertex.keys()):
+                if PHOTO_FIELD.match(key) and key + ".author" in vertex:
+                    photo = {}
+                    photo['_id'] = vertex['_id']
+                    photo['field'] = key
+                    photo['url'] = vertex[key]
+                    self.photos.setdefault(vertex[key + ".author"], []).append(photo)
+
+    def children(self, panda_id):
+        """Ids of a panda's children."""
+        return unique(self.graph.edges.targets(Edge.FAMILY, panda_id))
+
+    def find(self, kind, name):
+        """Entities of one kind with a name starting with the given text."""
+        found = search.lookup(self.names, name)
+        return [self.graph.index[kind][i] for i in found if i in self.graph.index[kind]]
+
+    def panda(self, panda_id):
+        """A panda's vertex, or None if there's no such panda."""
+        return self.graph.index["panda"].get(panda_id)
+
+    def parents(self, panda_id):
+        """Ids of a panda's parents."""
+        return unique(self.graph.edges.sources(Edge.FAMILY, panda_id))
+
+    def pandas(self, panda_ids):
+        """The vertices of a list of panda ids, skipping any that don't exist."""
+        return [self.graph.index["panda"][i] for i in panda_ids
+                if i in self.graph.index["panda"]]
+
+    def residents(self, zoo_id):
+        """Ids of the pandas whose current zoo is a zoo, by its vertex id."""
+        return unique(self.graph.edges.sources(Edge.ZOO, zoo_id))
+
+    def siblings(self, panda_id):
+        """Litter-mates first, then other pandas sharing a parent."""
+        found = self.graph.edges.neighbors(Edge.LITTER, panda_id)
+        for parent_id in self.parents(panda_id):
+            for child_id in self.children(parent_id):
+                if child_id != panda_id and child_id not in found:
+                    found.append(child_id)
+        return self.pandas(found)
+
+    def zoo(self, zoo_id):
+        """A zoo's vertex, by its id as written in the data files."""
+        try:
+            return self.graph.index["zoo"].get(str(int(zoo_id) * -1))
+        except ValueError:
+            return None
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Answers GET requests from the lineage index in self.server.lineage."""
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = [unquote(p) for p in url.path.split("/") if p != ""]
+        query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        try:
+            self.respond(200, self.route(parts, query))
+        except LookupError as e:
+            self.respond(404, {"error": e.args[0]})
+        except ValueError as e:
+            self.respond(400, {"error": e.args[0]})
+        except Exception as e:
+            # Anything else is a bug here, but the client still gets an answer
+            traceback.print_exc()
+            self.respond(500, {"error": "ERROR: %s: %s" % (type(e).__name__, e)})
+
+    def log_message(self, format, *args):
+        # The reverse proxy keeps the access logs
+        pass
+
+    def respond(self, status, data):
+        """Send a JSON response, or 304 if the client's copy is current."""
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':'),
+                          sort_keys=True).encode('utf8')
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        matches = [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]
+        if status == 200 and (etag in matches or "*" in matches):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, parts, query):
+        """Answer a query, given its path parts and query string."""
+        lineage = self.server.lineage
+        if parts == ["pandas"]:
+            if 'name' not in query:
+                raise ValueError("ERROR: search pandas with ?name=")
+            return summaries(lineage.find("panda", query['name']))
+        if parts == ["zoos"]:
+            if 'name' not in query:
+                raise ValueError("ERROR: search zoos with ?name=")
+            return summaries(lineage.find("zoo", query['name']))
+        if parts == ["photos"]:
+            if 'author' not in query:
+                raise ValueError("ERROR: search photos with ?author=")
+            return lineage.photos.get(query['author'], [])
+        if len(parts) in [2, 3] and parts[0] == "pandas":
+            panda = lineage.panda(parts[1])
+            if panda == None:
+                raise LookupError("ERROR: no panda with id %s" % parts[1])
+            if len(parts) == 2:
+                # Snapshot vertices are read-only mappings, not dicts
+                return dict(panda)
+            if parts[2] == "children":
+                return summaries(lineage.pandas(lineage.children(parts[1])))
+            if parts[2] == "parents":
+                return summaries(lineage.pandas(lineage.parents(parts[1])))
+            if parts[2] == "siblings":
+                return summaries(lineage.siblings(parts[1]))
+        if len(parts) in [2, 3] and parts[0] == "zoos":
+            zoo = lineage.zoo(parts[1])
+            if zoo == None:
+                raise LookupError("ERROR: no zoo with id %s" % parts[1])
+            if len(parts) == 2:
+                return dict(zoo)
+            if parts[2] == "residents":
+                return summaries(lineage.pandas(lineage.residents(zoo['_id'])))
+        raise LookupError("ERROR: no such query: /%s" % "/".join(parts))
+
+
+class QueryServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in its own thread."""
+    daemon_threads = True
+
+    def __init__(self, address, lineage):
+        HTTPServer.__init__(self, address, QueryHandler)
+        self.lineage = lineage
+
+
+def summaries(vertices):
+    """Just the core fields of some vertices, for list responses."""
+    return [dict((k, v) for k, v in vertex.items() if is_core_field(k))
+            for vertex in vertices]
+
+def unique(values):
+    """A list without its repeats, in the order first seen."""
+    found = []
+    for value in values:
+        if value not in found:
+            found.append(value)
+    return found
+
+if __name__ == '__main__':
+    """Build the dataset, then answer queries until interrupted."""
+    parser = argparse.ArgumentParser(description="Serve Red Panda Lineage queries over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="port to listen on")
+    parser.add_argument("--incremental", action="store_true",
+                        help="reuse parsed data for files unchanged since the last build")
+    parser.add_argument("--snapshot", metavar="PATH",
+                        help="serve from a snapshot written by build.py --snapshot, instead of building")
+    args = parser.parse_args()
+    if args.snapshot != None:
+        graph = snapshot.load(args.snapshot)
+    else:
+        cache = None
+        if args.incremental:
+            cache = ImportCache(CACHE_PATH)
+        graph = RedPandaGraph(cache)
+        graph.build_graph()
+    server = QueryServer((args.host, args.port), LineageIndex(graph))
+    print("Serving lineage queries on http://%s:%d/" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
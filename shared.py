@@ -1,28 +1,60 @@
 # Shared Python information for the Red Panda Lineage scripts
 
+AUTHOR_INDEX_PATH = "./.author_index.json"
+CACHE_PATH = "./.build_cache.json"
+COMPACT_PATH = "./export/redpanda.v2.json"
+CORE_PATH = "./export/redpanda.core.json"
+DETAIL_PATH = "./export/detail"
+MANIFEST_PATH = "./export/redpanda.manifest.json"
 MEDIA_PATH = "./media" 
+NDJSON_PATH = "./export/redpanda.ndjson"
 PANDA_PATH = "./pandas"
+PHOTOS_PATH = "./export/photos.json"
+PROFILE_PATH = "./profile.trace.json"
+RESIDENCY_PATH = "./export/residency.json"
 OUTPUT_PATH = "./export/redpanda.json"
+SEARCH_PATH = "./export/search.json"
+SNAPSHOT_PATH = "./export/redpanda.snapshot"
+VALIDATION_PATH = "./validation.json"
+VITAMIN_CACHE_PATH = "./.vitamin_cache.json"
+VITAMINS_PATH = "./export/vitamins.json"
 WILD_PATH = "./wild" 
 ZOO_PATH = "./zoos" 
 
-class DateConsistencyError(ValueError):
+class DataError(ValueError):
+    """Base class for problems in the data files, rather than in the code.
+
+    Each kind of problem also derives from the built-in error it has always
+    been, so code catching KeyError or IndexError still catches it. Errors
+    found by checking the whole dataset name the files involved in paths.
+    """
+    def __init__(self, *args, paths=None):
+        super().__init__(*args)
+        self.paths = paths or []
+
+class DataFormatError(DataError):
+    pass
+
+class DateConsistencyError(DataError):
     pass
 
-class DateFormatError(ValueError):
+class DateFormatError(DataError):
     pass
 
-class GenderFormatError(ValueError):
+class FieldError(DataError, KeyError):
     pass
 
-class IdError(KeyError):
+class GenderFormatError(DataError):
     pass
 
-class LinkError(IndexError):
+class IdError(DataError, KeyError):
     pass
 
-class NameFormatError(ValueError):
+class LinkError(DataError, IndexError):
     pass
 
-class SectionNameError(ValueError):
-    pass
\ No newline at end of file
+class NameFormatError(DataError):
+    pass
+
+class SectionNameError(DataError):
+    pass
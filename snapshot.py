@@ -0,0 +1,484 @@
+# Binary snapshot of the Red Panda Lineage graph, for offline analysis tools.
+#
+# A snapshot holds the same vertices and edges as redpanda.json, laid out as
+# flat arrays that can be memory-mapped and read in place. Opening one takes
+# the same time no matter how big the dataset is, and walking the family
+# tree only touches the entries it visits. No third-party modules are needed,
+# though NumPy can wrap any section without copying it:
+#
+#   numpy.frombuffer(graph.section("out.1"), dtype="<u4")
+#
+# All numbers are little-endian. The file starts with a header and a
+# directory of sections:
+#
+#   magic      8 bytes   b"RPLGSNAP"
+#   version    uint32    FORMAT
+#   sections   uint32    how many directory entries follow
+#   then, for each section:
+#     name     16 bytes  ASCII, padded with NUL bytes
+#     offset   uint32    from the start of the file, a multiple of 8
+#     length   uint32    in bytes
+#
+# Sections, with V vertices and E edges:
+#
+#   meta        UTF-8 JSON: the column names, each kind's range of vertices,
+#               the edge labels, the string ids of the field names that
+#               aren't columns, and the _photo and _totals sections
+#   strings     uint32[S+1]: where each string starts in the heap, then
+#               where the heap ends
+#   heap        every distinct string, UTF-8 encoded, back to back
+#   ids         uint32[V]: vertex positions, sorted by the vertex's _id
+#   columns     uint32[C*V]: fields set on most vertices, one column after
+#               another, each a string id per vertex, or NONE if unset
+#   extras.off  uint32[V+1]: where each vertex's other fields start in extras
+#   extras      uint32 pairs of (field name, value) string ids
+#   edges       uint32 triples of (out vertex, label, in vertex), in the order
+#               of redpanda.json
+#   out.<L>.off, out.<L>
+#   in.<L>.off, in.<L>
+#               compressed sparse rows for each label L, numbered as in the
+#               meta labels list: out.<L> lists each vertex's targets, from
+#               out.<L>.off[v] up to out.<L>.off[v+1], and in.<L> lists each
+#               vertex's sources the same way
+#
+# Vertices are numbered in redpanda.json order: zoos, wild locations, pandas,
+# then media. load() returns a SnapshotGraph, which answers the same lookups
+# as a built RedPandaGraph (vertices, index, and the edges methods of
+# build.EdgeStore), reading straight from the mapped file.
+
+import array
+import json
+import mmap
+import struct
+import sys
+
+from collections import Counter
+from collections.abc import Mapping, Sequence
+from shared import DataFormatError, LinkError
+
+FORMAT = 1
+MAGIC = b"RPLGSNAP"
+# A field gets a fixed-width column if at least this share of vertices has it
+COLUMN_SHARE = 0.25
+# String id meaning a column's field isn't set for a vertex
+NONE = 0xFFFFFFFF
+HEADER = struct.Struct("<8sII")
+ENTRY = struct.Struct("<16sII")
+
+class SnapshotGraph:
+    """Read-only view of a snapshot file, shaped like a built RedPandaGraph.
+
+    The vertices, the index of ids for each kind, the media, wild, and zoo
+    lists, and the edges (see SnapshotEdges) can be passed to code written
+    for a RedPandaGraph, like serve.LineageIndex or RedPandaGraph's
+    build_lineage. Every vertex and edge is read from the file when it's
+    asked for, so nothing is loaded up front besides the small meta section.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.rfh = open(path, 'rb')
+        self.mapped = mmap.mmap(self.rfh.fileno(), 0, access=mmap.ACCESS_READ)
+        self.cached = {}
+        self.views = []
+        self.data = self.keep(memoryview(self.mapped))
+        (magic, version, count) = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise DataFormatError("ERROR: %s: not a graph snapshot" % path)
+        if version != FORMAT:
+            raise DataFormatError("ERROR: %s: snapshot version %d, expected %d"
+                                  % (path, version, FORMAT))
+        self.sections = {}
+        for i in range(count):
+            (name, offset, length) = ENTRY.unpack_from(self.data, HEADER.size + i * ENTRY.size)
+            self.sections[name.rstrip(b"\0").decode('ascii')] = (offset, length)
+        meta = json.loads(self.section("meta", None).tobytes().decode('utf8'))
+        self.column_index = dict((key, i) for i, key in enumerate(meta['columns']))
+        self.column_names = meta['columns']
+        self.columns = self.section("columns")
+        self.edges = SnapshotEdges(self, meta['labels'])
+        self.extras = self.section("extras")
+        self.extras_offsets = self.section("extras.off")
+        self.fields = meta['fields']
+        self.heap = self.section("heap", None)
+        self.id_column = self.column_index["_id"]
+        self.ids = self.section("ids")
+        self.index = {}
+        self.kinds = {}
+        for [kind, start, count] in meta['kinds']:
+            self.index[kind] = SnapshotIndex(self, start, count)
+            self.kinds[kind] = (start, count)
+        self.media = SnapshotVertices(self, *self.kinds["media"])
+        self.photo = {}
+        self.photo["credit"] = meta['_photo']['credit']
+        self.photo["max"] = meta['_photo']['entity_max']
+        self.strings = self.section("strings")
+        self.totals = meta['_totals']
+        self.vertices = SnapshotVertices(self, 0, len(self.ids))
+        self.wilds = SnapshotVertices(self, *self.kinds["wild"])
+        self.zoos = SnapshotVertices(self, *self.kinds["zoo"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Unmap the file. Vertices read from it can't be used afterward."""
+        for view in reversed(self.views):
+            view.release()
+        self.cached = {}
+        self.views = []
+        self.mapped.close()
+        self.rfh.close()
+
+    def export_document(self):
+        """The vertices, edges, and totals, in the layout of redpanda.json."""
+        export = {}
+        export['_photo'] = {}
+        export['_photo']['credit'] = self.photo['credit']
+        export['_photo']['entity_max'] = self.photo['max']
+        export['_totals'] = self.totals
+        export['edges'] = [edge.as_dict() for edge in self.edges]
+        export['vertices'] = [dict(vertex) for vertex in self.vertices]
+        return export
+
+    def keep(self, view):
+        """Track a view of the mapped file, so close() can release it."""
+        self.views.append(view)
+        return view
+
+    def position(self, vertex_id):
+        """A vertex's position, found by binary search of the ids section."""
+        low = 0
+        high = len(self.ids)
+        while low < high:
+            middle = (low + high) // 2
+            if self.vertex_id(self.ids[middle]) < vertex_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.ids) and self.vertex_id(self.ids[low]) == vertex_id:
+            return self.ids[low]
+        return None
+
+    def section(self, name, typecode="I"):
+        """A section of the file, as unsigned 32-bit numbers or raw bytes."""
+        if (name, typecode) in self.cached:
+            return self.cached[(name, typecode)]
+        (offset, length) = self.sections[name]
+        view = self.keep(self.data[offset:offset + length])
+        if typecode != None and sys.byteorder != "little":
+            # The file is little-endian, so read a swapped copy instead
+            view = array.array(typecode, view.tobytes())
+            view.byteswap()
+        elif typecode != None:
+            view = self.keep(view.cast(typecode))
+        self.cached[(name, typecode)] = view
+        return view
+
+    def string(self, string_id):
+        return self.heap[self.strings[string_id]:self.strings[string_id + 1]].tobytes().decode('utf8')
+
+    def vertex_id(self, position):
+        return self.string(self.columns[self.id_column * len(self.ids) + position])
+
+
+class SnapshotEdges:
+    """The edges of a snapshot, answering the queries that build.EdgeStore does.
+
+    Labels are given as build.EDGE_LABELS codes, like Edge.FAMILY, and ids
+    as vertex ids. Looking up a vertex's edges is a binary search for the
+    vertex, and then a slice of that label's rows.
+    """
+    def __init__(self, graph, labels):
+        # Imported here, since build.py imports this module to write snapshots
+        from build import label_code
+        self.codes = {}
+        self.graph = graph
+        self.labels = labels
+        self.rows = graph.section("edges")
+        for number, label in enumerate(labels):
+            self.codes[label_code(label)] = number
+
+    def __iter__(self):
+        for row in range(0, len(self.rows), 3):
+            yield self.edge(self.rows[row], self.rows[row + 1], self.rows[row + 2])
+
+    def __len__(self):
+        return len(self.rows) // 3
+
+    def adjacent(self, direction, label, vertex_id):
+        """Positions of a vertex's neighbors in one direction, for one label."""
+        position = self.graph.position(vertex_id)
+        if label not in self.codes or position == None:
+            return []
+        name = "%s.%d" % (direction, self.codes[label])
+        offsets = self.graph.section(name + ".off")
+        return self.graph.section(name)[offsets[position]:offsets[position + 1]]
+
+    def between(self, one_id, other_id, label):
+        """Edges with a label between two vertices, in either direction."""
+        found = [new_edge(one_id, other_id, self.labels[self.codes[label]])
+                 for _ in range(self.count(one_id, other_id, label))]
+        if one_id != other_id:
+            found.extend(new_edge(other_id, one_id, self.labels[self.codes[label]])
+                         for _ in range(self.count(other_id, one_id, label)))
+        return found
+
+    def count(self, out_id, in_id, label):
+        in_position = self.graph.position(in_id)
+        return len([p for p in self.adjacent("out", label, out_id) if p == in_position])
+
+    def edge(self, out_position, label_number, in_position):
+        return new_edge(self.graph.vertex_id(out_position),
+                         self.graph.vertex_id(in_position),
+                         self.labels[label_number])
+
+    def exists(self, out_id, in_id, label):
+        """Whether there's an edge with a label from one vertex to another."""
+        return self.count(out_id, in_id, label) > 0
+
+    def incoming(self, vertex_id):
+        """Edges of every label arriving at a vertex."""
+        for label in sorted(self.codes):
+            for source_id in self.sources(label, vertex_id):
+                yield new_edge(source_id, vertex_id, self.labels[self.codes[label]])
+
+    def labelled(self, label):
+        """Every edge with a label, in export order."""
+        number = self.codes.get(label)
+        for row in range(0, len(self.rows), 3):
+            if self.rows[row + 1] == number:
+                yield self.edge(self.rows[row], number, self.rows[row + 2])
+
+    def linked(self, one_id, other_id, label):
+        """Whether two vertices have an edge with a label, in either direction."""
+        return self.exists(one_id, other_id, label) or self.exists(other_id, one_id, label)
+
+    def neighbors(self, label, vertex_id):
+        """Ids of the vertices at the other end of a vertex's edges, either way."""
+        found = []
+        for other_id in self.targets(label, vertex_id) + self.sources(label, vertex_id):
+            if other_id not in found:
+                found.append(other_id)
+        return found
+
+    def sources(self, label, in_id):
+        """Ids of the vertices with an edge of a label to this one."""
+        return [self.graph.vertex_id(p) for p in self.adjacent("in", label, in_id)]
+
+    def targets(self, label, out_id):
+        """Ids of the vertices this one has an edge of a label to."""
+        return [self.graph.vertex_id(p) for p in self.adjacent("out", label, out_id)]
+
+    def touching(self, vertex_ids):
+        """Edges of every label with either end in a set of vertices."""
+        found = []
+        for vertex_id in sorted(vertex_ids):
+            for label in sorted(self.codes):
+                name = self.labels[self.codes[label]]
+                for target_id in self.targets(label, vertex_id):
+                    found.append(new_edge(vertex_id, target_id, name))
+                for source_id in self.sources(label, vertex_id):
+                    if source_id not in vertex_ids:
+                        found.append(new_edge(source_id, vertex_id, name))
+        return found
+
+
+class SnapshotIndex(Mapping):
+    """The vertices of one kind, by id, like RedPandaGraph.index[kind]."""
+    def __init__(self, graph, start, count):
+        self.count = count
+        self.graph = graph
+        self.start = start
+
+    def __getitem__(self, vertex_id):
+        position = self.graph.position(vertex_id)
+        if position == None or not self.start <= position < self.start + self.count:
+            raise KeyError(vertex_id)
+        return SnapshotVertex(self.graph, position)
+
+    def __iter__(self):
+        for position in range(self.start, self.start + self.count):
+            yield self.graph.vertex_id(position)
+
+    def __len__(self):
+        return self.count
+
+
+class SnapshotVertex(Mapping):
+    """One vertex, read from the columns and extras when a field is asked for."""
+    def __init__(self, graph, position):
+        self.graph = graph
+        self.position = position
+
+    def __getitem__(self, key):
+        graph = self.graph
+        if key in graph.column_index:
+            string_id = graph.columns[graph.column_index[key] * len(graph.ids) + self.position]
+            if string_id != NONE:
+                return graph.string(string_id)
+        elif key in graph.fields:
+            key_id = graph.fields[key]
+            for pair in range(graph.extras_offsets[self.position],
+                              graph.extras_offsets[self.position + 1]):
+                if graph.extras[pair * 2] == key_id:
+                    return graph.string(graph.extras[pair * 2 + 1])
+        raise KeyError(key)
+
+    def __iter__(self):
+        graph = self.graph
+        for column, key in enumerate(graph.column_names):
+            if graph.columns[column * len(graph.ids) + self.position] != NONE:
+                yield key
+        for pair in range(graph.extras_offsets[self.position],
+                          graph.extras_offsets[self.position + 1]):
+            yield graph.string(graph.extras[pair * 2])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class SnapshotVertices(Sequence):
+    """A run of vertices in snapshot order, like RedPandaGraph.vertices."""
+    def __init__(self, graph, start, count):
+        self.count = count
+        self.graph = graph
+        self.start = start
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[p] for p in range(*position.indices(self.count))]
+        if position < 0:
+            position = position + self.count
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        return SnapshotVertex(self.graph, self.start + position)
+
+    def __len__(self):
+        return self.count
+
+
+def load(path):
+    """Open a snapshot file written by write()."""
+    return SnapshotGraph(path)
+
+def new_edge(out_id, in_id, label):
+    """A build.Edge, for code that expects the edges of a RedPandaGraph."""
+    # Imported here, since build.py imports this module to write snapshots
+    from build import Edge
+    return Edge(out_id, in_id, label)
+
+def write(destpath, export, kinds):
+    """Write an export document (see RedPandaGraph.export_document) as a snapshot.
+
+    The kinds list gives the kind and number of vertices of each run of the
+    export's vertices, like [("zoo", 193), ("wild", 6), ...]. Returns the
+    number of bytes written.
+    """
+    vertices = export['vertices']
+    strings = {}
+    def string_id(value):
+        return strings.setdefault(value, len(strings))
+    counts = Counter()
+    for vertex in vertices:
+        counts.update(vertex.keys())
+    columns = sorted(key for key, count in counts.items()
+                     if key == "_id" or count >= COLUMN_SHARE * len(vertices))
+    column_index = dict((key, i) for i, key in enumerate(columns))
+    positions = {}
+    column_data = array.array("I", [NONE]) * (len(columns) * len(vertices))
+    extras = array.array("I")
+    extras_offsets = array.array("I", [0])
+    fields = {}
+    for position, vertex in enumerate(vertices):
+        positions.setdefault(vertex['_id'], position)
+        for key in sorted(vertex.keys()):
+            if key in column_index:
+                column_data[column_index[key] * len(vertices) + position] = string_id(vertex[key])
+            else:
+                fields[key] = string_id(key)
+                extras.append(fields[key])
+                extras.append(string_id(vertex[key]))
+        extras_offsets.append(len(extras) // 2)
+    ids = array.array("I", sorted(range(len(vertices)), key=lambda p: vertices[p]['_id']))
+    labels = sorted(set(edge['_label'] for edge in export['edges']))
+    label_index = dict((label, i) for i, label in enumerate(labels))
+    rows = array.array("I")
+    out_lists = [[[] for _ in vertices] for _ in labels]
+    in_lists = [[[] for _ in vertices] for _ in labels]
+    for edge in export['edges']:
+        if edge['_out'] not in positions or edge['_in'] not in positions:
+            raise LinkError("ERROR: edge refers to a missing vertex: %s" % edge)
+        out_position = positions[edge['_out']]
+        in_position = positions[edge['_in']]
+        label = label_index[edge['_label']]
+        rows.extend([out_position, label, in_position])
+        out_lists[label][out_position].append(in_position)
+        in_lists[label][in_position].append(out_position)
+    heap = bytearray()
+    string_offsets = array.array("I")
+    for value in sorted(strings, key=strings.get):
+        string_offsets.append(len(heap))
+        heap.extend(value.encode('utf8'))
+    string_offsets.append(len(heap))
+    meta = {}
+    meta['_photo'] = export['_photo']
+    meta['_totals'] = export['_totals']
+    meta['columns'] = columns
+    meta['fields'] = fields
+    meta['kinds'] = []
+    start = 0
+    for (kind, count) in kinds:
+        meta['kinds'].append([kind, start, count])
+        start = start + count
+    meta['labels'] = labels
+    sections = []
+    sections.append(("meta", json.dumps(meta, ensure_ascii=False, sort_keys=True).encode('utf8')))
+    sections.append(("strings", little_endian(string_offsets)))
+    sections.append(("heap", bytes(heap)))
+    sections.append(("ids", little_endian(ids)))
+    sections.append(("columns", little_endian(column_data)))
+    sections.append(("extras.off", little_endian(extras_offsets)))
+    sections.append(("extras", little_endian(extras)))
+    sections.append(("edges", little_endian(rows)))
+    for number in range(len(labels)):
+        for (direction, lists) in [("out", out_lists), ("in", in_lists)]:
+            (offsets, targets) = sparse_rows(lists[number])
+            sections.append(("%s.%d.off" % (direction, number), little_endian(offsets)))
+            sections.append(("%s.%d" % (direction, number), little_endian(targets)))
+    offset = aligned(HEADER.size + ENTRY.size * len(sections))
+    directory = [HEADER.pack(MAGIC, FORMAT, len(sections))]
+    for (name, content) in sections:
+        directory.append(ENTRY.pack(name.encode('ascii'), offset, len(content)))
+        offset = aligned(offset + len(content))
+    with open(destpath, 'wb') as wfh:
+        wfh.write(b"".join(directory))
+        for (name, content) in sections:
+            wfh.write(b"\0" * (aligned(wfh.tell()) - wfh.tell()))
+            wfh.write(content)
+        return wfh.tell()
+
+def aligned(offset):
+    """Round an offset up to the next multiple of 8 bytes."""
+    return (offset + 7) // 8 * 8
+
+def little_endian(values):
+    """The bytes of an array of numbers, in little-endian order."""
+    if sys.byteorder != "little":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def sparse_rows(lists):
+    """Compressed sparse rows for a list of lists: offsets, and their contents."""
+    offsets = array.array("I", [0])
+    targets = array.array("I")
+    for neighbors in lists:
+        targets.extend(neighbors)
+        offsets.append(len(targets))
+    return (offsets, targets)
@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+
+# Synthetic dataset generator for the Red Panda Lineage scripts. It writes
+# made-up zoos, wild locations, pandas, and group photos in the same folder
+# layout and file format as the real dataset, at whatever size is asked for,
+# so that we can measure how build.py and manage.py scale.
+#
+# The generated families follow the rules build.py checks: parents are born
+# well before their children and are alive when they're born, litter-mates
+# share a birthday, and every panda lives in a zoo folder that matches its
+# zoo id. Generating with the same size and seed gives the same files.
+
+import argparse
+import bisect
+import datetime
+import os
+import random
+
+from datafile import sorted_fields, write_fields
+from shared import MEDIA_PATH, PANDA_PATH, WILD_PATH, ZOO_PATH
+
+COUNTRIES = ["australia", "china", "france", "germany", "japan",
+             "netherlands", "united-kingdom", "united-states"]
+END_DATE = datetime.date(2024, 1, 1)
+START_DATE = datetime.date(1995, 1, 1)
+# Name sounds in romaji and katakana
+SYLLABLES = [("a", "ア"), ("chi", "チ"), ("ha", "ハ"), ("ka", "カ"),
+             ("ki", "キ"), ("ko", "コ"), ("ma", "マ"), ("mi", "ミ"),
+             ("mo", "モ"), ("na", "ナ"), ("no", "ノ"), ("ri", "リ"),
+             ("ru", "ル"), ("sa", "サ"), ("shi", "シ"), ("ta", "タ"),
+             ("to", "ト"), ("yu", "ユ")]
+TAGS = ["baby", "bamboo", "profile", "sleeping", "smile", "tree"]
+# The real dataset's wild locations, as written by the generator
+WILD_LOCATIONS = [
+    ("wild.1", "capture", "Captured Wild Animal"),
+    ("wild.2", "living", "Living Wild Animal")
+]
+
+class SyntheticDataset:
+    """Builds the entities of a made-up dataset, then writes them out as files.
+
+    Pandas are generated in birth order. The first few are founders with no
+    known parents, and everyone after that is born into a litter with a
+    mother and father chosen from the adult pandas alive at the time.
+    """
+    def __init__(self, animals, seed=1):
+        self.animals = animals
+        self.authors = ["author_%d" % i for i in range(max(20, animals // 20))]
+        self.birthdays = []
+        self.media = []
+        self.pandas = []
+        self.random = random.Random(seed)
+        self.zoos = []
+
+    def author(self):
+        """Pick a photo author, favoring a few very active ones."""
+        return self.authors[int(len(self.authors) * self.random.random() ** 3)]
+
+    def generate(self):
+        """Make up every zoo, panda, and group photo in the dataset."""
+        for zoo_id in range(1, max(5, self.animals // 5) + 1):
+            zoo = {}
+            zoo['country'] = self.random.choice(COUNTRIES)
+            zoo['id'] = zoo_id
+            zoo['name'] = self.name()[0] + " Zoo"
+            self.zoos.append(zoo)
+        founders = max(10, self.animals // 20)
+        days = (END_DATE - START_DATE).days - 365
+        while len(self.pandas) < self.animals:
+            # Births are spread evenly over the whole time span
+            birthday = START_DATE + datetime.timedelta(
+                days=days * len(self.pandas) // self.animals)
+            parents = None
+            if len(self.pandas) >= founders:
+                parents = self.pick_parents(birthday)
+            size = self.random.choice([1, 1, 2, 2, 3])
+            size = min(size, self.animals - len(self.pandas))
+            litter = [self.new_panda(birthday, parents) for _ in range(size)]
+            for panda in litter:
+                panda['litter'] = [p['id'] for p in litter if p is not panda]
+        for panda in self.pandas:
+            if (len(panda['litter']) > 0 and len(panda['locations']) > 0 and
+                self.random.random() < 0.1):
+                self.new_media([panda] + [self.pandas[i - 1] for i in panda['litter']])
+
+    def name(self):
+        """A made-up name, in English and in Japanese katakana."""
+        sounds = [self.random.choice(SYLLABLES) for _ in range(self.random.randint(2, 4))]
+        return ("".join(s[0] for s in sounds).capitalize(), "".join(s[1] for s in sounds))
+
+    def new_media(self, pandas):
+        """A group photo of some pandas, filed under the first one's zoo."""
+        media = {}
+        media['id'] = len(self.media) + 1
+        media['pandas'] = pandas
+        media['photos'] = [self.new_photo()]
+        media['zoo'] = pandas[0]['locations'][0][0]
+        self.media.append(media)
+
+    def new_panda(self, birthday, parents):
+        """Add one panda born on a given day, to the given parents."""
+        panda = {}
+        panda['birthday'] = birthday
+        panda['children'] = []
+        panda['death'] = None
+        panda['gender'] = self.random.choice(["f", "m"])
+        panda['id'] = len(self.pandas) + 1
+        panda['name'] = self.name()
+        panda['photos'] = [self.new_photo() for _ in range(self.random.randint(0, 4))]
+        panda['species'] = self.random.choice(["1", "2", "2"])
+        panda['wild'] = None
+        lifespan = datetime.timedelta(days=self.random.randint(5 * 365, 18 * 365))
+        if birthday + lifespan < END_DATE:
+            panda['death'] = birthday + lifespan
+        if parents == None:
+            birthplace = self.random.choice(self.zoos)['id']
+            if self.random.random() < 0.1:
+                birthplace = "wild.1"
+        else:
+            (mother, father) = parents
+            mother['children'].append(panda['id'])
+            father['children'].append(panda['id'])
+            birthplace = self.zoo_at(mother, birthday)
+        panda['birthplace'] = birthplace
+        # Where the panda lived and when it moved there. Wild-born founders
+        # start out in a zoo, and a few pandas are never captured at all.
+        panda['locations'] = []
+        if birthplace == "wild.1":
+            if self.random.random() < 0.1:
+                panda['wild'] = "wild.2"
+            else:
+                panda['locations'].append((self.random.choice(self.zoos)['id'], birthday))
+        else:
+            panda['locations'].append((birthplace, birthday))
+        moved = birthday
+        for _ in range(self.random.randint(0, 2)):
+            if panda['wild'] != None:
+                break
+            moved = moved + datetime.timedelta(days=self.random.randint(300, 1500))
+            if moved >= END_DATE or (panda['death'] != None and moved >= panda['death']):
+                break
+            panda['locations'].append((self.random.choice(self.zoos)['id'], moved))
+        self.birthdays.append(birthday)
+        self.pandas.append(panda)
+        return panda
+
+    def new_photo(self):
+        """A made-up photo, its author, and maybe some tags."""
+        photo = {}
+        photo['author'] = self.author()
+        photo['tags'] = self.random.sample(TAGS, self.random.randint(0, 2))
+        photo['url'] = "https://www.instagram.com/p/%011x/media/?size=m" % self.random.getrandbits(44)
+        return photo
+
+    def pick_parents(self, birthday):
+        """A mother and father who were adults and alive on a birthday, if any.
+
+        Parents are sampled from the pandas born two to fifteen years before,
+        so that picking them takes the same time however big the dataset is.
+        """
+        oldest = bisect.bisect_left(self.birthdays, birthday - datetime.timedelta(days=15 * 365))
+        youngest = bisect.bisect_right(self.birthdays, birthday - datetime.timedelta(days=2 * 365))
+        if youngest <= oldest:
+            return None
+        mother = None
+        father = None
+        for _ in range(50):
+            panda = self.pandas[self.random.randrange(oldest, youngest)]
+            if panda['wild'] != None:
+                continue
+            if panda['death'] != None and panda['death'] <= birthday:
+                continue
+            if panda['gender'] == "f" and mother == None:
+                mother = panda
+            elif panda['gender'] == "m" and father == None:
+                father = panda
+            if mother != None and father != None:
+                return (mother, father)
+        return None
+
+    def write(self, root):
+        """Write the dataset's files under a folder, in the real layout."""
+        zoo_folders = {}
+        for zoo in self.zoos:
+            folder = os.path.join(zoo['country'], "%04d_%s" % (zoo['id'], slug(zoo['name'])))
+            zoo_folders[zoo['id']] = folder
+            fields = {}
+            fields['_id'] = str(zoo['id'])
+            fields['en.location'] = zoo['country'].replace("-", " ").title()
+            fields['en.name'] = zoo['name']
+            fields['flag'] = zoo['country'].replace("-", " ").title()
+            fields['language.order'] = "en, jp"
+            fields['website'] = "https://example.com/zoos/%d" % zoo['id']
+            add_photos(fields, [self.new_photo() for _ in range(self.random.randint(0, 3))])
+            write_data_file(os.path.join(root, ZOO_PATH, folder + ".txt"), "zoo", fields)
+        for (wild_id, kind, name) in WILD_LOCATIONS:
+            fields = {}
+            fields['_id'] = wild_id
+            fields['en.location'] = "China"
+            fields['en.name'] = name
+            fields['flag'] = "China"
+            fields['language.order'] = "en"
+            write_data_file(os.path.join(root, WILD_PATH, "china", "%s_%s.txt" % (wild_id, kind)),
+                            "wild", fields)
+        for panda in self.pandas:
+            fields = {}
+            fields['_id'] = str(panda['id'])
+            fields['birthday'] = format_date(panda['birthday'])
+            fields['birthplace'] = str(panda['birthplace'])
+            fields['children'] = id_list(panda['children'])
+            if panda['death'] != None:
+                fields['death'] = format_date(panda['death'])
+            fields['en.name'] = panda['name'][0]
+            fields['en.nicknames'] = "none"
+            fields['gender'] = panda['gender']
+            fields['jp.name'] = panda['name'][1]
+            fields['language.order'] = "en, jp"
+            fields['litter'] = id_list(panda['litter'])
+            for number, (zoo_id, moved) in enumerate(panda['locations'], start=1):
+                fields['location.%d' % number] = "%d, %s" % (zoo_id, format_date(moved))
+            fields['species'] = panda['species']
+            add_photos(fields, panda['photos'])
+            if panda['wild'] != None:
+                fields['wild'] = panda['wild']
+                folder = os.path.join("china", "%s_living" % panda['wild'])
+            else:
+                zoo_id = panda['locations'][-1][0]
+                fields['zoo'] = str(zoo_id)
+                folder = zoo_folders[zoo_id]
+            filename = "%04d_%s.txt" % (panda['id'], slug(panda['name'][0]))
+            write_data_file(os.path.join(root, PANDA_PATH, folder, filename), "panda", fields)
+        for media in self.media:
+            fields = {}
+            fields['_id'] = "media.%d.%d" % (media['zoo'], media['id'])
+            fields['panda.tags'] = id_list(p['id'] for p in media['pandas'])
+            add_photos(fields, media['photos'])
+            filename = "group_%d.txt" % media['id']
+            write_data_file(os.path.join(root, MEDIA_PATH, zoo_folders[media['zoo']], filename),
+                            "media", fields)
+
+    def zoo_at(self, panda, date):
+        """The zoo a panda was living at on a given date."""
+        zoo_id = panda['locations'][0][0]
+        for (location, moved) in panda['locations']:
+            if moved <= date:
+                zoo_id = location
+        return zoo_id
+
+
+def add_photos(fields, photos):
+    """Add numbered photo fields, like photo.1 and photo.1.author."""
+    for number, photo in enumerate(photos, start=1):
+        fields['photo.%d' % number] = photo['url']
+        fields['photo.%d.author' % number] = photo['author']
+        fields['photo.%d.link' % number] = "https://www.instagram.com/%s/" % photo['author']
+        if len(photo['tags']) > 0:
+            fields['photo.%d.tags' % number] = ", ".join(photo['tags'])
+
+def format_date(date):
+    """Dates are written YYYY/M/D, like the real data files."""
+    return "%d/%d/%d" % (date.year, date.month, date.day)
+
+def id_list(ids):
+    """A comma-separated list of ids, or none."""
+    output = ", ".join(str(i) for i in ids)
+    if output == "":
+        return "none"
+    return output
+
+def slug(name):
+    """Lowercase a name for use in a file name."""
+    return name.lower().replace(" ", "-")
+
+def write_data_file(path, section, fields):
+    """Write a data file, creating its folder if needed."""
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path, 'w', encoding='utf-8') as wfh:
+        write_fields(wfh, section, sorted_fields(fields))
+
+def generate_dataset(root, animals, seed=1):
+    """Write a synthetic dataset with a number of pandas under a folder."""
+    dataset = SyntheticDataset(animals, seed)
+    dataset.generate()
+    dataset.write(root)
+    return dataset
+
+if __name__ == '__main__':
+    """Write a synthetic dataset to a folder."""
+    parser = argparse.ArgumentParser(description="Generate a synthetic Red Panda Lineage dataset.")
+    parser.add_argument("--animals", type=int, default=1000,
+                        help="how many pandas to generate")
+    parser.add_argument("--seed", type=int, default=1,
+                        help="random seed, so the same dataset can be made again")
+    parser.add_argument("destination",
+                        help="folder to write the zoos, wild, pandas, and media folders to")
+    args = parser.parse_args()
+    dataset = generate_dataset(args.destination, args.animals, args.seed)
+    print("Generated %d pandas, %d zoos, and %d group photos in %s"
+          % (len(dataset.pandas), len(dataset.zoos), len(dataset.media), args.destination))
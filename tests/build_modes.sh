@@ -0,0 +1,29 @@
+#!/bin/sh
+
+# Checks that parallel and incremental builds export exactly what a plain
+# serial build does. The incremental build is run twice: once with no cache,
+# and once replaying every file from the cache the first run wrote.
+
+set -e
+
+SERIAL=$(mktemp)
+trap 'rm -f $SERIAL .build_cache.json' EXIT
+
+./build.py > /dev/null
+cp export/redpanda.json $SERIAL
+
+check() {
+  if ! cmp export/redpanda.json $SERIAL; then
+    echo "ERROR: $1 build differs from the serial build"
+    exit 1
+  fi
+  echo "OK: $1 build matches the serial build"
+}
+
+./build.py --jobs 2 > /dev/null
+check "--jobs 2"
+rm -f .build_cache.json
+./build.py --incremental > /dev/null
+check "cold --incremental"
+./build.py --incremental > /dev/null
+check "warm --incremental"
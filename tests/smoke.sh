@@ -0,0 +1,50 @@
+#!/bin/sh
+
+# Smoke test for the lineage query service. Serves the dataset twice, once
+# built from the data files and once loaded from a snapshot, and checks that
+# both answer a handful of queries, with the same responses.
+
+set -e
+
+BUILT_PORT=8001
+SNAPSHOT_PORT=8002
+
+./build.py --snapshot > /dev/null
+python3 serve.py --port $BUILT_PORT > /dev/null &
+BUILT_PID=$!
+python3 serve.py --snapshot export/redpanda.snapshot --port $SNAPSHOT_PORT > /dev/null &
+SNAPSHOT_PID=$!
+trap 'kill $BUILT_PID $SNAPSHOT_PID; rm -f export/redpanda.snapshot' EXIT
+
+# Building the graph takes a few seconds before the port opens
+for port in $BUILT_PORT $SNAPSHOT_PORT; do
+  tries=0
+  until curl -s -o /dev/null http://127.0.0.1:$port/pandas/1; do
+    tries=$((tries + 1))
+    if [ $tries -gt 120 ]; then
+      echo "ERROR: query service on port $port never started"
+      exit 1
+    fi
+    sleep 0.5
+  done
+done
+
+for query in "/pandas/4" "/pandas/4/parents" "/pandas/4/children" \
+             "/pandas/4/siblings" "/pandas?name=lychee" "/zoos/1" \
+             "/zoos/1/residents" "/zoos?name=ichikawa" \
+             "/photos?author=takashi_8310iyo"; do
+  built=$(curl -sf "http://127.0.0.1:$BUILT_PORT$query")
+  loaded=$(curl -sf "http://127.0.0.1:$SNAPSHOT_PORT$query")
+  if [ "$built" = "[]" ] || [ "$built" != "$loaded" ]; then
+    echo "ERROR: $query: snapshot and build answers differ, or are empty"
+    exit 1
+  fi
+  echo "OK: $query"
+done
+
+status=$(curl -s -o /dev/null -w "%{http_code}" "http://127.0.0.1:$SNAPSHOT_PORT/pandas/99999")
+if [ "$status" != "404" ]; then
+  echo "ERROR: /pandas/99999: expected 404, got $status"
+  exit 1
+fi
+echo "OK: /pandas/99999 is 404"
@@ -0,0 +1,142 @@
+# Validation reports for the Red Panda Lineage dataset.
+#
+# By default, build.py stops at the first data file or dataset check that
+# fails. With --all-errors, it keeps going instead, and every error is added
+# to a report: the file and field it was found in (where there is one), the
+# error class, and the message. Errors from checks across the dataset have no
+# single file, but list the files of every panda involved in "paths". The
+# report is printed, and written as JSON for CI tools to read:
+#
+#   {
+#     "count": 2,
+#     "errors": [
+#       {"class": "GenderFormatError", "field": "gender",
+#        "message": "ERROR: ./pandas/...: unsupported gender: x",
+#        "path": "./pandas/japan/0001_ichikawa/0747_seisei.txt",
+#        "paths": ["./pandas/japan/0001_ichikawa/0747_seisei.txt"]},
+#       {"class": "DateConsistencyError", "field": null,
+#        "message": "ERROR: inconsistent family dates: ...", "path": null,
+#        "paths": ["./pandas/japan/...", "./pandas/japan/..."]}
+#     ],
+#     "warnings": [
+#       {"class": "LocationWarning", "field": null,
+#        "message": "WARNING: Seisei (747) location.2 is ...",
+#        "path": "./pandas/japan/0001_ichikawa/0747_seisei.txt",
+#        "paths": ["./pandas/japan/0001_ichikawa/0747_seisei.txt"]}
+#     ]
+#   }
+#
+# Only data errors (shared.DataError) are collected. Anything else is a bug
+# in the build, and stops it whether or not --all-errors is given. Warnings
+# are always printed and recorded, but never fail the build.
+#
+# A file that can't be read at all is left out of the graph, while a field
+# that fails its checks is left out of its file's vertex, so later checks may
+# report errors that follow from earlier ones.
+
+import json
+
+from shared import DataError
+
+class Check:
+    """Reports the error that stops a block of checks; see Report.check."""
+    def __init__(self, report, path, field):
+        self.field = field
+        self.path = path
+        self.report = report
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        if self.report == None or not isinstance(error, DataError):
+            return False
+        self.report.fail(error, self.path, self.field)
+        return True
+
+class Report:
+    """Collects the errors and warnings found while building the dataset.
+
+    A fail-fast report, the default, raises each error as soon as it's
+    found, so the build stops just as it would without a report.
+    """
+    def __init__(self, collect=False):
+        self.collect = collect
+        self.errors = []
+        self.warnings = []
+
+    def check(self, path=None, field=None):
+        """A context for a block of checks, reporting the error if one fails.
+
+        Fail-fast reports hand back one shared context that does nothing,
+        since builds check every field of every file this way.
+        """
+        if not self.collect:
+            return UNCHECKED
+        return Check(self, path, field)
+
+    def fail(self, error, path=None, field=None):
+        """Report an error, or raise it if this report is fail-fast.
+
+        Errors that aren't data errors are always raised.
+        """
+        if not self.collect or not isinstance(error, DataError):
+            raise error
+        self.errors.append(entry(type(error).__name__, message(error), path, field,
+                                 error.paths))
+
+    def summary(self):
+        """The warnings and errors as text, one per line, with counts at the end."""
+        lines = []
+        for found in self.warnings + self.errors:
+            where = []
+            if found['path'] != None:
+                where.append(found['path'])
+            elif len(found['paths']) > 0:
+                where.append(", ".join(found['paths']))
+            if found['field'] != None:
+                where.append(found['field'])
+            lines.append("%s [%s] %s" % (found['class'], ": ".join(where) or "dataset",
+                                         found['message']))
+        if len(self.warnings) > 0:
+            lines.append("%d warnings found" % len(self.warnings))
+        lines.append("%d errors found" % len(self.errors))
+        return "\n".join(lines)
+
+    def warn(self, kind, text, path=None, field=None):
+        """Print a warning, and record it. Warnings never stop the build."""
+        print(text)
+        self.warnings.append(entry(kind, text, path, field))
+
+    def write(self, destpath):
+        """Write the errors out as JSON."""
+        report = {}
+        report['count'] = len(self.errors)
+        report['errors'] = self.errors
+        report['warnings'] = self.warnings
+        with open(destpath, 'w', encoding='utf-8') as wfh:
+            json.dump(report, wfh, ensure_ascii=False, indent=2, sort_keys=True)
+            wfh.write("\n")
+
+def entry(kind, text, path, field, paths=None):
+    """A report entry for one error or warning.
+
+    The paths are every file involved. They default to just the one file,
+    if there is one.
+    """
+    if paths == None or len(paths) == 0:
+        paths = [path] if path != None else []
+    found = {}
+    found['class'] = kind
+    found['field'] = field
+    found['message'] = text
+    found['path'] = path
+    found['paths'] = paths
+    return found
+
+def message(error):
+    """An error's message, without the quotes KeyError adds."""
+    return error.args[0] if len(error.args) > 0 else repr(error)
+
+# Context for fail-fast reports, letting errors through
+UNCHECKED = Check(None, None, None)